@@ -0,0 +1,546 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SERVER_DIR = os.path.join(REPO_DIR, "server", "src")
+sys.path.insert(0, os.path.join(REPO_DIR, "client", "src"))
+
+from client import FTP_CLIENT  # noqa: E402
+
+UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+THROTTLE_CHUNK = 64 * 1024  # 限速时每次收发的最大字节数
+
+
+def parse_size(text):
+    """把 "64K"、"16M"、"2G" 这样的大小转换为字节数"""
+    text = text.strip().upper().rstrip("B")
+    unit = text[-1:] if text[-1:] in UNITS else ""
+    return int(float(text[:len(text) - len(unit)]) * UNITS[unit])
+
+
+def parse_list(text, convert=int):
+    return [convert(item) for item in text.split(",") if item.strip()]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def text_block(size, seed=0):
+    """size 字节类似访问日志的 CSV 文本，用于测试 MODE Z"""
+    rng = random.Random(seed)
+    paths = ["/api/v1/items", "/api/v1/users", "/static/app.js", "/index.html", "/login", "/api/v2/orders"]
+    lines = []
+    length = 0
+    while length < size:
+        line = (f"2026-10-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:"
+                f"{rng.randint(0, 59):02d},10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)},"
+                f"GET {rng.choice(paths)}/{rng.randint(1, 99999)},{rng.choice((200, 200, 200, 304, 404))},"
+                f"{rng.randint(100, 99999)}\n")
+        lines.append(line)
+        length += len(line)
+    return "".join(lines).encode()[:size]
+
+
+class ThrottledSocket:
+    """按固定速率收发的数据连接，模拟带宽有限的网络
+
+    回环地址的带宽远高于压缩的速度，MODE Z 在这里只会变慢；限速之后才能看出压缩节省的传输时间。
+    只包装 recv_into 和 sendall，其它属性直接转发给原来的套接字。
+    """
+
+    def __init__(self, sock, rate):
+        self.sock = sock
+        self.rate = rate  # 字节/秒
+        self.start = time.perf_counter()
+        self.moved = 0
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def wait(self, count):
+        self.moved += count
+        delay = self.moved / self.rate - (time.perf_counter() - self.start)
+        if delay > 0:
+            time.sleep(delay)
+
+    def recv_into(self, buffer, nbytes=0):
+        read = self.sock.recv_into(buffer, min(nbytes or len(buffer), THROTTLE_CHUNK))
+        self.wait(read)
+        return read
+
+    def sendall(self, data):
+        view = memoryview(data).cast("B")
+        for start in range(0, len(view), THROTTLE_CHUNK):
+            chunk = view[start:start + THROTTLE_CHUNK]
+            self.sock.sendall(chunk)
+            self.wait(len(chunk))
+
+
+def summarize(samples):
+    """时间样本（秒）的统计值，单位毫秒"""
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "min_ms": ordered[0] * 1000,
+        "median_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "mean_ms": statistics.mean(ordered) * 1000,
+    }
+
+
+class BenchmarkServer:
+    """在回环地址的空闲端口上启动一个服务器，根目录是一个临时目录"""
+
+    def __init__(self, kind, binary=None):
+        self.kind = kind
+        self.binary = binary or os.path.join(SERVER_DIR, "server")
+        self.root_dir = tempfile.mkdtemp(prefix="ftpbench-root-")
+        self.port = free_port()
+        self.process = None
+
+    def start(self, timeout=10):
+        # 用户文件和校验和缓存也放在临时目录中，不读写服务器默认的文件
+        databases = ["-userdb", os.path.join(self.root_dir, ".users.txt"),
+                     "-hashdb", os.path.join(self.root_dir, ".hashes.txt")]
+        if self.kind == "c":
+            if not os.path.exists(self.binary):
+                subprocess.run(["make", "-C", SERVER_DIR], check=True, stdout=subprocess.DEVNULL)
+            command = [self.binary, "-port", str(self.port), "-root", self.root_dir] + databases
+            env = None
+        else:
+            command = [sys.executable, "-m", "ftpserver", "-port", str(self.port), "-root", self.root_dir] + databases
+            env = dict(os.environ, PYTHONPATH=SERVER_DIR)
+        # 服务器的调试输出很多，全部丢弃，避免输出本身影响测量结果
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=1) as s:
+                    if s.recv(1024).startswith(b"220"):
+                        return self
+            except OSError:
+                time.sleep(0.05)
+        self.stop()
+        raise RuntimeError(f"server did not start on port {self.port}")
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+
+    def create_file(self, name, size, content="random"):
+        """在服务器根目录下生成 size 字节的测试文件（重复写入同一个 1 MiB 的块）
+
+        content 为 "random"（随机数据，无法压缩）或 "text"（类似日志的文本，容易压缩）。
+        """
+        block = text_block(min(size, 1 << 20)) if content == "text" else os.urandom(min(size, 1 << 20))
+        with open(os.path.join(self.root_dir, name), "wb") as f:
+            remaining = size
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+        return name
+
+
+class Benchmark:
+    def __init__(self, server, username, password, repeat=3, timeout=60):
+        self.server = server
+        self.template = FTP_CLIENT("127.0.0.1", server.port)
+        self.template.username = username
+        self.template.password = password
+        self.repeat = repeat
+        self.timeout = timeout  # 单次操作的套接字超时（秒），避免服务器卡住时测试挂起
+        self.link_rate = None  # 不为 None 时数据连接按这个速率（字节/秒）限速
+        self.work_dir = tempfile.mkdtemp(prefix="ftpbench-local-")
+
+    def close(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def open_session(self, buffer_size=1 << 20):
+        self.template.buffer_size = buffer_size
+        session = self.template.open_session()
+        session.control_socket.settimeout(self.timeout)
+        return session
+
+    def quit(self, session):
+        try:
+            session.send_command("QUIT")
+            session.receive_response()
+        except OSError:
+            pass
+        session.close()
+
+    def open_data(self, session, mode):
+        """按 mode（"pasv" 或 "port"）准备数据连接"""
+        if mode == "port":
+            port = free_port()
+            ok = session.enter_port_mode(f"PORT 127,0,0,1,{port // 256},{port % 256}")
+        else:
+            ok = session.enter_pasv_mode()
+        if not ok:
+            raise ConnectionError(f"{mode.upper()} failed")
+
+    def finish_data(self, session, data_socket):
+        data_socket.close()
+        if session.active_mode and session.data_socket:
+            session.data_socket.close()
+            session.data_socket = None
+        session.active_mode = False
+        session.pasv_mode = False
+        response = session.receive_response()
+        if not response.startswith("226"):
+            raise ConnectionError(response)
+
+    def retr(self, session, filename, mode):
+        """下载到内存中丢弃，只测量协议和服务器的开销，返回接收的字节数"""
+        self.open_data(session, mode)
+        session.send_command(f"RETR {filename}")
+        response = session.receive_response()
+        if not response.startswith(("150", "125")):
+            raise ConnectionError(response)
+        data_socket = session.data_connect(self.timeout)
+        if data_socket is None:
+            raise ConnectionError("data connection failed")
+        data_socket.settimeout(self.timeout)
+        if self.link_rate:
+            data_socket = ThrottledSocket(data_socket, self.link_rate)
+        received = session.recv_stream(data_socket, lambda chunk: None)
+        self.finish_data(session, data_socket)
+        return received
+
+    def stor(self, session, local_path, mode):
+        self.open_data(session, mode)
+        session.send_command(f"STOR {os.path.basename(local_path)}")
+        response = session.receive_response()
+        if not response.startswith(("150", "125")):
+            raise ConnectionError(response)
+        data_socket = session.data_connect(self.timeout)
+        if data_socket is None:
+            raise ConnectionError("data connection failed")
+        if self.link_rate:
+            # 带超时的套接字不使用 os.sendfile，所有数据都经过 ThrottledSocket.sendall
+            data_socket.settimeout(self.timeout)
+            data_socket = ThrottledSocket(data_socket, self.link_rate)
+        with open(local_path, "rb") as f:
+            sent, method = session.send_file(data_socket, f)
+        self.finish_data(session, data_socket)
+        return sent
+
+    def list(self, session, directory):
+        """LIST 目录，返回列表的行数"""
+        self.open_data(session, "pasv")
+        session.send_command(f"LIST {directory}")
+        response = session.receive_response()
+        if not response.startswith(("150", "125")):
+            raise ConnectionError(response)
+        data_socket = session.data_connect(self.timeout)
+        if data_socket is None:
+            raise ConnectionError("data connection failed")
+        data_socket.settimeout(self.timeout)
+        data = bytearray()
+        session.recv_stream(data_socket, data.extend)
+        self.finish_data(session, data_socket)
+        return sum(1 for line in data.splitlines() if line and not line.lower().startswith(b"total"))
+
+    # ---------- 测试项目 ----------
+
+    def bench_login(self, count):
+        """连接 + 登录 + QUIT 的延迟"""
+        samples = []
+        for _ in range(count):
+            start = time.perf_counter()
+            session = self.open_session()
+            samples.append(time.perf_counter() - start)
+            self.quit(session)
+        return summarize(samples)
+
+    def bench_transfer(self, sizes, buffers, modes):
+        """RETR/STOR 吞吐量：文件大小 × 缓冲区大小 × PASV/PORT"""
+        results = []
+        for size in sizes:
+            remote = self.server.create_file(f"retr-{size}.bin", size)
+            local = os.path.join(self.work_dir, f"stor-{size}.bin")
+            shutil.copyfile(os.path.join(self.server.root_dir, remote), local)
+            for buffer_size in buffers:
+                for mode in modes:
+                    for command in ("RETR", "STOR"):
+                        samples = []
+                        session = self.open_session(buffer_size)
+                        try:
+                            for _ in range(self.repeat):
+                                start = time.perf_counter()
+                                if command == "RETR":
+                                    moved = self.retr(session, remote, mode)
+                                else:
+                                    moved = self.stor(session, local, mode)
+                                samples.append(time.perf_counter() - start)
+                                if moved != size:
+                                    raise ConnectionError(f"{command} moved {moved} of {size} bytes")
+                        finally:
+                            self.quit(session)
+                        result = {"command": command, "size": size, "buffer": buffer_size, "mode": mode}
+                        result.update(summarize(samples))
+                        result["best_mb_s"] = size / min(samples) / 1e6
+                        result["median_mb_s"] = size / statistics.median(samples) / 1e6
+                        results.append(result)
+                        print(f"[INFO] {command} {size} bytes buffer={buffer_size} {mode}: "
+                              f"{result['median_mb_s']:.1f} MB/s", file=sys.stderr)
+            os.remove(os.path.join(self.server.root_dir, remote))
+            os.remove(local)
+        return results
+
+    def bench_compression(self, size, contents, levels, link_mbps=0):
+        """MODE Z 的效果：文本和随机数据分别用 MODE S 和各个压缩级别的 MODE Z 传输
+
+        记录数据连接上实际传输的字节数和压缩率；link_mbps 不为 0 时把数据连接限速到这个带宽（Mbit/s），
+        模拟广域网，这时 MODE Z 节省的是传输时间，而不只是字节数。
+        """
+        results = []
+        self.link_rate = link_mbps * 1e6 / 8 if link_mbps else None
+        try:
+            for content in contents:
+                remote = self.server.create_file(f"compress-{content}.dat", size, content)
+                local = os.path.join(self.work_dir, f"compress-{content}.dat")
+                shutil.copyfile(os.path.join(self.server.root_dir, remote), local)
+                for level in [None] + levels:
+                    mode = "S" if level is None else f"Z{level}"
+                    for command in ("RETR", "STOR"):
+                        samples = []
+                        session = self.open_session()
+                        try:
+                            if level is not None and not session.set_mode_z(True, level):
+                                raise ConnectionError("MODE Z not supported")
+                            for _ in range(self.repeat):
+                                start = time.perf_counter()
+                                if command == "RETR":
+                                    moved = self.retr(session, remote, "pasv")
+                                else:
+                                    moved = self.stor(session, local, "pasv")
+                                samples.append(time.perf_counter() - start)
+                                if moved != size:
+                                    raise ConnectionError(f"{command} moved {moved} of {size} bytes")
+                        finally:
+                            self.quit(session)
+                        result = {"command": command, "content": content, "mode": mode, "size": size,
+                                  "wire_bytes": session.wire_bytes, "ratio": session.wire_bytes / size,
+                                  "link_mbps": link_mbps}
+                        result.update(summarize(samples))
+                        result["median_mb_s"] = size / statistics.median(samples) / 1e6
+                        results.append(result)
+                        print(f"[INFO] {command} {content} MODE {mode}: {result['ratio'] * 100:.1f}% on the wire, "
+                              f"{result['median_mb_s']:.1f} MB/s", file=sys.stderr)
+                # STOR 的文件名与 RETR 的相同，上传会覆盖服务器上的测试文件，内容不变
+                os.remove(os.path.join(self.server.root_dir, remote))
+                os.remove(local)
+        finally:
+            self.link_rate = None
+        return results
+
+    def bench_list(self, entry_counts):
+        """不同目录大小下 LIST 的延迟"""
+        results = []
+        for count in entry_counts:
+            directory = f"list-{count}"
+            path = os.path.join(self.server.root_dir, directory)
+            os.mkdir(path)
+            for i in range(count):
+                open(os.path.join(path, f"file{i:06d}.dat"), "wb").close()
+            session = self.open_session()
+            samples = []
+            try:
+                for _ in range(self.repeat):
+                    start = time.perf_counter()
+                    lines = self.list(session, directory)
+                    samples.append(time.perf_counter() - start)
+            finally:
+                self.quit(session)
+            result = {"entries": count, "lines": lines}
+            result.update(summarize(samples))
+            results.append(result)
+            print(f"[INFO] LIST {count} entries: {result['median_ms']:.1f} ms", file=sys.stderr)
+            shutil.rmtree(path)
+        return results
+
+    def bench_concurrency(self, client_counts, size):
+        """N 个客户端同时执行 连接 + 登录 + RETR + QUIT，统计总吞吐量和每个会话的延迟"""
+        remote = self.server.create_file("concurrent.bin", size)
+        results = []
+        for clients in client_counts:
+            samples = []
+            errors = []
+            lock = threading.Lock()
+            barrier = threading.Barrier(clients)
+
+            def worker():
+                try:
+                    barrier.wait(self.timeout)
+                    start = time.perf_counter()
+                    session = self.open_session()
+                    try:
+                        moved = self.retr(session, remote, "pasv")
+                    finally:
+                        self.quit(session)
+                    if moved != size:
+                        raise ConnectionError(f"RETR moved {moved} of {size} bytes")
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        samples.append(elapsed)
+                except Exception as e:
+                    with lock:
+                        errors.append(repr(e))
+
+            threads = [threading.Thread(target=worker, daemon=True) for _ in range(clients)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall = time.perf_counter() - start
+            result = {"clients": clients, "size": size, "completed": len(samples), "errors": len(errors),
+                      "wall_s": wall, "aggregate_mb_s": size * len(samples) / wall / 1e6}
+            if samples:
+                result.update(summarize(samples))
+            if errors:
+                result["first_error"] = errors[0]
+            results.append(result)
+            print(f"[INFO] {clients} clients: {len(samples)} ok, {len(errors)} failed, "
+                  f"{result['aggregate_mb_s']:.1f} MB/s", file=sys.stderr)
+        os.remove(os.path.join(self.server.root_dir, remote))
+        return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "-C", REPO_DIR, "rev-parse", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_file, new_file):
+    """按测试项目对比两次结果的中位数延迟，打印变化百分比（负数表示变快）"""
+    with open(old_file) as f:
+        old = json.load(f)["results"]
+    with open(new_file) as f:
+        new = json.load(f)["results"]
+    keys = {
+        "transfer": ("command", "size", "buffer", "mode"),
+        "list": ("entries",),
+        "concurrency": ("clients", "size"),
+        "compression": ("command", "content", "mode", "link_mbps"),
+    }
+    rows = []
+    if "login" in old and "login" in new:
+        rows.append(("login", old["login"], new["login"]))
+    for section, fields in keys.items():
+        before = {tuple(r[k] for k in fields): r for r in old.get(section, [])}
+        for r in new.get(section, []):
+            key = tuple(r[k] for k in fields)
+            if key in before:
+                rows.append((f"{section} {' '.join(str(k) for k in key)}", before[key], r))
+    for name, a, b in rows:
+        if "median_ms" in a and "median_ms" in b:
+            change = (b["median_ms"] - a["median_ms"]) / a["median_ms"] * 100
+            print(f"{name:50s} {a['median_ms']:10.2f} ms -> {b['median_ms']:10.2f} ms  {change:+7.1f}%")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="FTP client/server benchmark")
+    # 被测服务器：C 服务器（server/src/server）或 asyncio 服务器（server/src/ftpserver）
+    parser.add_argument('-server', choices=["c", "python"], default="c")
+    parser.add_argument('-binary', type=str, default=None)
+    parser.add_argument('-user', type=str, default="anonymous")
+    parser.add_argument('-password', type=str, default="anonymous@example.com")
+    parser.add_argument('-sizes', type=str, default="1K,64K,1M,16M,256M")
+    # 客户端数据连接的缓冲区大小（KiB）
+    parser.add_argument('-buffers', type=str, default="64,1024")
+    parser.add_argument('-modes', type=str, default="pasv,port")
+    parser.add_argument('-list-entries', type=str, default="10,1000,10000,100000")
+    parser.add_argument('-clients', type=str, default="1,8,64,512")
+    parser.add_argument('-concurrency-size', type=str, default="1M")
+    # MODE Z：测试文件大小、内容（text、random）、压缩级别，以及模拟的链路带宽（Mbit/s，0 表示不限速）
+    parser.add_argument('-compress-size', type=str, default="16M")
+    parser.add_argument('-compress-content', type=str, default="text,random")
+    parser.add_argument('-compress-levels', type=str, default="1,6")
+    parser.add_argument('-link-mbps', type=float, default=0)
+    parser.add_argument('-logins', type=int, default=50)
+    parser.add_argument('-repeat', type=int, default=3)
+    # 只运行指定的测试项目
+    parser.add_argument('-only', type=str, default="login,transfer,list,concurrency,compression")
+    parser.add_argument('-output', type=str, default=None)
+    # 对比两个结果文件：-compare old.json new.json
+    parser.add_argument('-compare', nargs=2, metavar=("OLD", "NEW"), default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    only = set(parse_list(args.only, str))
+    server = BenchmarkServer(args.server, args.binary).start()
+    bench = Benchmark(server, args.user, args.password, args.repeat)
+    report = {
+        "meta": {
+            "server": args.server,
+            "revision": git_revision(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": {},
+    }
+    results = report["results"]
+    try:
+        if "login" in only:
+            results["login"] = bench.bench_login(args.logins)
+        if "transfer" in only:
+            results["transfer"] = bench.bench_transfer(parse_list(args.sizes, parse_size),
+                                                       [kib * 1024 for kib in parse_list(args.buffers)],
+                                                       parse_list(args.modes, str))
+        if "compression" in only:
+            results["compression"] = bench.bench_compression(parse_size(args.compress_size),
+                                                             parse_list(args.compress_content, str),
+                                                             parse_list(args.compress_levels), args.link_mbps)
+        if "list" in only:
+            results["list"] = bench.bench_list(parse_list(args.list_entries))
+        if "concurrency" in only:
+            results["concurrency"] = bench.bench_concurrency(parse_list(args.clients),
+                                                             parse_size(args.concurrency_size))
+    finally:
+        bench.close()
+        server.stop()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+import asyncio
+import os
+import re  # 用于正则表达式的匹配 提取IP地址和端口号
+import argparse
+import time
+
+
+class AsyncFTPClient:
+    """基于 asyncio 流的 FTP 客户端，命令集与 FTP_CLIENT 相同
+
+    每个会话只占用事件循环中的几个协程，不需要单独的线程，
+    因此一个进程可以在同一个事件循环里同时驱动大量会话和传输。
+    协议错误以 ConnectionError 抛出，异常信息中带有服务器的响应。
+    """
+
+    def __init__(self, server_ip, server_port, buffer_size=1 << 20, verbose=False):
+        self.server_ip = server_ip
+        self.server_port = server_port
+        self.buffer_size = buffer_size
+        self.verbose = verbose  # 为 True 时打印服务器响应
+        self.reader = None
+        self.writer = None
+        self.pasv_ip = None
+        self.pasv_port = None
+        self.active_mode = False  # True: PORT模式
+        self.pasv_mode = False  # True: PASV模式
+        # PORT 模式下的监听服务器，以及等待服务器连入的数据连接
+        self.port_server = None
+        self.port_connections = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.server_ip, self.server_port)
+        return await self.expect("220")
+
+    async def read_reply(self):
+        """读取一条完整的响应（包括 "NNN-" 开头的多行响应）"""
+        line = (await self.reader.readline()).rstrip(b"\r\n")
+        lines = [line]
+        # 多行响应以 "NNN-" 开始，以 "NNN " 结束
+        if len(line) >= 4 and line[:3].isdigit() and line[3:4] == b"-":
+            code = line[:3]
+            while True:
+                raw = await self.reader.readline()
+                if not raw:
+                    break
+                line = raw.rstrip(b"\r\n")
+                lines.append(line)
+                if line[:3] == code and line[3:4] != b"-":
+                    break
+        response = b"\r\n".join(lines).decode('utf-8', errors='replace').strip()
+        if self.verbose:
+            print(response, flush=True)
+        return response
+
+    async def send_command(self, command):
+        self.writer.write(f"{command}\r\n".encode('utf-8'))
+        await self.writer.drain()
+
+    async def expect(self, *codes):
+        """读取一条响应，响应码不在 codes 中时抛出 ConnectionError"""
+        response = await self.read_reply()
+        if not response.startswith(codes):
+            raise ConnectionError(response)
+        return response
+
+    async def command(self, command, *codes):
+        await self.send_command(command)
+        return await self.expect(*codes)
+
+    async def close(self):
+        if self.port_server:
+            self.port_server.close()
+            self.port_server = None
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.writer = None
+
+    async def quit(self):
+        try:
+            response = await self.command("QUIT", "221")
+        finally:
+            await self.close()
+        return response
+
+    async def login(self, username, password):
+        """发送 USER 和 PASS 命令进行登录"""
+        await self.command(f"USER {username}", "331", "230")
+        return await self.command(f"PASS {password}", "230")
+
+    async def pwd(self):
+        """发送 PWD 命令获取当前工作目录"""
+        response = await self.command("PWD", "257")
+        match = re.search(r'"(.+)"', response)
+        return match.group(1) if match else None
+
+    async def cwd(self, directory):
+        return await self.command(f"CWD {directory}", "250")
+
+    async def mkd(self, directory_name):
+        return await self.command(f"MKD {directory_name}", "257")
+
+    async def rmd(self, directory_name):
+        return await self.command(f"RMD {directory_name}", "250")
+
+    async def size(self, filename):
+        response = await self.command(f"SIZE {filename}", "213")
+        return int(response.split()[1])
+
+    async def enter_pasv_mode(self):
+        """进入 PASV 模式（被动模式），之前 PORT 模式的监听不再需要"""
+        if self.port_server:
+            self.port_server.close()
+            self.port_server = None
+        response = await self.command("PASV", "227")
+        match = re.search(r"\((\d+),(\d+),(\d+),(\d+),(\d+),(\d+)\)", response)
+        if not match:
+            raise ConnectionError(f"Unable to parse PASV response: {response}")
+        self.pasv_ip = ".".join(match.groups()[:4])
+        self.pasv_port = int(match.group(5)) * 256 + int(match.group(6))
+        self.pasv_mode = True
+        self.active_mode = False
+        return response
+
+    async def enter_port_mode(self, ip_address, port):
+        """进入 PORT 模式（主动模式）：先在本地开始监听，再把地址通过 PORT 命令告诉服务器"""
+        if self.port_server:
+            self.port_server.close()
+        self.port_connections = asyncio.Queue()
+
+        def on_connect(reader, writer):
+            self.port_connections.put_nowait((reader, writer))
+
+        self.port_server = await asyncio.start_server(on_connect, ip_address, port)
+        return await self.send_port()
+
+    async def send_port(self):
+        """把 PORT 模式监听的地址通过 PORT 命令告诉服务器；服务器每次传输后都会忘记它，所以每次传输前都要重新发送"""
+        ip_address, port = self.port_server.sockets[0].getsockname()[:2]
+        p1, p2 = port // 256, port % 256
+        response = await self.command(f"PORT {ip_address.replace('.', ',')},{p1},{p2}", "200")
+        self.active_mode = True
+        self.pasv_mode = False
+        return response
+
+    async def data_connect(self, timeout=5):
+        """建立数据连接，返回 (reader, writer)"""
+        if self.active_mode:
+            return await asyncio.wait_for(self.port_connections.get(), timeout)
+        if self.pasv_mode:
+            return await asyncio.wait_for(asyncio.open_connection(self.pasv_ip, self.pasv_port), timeout)
+        raise ConnectionError("No active or passive mode set for data connection.")
+
+    async def ensure_data_connection(self):
+        """PORT 模式的监听仍然有效时沿用它重新发送 PORT，否则进入 PASV 模式"""
+        if self.port_server:
+            if not self.active_mode:
+                await self.send_port()
+        else:
+            await self.enter_pasv_mode()
+
+    def finish_transfer(self):
+        # 与 FTP_CLIENT 相同，服务器在每次传输后清除 PORT/PASV，下一次传输前需要重新发送
+        self.pasv_mode = False
+        self.active_mode = False
+
+    async def list_files(self, directory=None):
+        """发送 LIST 命令，返回去掉 total 行之后的列表行"""
+        await self.ensure_data_connection()
+        await self.command(f"LIST {directory}" if directory else "LIST", "150", "125")
+        reader, writer = await self.data_connect()
+        data = bytearray()
+        while True:
+            chunk = await reader.read(self.buffer_size)
+            if not chunk:
+                break
+            data += chunk
+        writer.close()
+        await self.expect("226", "250")
+        self.finish_transfer()
+        lines = data.decode('utf-8', errors='replace').splitlines()
+        return [line.strip() for line in lines if line.strip() and not line.lower().startswith("total")]
+
+    async def retr(self, filename, local_filename=None, resume=False, progress_callback=None):
+        """下载文件；resume 为 True 时从本地已有文件的末尾通过 REST 续传。返回本次接收的字节数"""
+        local_filename = local_filename or filename.split("/")[-1]
+        file_offset = os.path.getsize(local_filename) if resume and os.path.exists(local_filename) else 0
+        await self.ensure_data_connection()
+        if file_offset > 0:
+            await self.command(f"REST {file_offset}", "350")
+        await self.command(f"RETR {filename}", "150", "125")
+        reader, writer = await self.data_connect()
+        received = 0
+        try:
+            with open(local_filename, "ab" if file_offset > 0 else "wb") as f:
+                while True:
+                    chunk = await reader.read(self.buffer_size)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    received += len(chunk)
+                    if progress_callback:
+                        progress_callback(file_offset + received)
+        finally:
+            writer.close()
+        await self.expect("226", "250")
+        self.finish_transfer()
+        return received
+
+    async def stor(self, local_filename, resume=False, progress_callback=None):
+        """上传文件；resume 为 True 时先用 SIZE 查询服务器上已有的长度，再通过 REST 续传。返回本次发送的字节数"""
+        if not os.path.isfile(local_filename):
+            raise FileNotFoundError(local_filename)
+        filename = os.path.basename(local_filename)
+        file_size = os.path.getsize(local_filename)
+        file_offset = 0
+        if resume:
+            try:
+                file_offset = await self.size(filename)
+            except ConnectionError:
+                file_offset = 0
+            if file_offset >= file_size:
+                file_offset = 0
+        await self.ensure_data_connection()
+        if file_offset > 0:
+            await self.command(f"REST {file_offset}", "350")
+        await self.command(f"STOR {filename}", "150", "125")
+        reader, writer = await self.data_connect()
+        try:
+            with open(local_filename, "rb") as f:
+                # loop.sendfile 在支持的平台上使用 os.sendfile 零拷贝发送，否则自动退回到读写循环；
+                # 需要报告进度时与 retr 相同，每 buffer_size 字节报告一次，否则一次发送整个文件
+                loop = asyncio.get_running_loop()
+                count = self.buffer_size if progress_callback else None
+                sent = 0
+                while True:
+                    n = await loop.sendfile(writer.transport, f, file_offset + sent, count)
+                    sent += n
+                    if progress_callback and n:
+                        progress_callback(file_offset + sent)
+                    if count is None or n == 0:
+                        break
+            await writer.drain()
+        finally:
+            writer.close()
+        await self.expect("226", "250")
+        self.finish_transfer()
+        return sent
+
+
+def parse_arguments():
+    # 创建 ArgumentParser 对象
+    parser = argparse.ArgumentParser(description="Async FTP Client")
+
+    parser.add_argument('-ip', type=str, default="127.0.0.1")
+    parser.add_argument('-port', type=int, default=21)
+    parser.add_argument('-user', type=str, default="anonymous")
+    parser.add_argument('-password', type=str, default="anonymous@example.com")
+    # 在同一个事件循环中并发运行的会话数
+    parser.add_argument('-sessions', type=int, default=1)
+    # 每个会话要下载的文件；不指定时每个会话执行一次 LIST
+    parser.add_argument('-retr', type=str, default=None)
+
+    return parser.parse_args()
+
+
+async def run_session(args, index):
+    client = AsyncFTPClient(args.ip, args.port)
+    await client.connect()
+    await client.login(args.user, args.password)
+    if args.retr:
+        local_filename = f"{os.path.basename(args.retr)}.{index}"
+        result = await client.retr(args.retr, local_filename)
+    else:
+        result = len(await client.list_files())
+    await client.quit()
+    return result
+
+
+async def run_sessions(args):
+    start = time.time()
+    results = await asyncio.gather(*(run_session(args, i) for i in range(args.sessions)), return_exceptions=True)
+    elapsed = time.time() - start
+    failed = [r for r in results if isinstance(r, BaseException)]
+    for error in failed[:10]:
+        print(f"[ERROR] {error!r}")
+    print(f"[INFO] {len(results) - len(failed)}/{len(results)} 个会话完成，用时 {elapsed:.2f}s")
+
+
+def main():
+    asyncio.run(run_sessions(parse_arguments()))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,129 @@ import sys
 import re  # 用于正则表达式的匹配 提取IP地址和端口号
 import os
 import argparse
+import threading
+import errno
+import calendar
+import hashlib
+import posixpath
+import zlib
+from collections import namedtuple
+
+from listing_cache import ListingCache
+from progress import ProgressReporter, console_progress
+
+# MODE Z 的压缩实现与 Python 服务器共用 server/src/ftpserver/deflate.py，两端的分帧和级别切换保持一致
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "server", "src"))
+from ftpserver.deflate import ZLIB_DEFAULT_LEVEL, AdaptiveDeflate, is_compressed_name  # noqa: E402
+
+
+def split_ranges(total_size, segments):
+    """把 [0, total_size) 切分成 segments 段，返回 [(起始偏移, 长度)]"""
+    segments = max(1, min(segments, total_size)) if total_size > 0 else 1
+    base, extra = divmod(total_size, segments)
+    ranges = []
+    start = 0
+    for i in range(segments):
+        length = base + (1 if i < extra else 0)
+        ranges.append((start, length))
+        start += length
+    return ranges
+
+
+def run_segments(ranges, worker, retries=2):
+    """为每个分段启动一个线程执行 worker(start, length)，失败的分段最多重试 retries 次
+
+    返回每个分段的状态列表：{"start", "length", "attempts", "done", "error"}
+    """
+    segments = [{"start": start, "length": length, "attempts": 0, "done": False, "error": None}
+                for start, length in ranges]
+
+    def run(segment):
+        while not segment["done"] and segment["attempts"] <= retries:
+            segment["attempts"] += 1
+            try:
+                worker(segment["start"], segment["length"])
+                segment["done"] = True
+                segment["error"] = None
+            except Exception as e:
+                segment["error"] = str(e)
+
+    threads = [threading.Thread(target=run, args=(segment,), daemon=True) for segment in segments]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return segments
+
+
+# MLSD/MLST 返回的一个条目；size 为 None 表示服务器没有给出，modify 为 UTC 时间戳（秒），perm 为权限字母
+MLSXEntry = namedtuple("MLSXEntry", "name type size modify perm")
+
+
+def parse_mlsx_time(value):
+    """把 MLSx 的 modify 值 "YYYYMMDDHHMMSS[.sss]" 转换为 UTC 时间戳，格式不正确时返回 None"""
+    digits, _, fraction = value.partition(".")
+    if len(digits) != 14 or not digits.isdigit():
+        return None
+    timestamp = calendar.timegm((int(digits[0:4]), int(digits[4:6]), int(digits[6:8]),
+                                 int(digits[8:10]), int(digits[10:12]), int(digits[12:14]), 0, 0, 0))
+    return timestamp + float("0." + fraction) if fraction.isdigit() else timestamp
+
+
+def parse_mlsx_line(line):
+    """解析一行 "fact=value;fact=value; name"，返回 MLSXEntry，格式不正确时返回 None
+
+    facts 中不含空格，第一个空格之后的全部内容都是文件名，因此文件名中可以有空格。
+    """
+    facts, sep, name = line.partition(" ")
+    if not sep or not name:
+        return None
+    kind = size = modify = None
+    perm = ""
+    for fact in facts.split(";"):
+        key, eq, value = fact.partition("=")
+        if not eq:
+            continue
+        key = key.lower()
+        if key == "type":
+            kind = value.lower()
+        elif key == "size":
+            size = int(value) if value.isdigit() else None
+        elif key == "modify":
+            modify = parse_mlsx_time(value)
+        elif key == "perm":
+            perm = value.lower()
+    return MLSXEntry(name, kind, size, modify, perm)
+
+
+# HASH 命令的算法名对应的 hashlib 名称（CRC32 用 zlib 计算）和旧式的校验和命令
+HASH_ALGORITHMS = {"SHA-256": ("sha256", "XSHA256"), "SHA-1": ("sha1", "XSHA1"),
+                   "MD5": ("md5", "XMD5"), "CRC32": (None, "XCRC")}
+
+
+def local_checksum(path, algorithm="SHA-256", start=0, end=None):
+    """计算本地文件 [start, end) 的校验和（十六进制小写，与服务器的 HASH 结果格式相同），end 为 None 时到文件末尾"""
+    name = HASH_ALGORITHMS[algorithm][0]
+    digest = hashlib.new(name) if name else None
+    crc = 0
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            data = f.read(1 << 20 if remaining is None else min(1 << 20, remaining))
+            if not data:
+                break
+            if digest is None:
+                crc = zlib.crc32(data, crc)
+            else:
+                digest.update(data)
+            if remaining is not None:
+                remaining -= len(data)
+    return f"{crc:08x}" if digest is None else digest.hexdigest()
+
+
 class FTP_CLIENT:
-    def __init__(self, server_ip, server_port):
+    def __init__(self, server_ip, server_port, buffer_size=1 << 20):
         self.server_ip = server_ip
         self.server_port = server_port
         self.control_socket = None
@@ -16,32 +137,604 @@ class FTP_CLIENT:
         self.pasv_mode = False  # True: PASV模式, False: PORT模式
         # 保存一个输出缓冲区队列
         self.output_buffer = []
+        # 控制连接的接收缓冲区，保存尚未解析成完整响应的字节
+        self.recv_buffer = bytearray()
+        # 登录凭据，用于并行传输时建立额外的会话
+        self.username = None
+        self.password = None
+        self.verbose = True  # 为 False 时不打印服务器响应（用于并行传输的辅助会话）
+        # 记录改变过服务器端会话状态的命令（CWD、REST），连接池归还连接时据此复位
+        self.session_changes = set()
+        # 数据连接复用的传输缓冲区，首次使用时分配
+        self.buffer_size = buffer_size
+        self.transfer_buffer = None
+        # MODE Z：数据连接上的内容经 deflate 压缩；compress_level 为上传时本地的压缩级别，也用 OPTS 告诉服务器
+        self.mode_z = False
+        self.compress_level = ZLIB_DEFAULT_LEVEL
+        self.wire_bytes = 0  # 最近一次传输在数据连接上实际收发的字节数（MODE Z 时为压缩后的字节数）
+        self.hash_algorithm = None  # 已经用 OPTS HASH 选择的算法，None 表示使用服务器的默认值
+        # 已知的远程当前目录（None 表示需要用 PWD 查询）和按绝对路径缓存的目录列表
+        self.current_dir = None
+        self.listing_cache = ListingCache()
 
     def connect(self):
         self.control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.recv_buffer.clear()
         try:
             self.control_socket.connect((self.server_ip, self.server_port))
             self.receive_response()
         except Exception as e:
             sys.exit(1)
 
-    def receive_response(self):
-        response = ""
+    def read_line(self):
+        """从控制连接读取一行（不含行尾的 CRLF），连接关闭且缓冲区为空时返回 None"""
         while True:
-            chunk = self.control_socket.recv(4096).decode('utf-8')
-            response += chunk
-            if not chunk or '\r\n' in chunk:
-                break
-        print(response.strip(), flush=True)
-        return response.strip()
+            index = self.recv_buffer.find(b"\n")
+            if index >= 0:
+                line = bytes(self.recv_buffer[:index]).rstrip(b"\r")
+                del self.recv_buffer[:index + 1]
+                return line
+            chunk = self.control_socket.recv(4096)
+            if not chunk:
+                # 连接已关闭，把剩余的不完整数据作为最后一行返回
+                if not self.recv_buffer:
+                    return None
+                line = bytes(self.recv_buffer).rstrip(b"\r")
+                self.recv_buffer.clear()
+                return line
+            self.recv_buffer += chunk
+
+    def read_reply(self):
+        """读取一条完整的响应（包括 "NNN-" 开头的多行响应），多余的字节留在缓冲区中"""
+        line = self.read_line()
+        if line is None:
+            return ""
+        lines = [line]
+        # 多行响应以 "NNN-" 开始，以 "NNN " 结束
+        if len(line) >= 4 and line[:3].isdigit() and line[3:4] == b"-":
+            code = line[:3]
+            while True:
+                line = self.read_line()
+                if line is None:
+                    break
+                lines.append(line)
+                if line[:3] == code and line[3:4] != b"-":
+                    break
+        return b"\r\n".join(lines).decode('utf-8', errors='replace').strip()
+
+    def receive_response(self):
+        response = self.read_reply()
+        if self.verbose:
+            print(response, flush=True)
+        return response
 
     def send_command(self, command):
+        self.track_command(command)
         command += "\r\n"
         self.control_socket.sendall(command.encode('utf-8'))
 
+    def track_command(self, command):
+        """根据即将发送的命令更新会话状态和缓存（send_command 和 pipeline 共用）"""
+        verb, _, arg = command.partition(" ")
+        if verb.upper() == "USER":
+            self.username = arg
+        elif verb.upper() == "PASS":
+            self.password = arg
+        elif verb.upper() in ("CWD", "CDUP"):
+            self.session_changes.add("CWD")
+            self.current_dir = None
+        elif verb.upper() == "REST":
+            self.session_changes.add("REST")
+        elif verb.upper() in ("RETR", "STOR"):
+            # 服务器在传输开始时消耗掉 REST 偏移量
+            self.session_changes.discard("REST")
+        if verb.upper() in ("MKD", "RMD", "STOR", "DELE"):
+            # 我们自己修改了远程目录，对应的缓存列表不再可信
+            self.invalidate_listing(arg, tree=verb.upper() == "RMD")
+
+    def pipeline(self, commands, window=64):
+        """批量发送命令：每次用一次 sendall 写出一批命令，再按顺序读取对应的响应
+
+        返回与 commands 一一对应的结果列表，每项为 {"command", "response", "ok"}，
+        单条命令失败不影响其余命令。window 限制同时在途的命令数量，
+        避免双方的发送缓冲区都被填满而互相等待。只适用于不需要数据连接的命令（SIZE、CWD、MKD、PWD 等）。
+        """
+        results = []
+        for start in range(0, len(commands), window):
+            batch = commands[start:start + window]
+            for command in batch:
+                self.track_command(command)
+            payload = "".join(f"{command}\r\n" for command in batch)
+            self.control_socket.sendall(payload.encode('utf-8'))
+            for command in batch:
+                response = self.receive_response()
+                # 1xx/2xx/3xx 表示命令被接受，4xx/5xx 或连接断开表示失败
+                results.append({"command": command, "response": response,
+                                "ok": response[:1] in ("1", "2", "3")})
+        return results
+
+    def size_many(self, filenames):
+        """批量查询文件大小，返回 {文件名: 大小}，查询失败的文件对应 None"""
+        sizes = {}
+        for filename, result in zip(filenames, self.pipeline([f"SIZE {name}" for name in filenames])):
+            sizes[filename] = int(result["response"].split()[1]) if result["response"].startswith("213") else None
+        return sizes
+
     def close(self):
         self.control_socket.close()
 
+    def pwd(self):
+        """发送 PWD 命令获取当前工作目录"""
+        self.send_command("PWD")
+        response = self.receive_response()
+        match = re.search(r'"(.+)"', response)
+        if not response.startswith("257") or not match:
+            return None
+        self.current_dir = match.group(1)
+        return self.current_dir
+
+    def remote_path(self, name=None):
+        """把相对于当前目录的远程路径转换为绝对路径，当前目录未知时先发送一次 PWD"""
+        if name and name.startswith("/"):
+            return posixpath.normpath(name)
+        if self.current_dir is None and self.pwd() is None:
+            self.current_dir = "/"
+        return posixpath.normpath(posixpath.join(self.current_dir, name or "."))
+
+    def invalidate_listing(self, name, tree=False):
+        """使 name 所在目录的缓存列表失效；tree 为 True 时 name 下的整棵子树也失效"""
+        name = name.split()[0] if name.strip() else "."
+        if self.current_dir is None and not name.startswith("/"):
+            # 不知道当前目录时无法定位受影响的路径，全部失效
+            self.listing_cache.clear()
+            return
+        path = posixpath.normpath(posixpath.join(self.current_dir or "/", name))
+        self.listing_cache.invalidate(posixpath.dirname(path))
+        if tree:
+            self.listing_cache.invalidate_tree(path)
+
+    def list_directory(self, directory=None, refresh=False):
+        """返回目录的 MLSXEntry 列表，优先使用缓存；refresh 为 True 时跳过缓存重新获取
+
+        服务器不支持 MLSD 时抛出 ConnectionError。
+        """
+        path = self.remote_path(directory)
+        if not refresh:
+            entries = self.listing_cache.get(path)
+            if entries is not None:
+                return entries
+        entries = list(self.mlsd(directory))
+        self.listing_cache.put(path, entries)
+        return entries
+
+    def open_session(self, directory=None):
+        """用相同的服务器地址和登录凭据建立一个不打印输出的新会话，失败时抛出 ConnectionError"""
+        session = FTP_CLIENT(self.server_ip, self.server_port, self.buffer_size)
+        session.verbose = False
+        session.control_socket = socket.create_connection((self.server_ip, self.server_port), timeout=10)
+        session.control_socket.settimeout(None)
+        steps = [(None, "220"), (f"USER {self.username}", "331"), (f"PASS {self.password}", "230")]
+        if directory and directory != "/":
+            steps.append((f"CWD {directory}", "250"))
+        if self.mode_z:
+            steps += [(f"OPTS MODE Z LEVEL {self.compress_level}", "200"), ("MODE Z", "200")]
+        for command, code in steps:
+            if command:
+                session.send_command(command)
+            response = session.receive_response()
+            if not response.startswith(code):
+                session.close()
+                raise ConnectionError(f"{command or 'connect'}: {response}")
+        session.session_changes.clear()  # 登录后所在的目录就是这个会话的初始状态
+        session.mode_z = self.mode_z
+        session.compress_level = self.compress_level
+        return session
+
+    def set_mode_z(self, enabled, level=None):
+        """用 MODE Z / MODE S 打开或关闭数据连接的压缩，level 不为 None 时先用 OPTS 设置压缩级别，返回是否成功"""
+        if enabled and level is not None:
+            self.send_command(f"OPTS MODE Z LEVEL {level}")
+            if not self.receive_response().startswith("200"):
+                return False
+            self.compress_level = level
+        self.send_command("MODE Z" if enabled else "MODE S")
+        if not self.receive_response().startswith("200"):
+            return False
+        self.mode_z = enabled
+        return True
+
+    def remote_checksum(self, filename, algorithm="SHA-256", start=0, end=None):
+        """让服务器计算 [start, end) 的校验和，end 为 None 时到文件末尾；服务器不支持或出错时返回 None
+
+        优先使用 HASH（需要时先发送 OPTS HASH 和 RANG），服务器不支持 HASH 时退回到 XCRC/XMD5/XSHA1/XSHA256。
+        服务器缓存计算结果，同一个文件没有变化时再次查询不需要重新读取。
+        """
+        if end is not None and end <= start:
+            return local_checksum(os.devnull, algorithm)  # RANG 无法表示空范围
+        response = ""
+        if self.hash_algorithm != algorithm:
+            self.send_command(f"OPTS HASH {algorithm}")
+            response = self.receive_response()
+            if response.startswith("200"):
+                self.hash_algorithm = algorithm
+        if self.hash_algorithm == algorithm:
+            ranged = start > 0 or end is not None
+            if ranged:
+                # RANG 的终点包含在范围内，超过文件末尾时服务器算到文件末尾为止
+                self.send_command(f"RANG {start} {end - 1 if end is not None else (1 << 62)}")
+                response = self.receive_response()
+            if not ranged or response.startswith("350"):
+                self.send_command(f"HASH {filename}")
+                response = self.receive_response()
+                # "213 算法 起点-终点 校验和 文件名"
+                parts = response.split()
+                if response.startswith("213") and len(parts) >= 4:
+                    return parts[3].lower()
+                if response.startswith("55"):
+                    return None  # 文件不存在等错误，旧式命令也不会成功
+        command = HASH_ALGORITHMS[algorithm][1]
+        arguments = f" {start} {end}" if end is not None else f" {start}" if start > 0 else ""
+        self.send_command(f"{command} {filename}{arguments}")
+        response = self.receive_response()
+        parts = response.split()
+        return parts[1].lower() if response.startswith("250") and len(parts) >= 2 else None
+
+    def verify_prefix(self, remote_name, local_path, length, algorithm="SHA-256"):
+        """比较远程文件和本地文件的前 length 字节，一致时返回 True，服务器无法计算校验和时返回 None"""
+        remote = self.remote_checksum(remote_name, algorithm, 0, length)
+        if remote is None:
+            return None
+        return remote == local_checksum(local_path, algorithm, 0, length)
+
+    def fetch_range(self, filename, fd, start, length, progress_callback=None):
+        """在当前会话上用 REST + RETR 下载 [start, start + length) 并写入 fd 的相同偏移处
+
+        progress_callback(received) 在每收到一块数据后被调用。
+        """
+        if not self.enter_pasv_mode():
+            raise ConnectionError("PASV failed")
+        if start > 0:
+            self.send_command(f"REST {start}")
+            response = self.receive_response()
+            if not response.startswith("350"):
+                raise ConnectionError(f"REST: {response}")
+        self.send_command(f"RETR {filename}")
+        response = self.receive_response()
+        if not (response.startswith("150") or response.startswith("125")):
+            raise ConnectionError(f"RETR: {response}")
+        data_socket = self.data_connect()
+        if data_socket is None:
+            raise ConnectionError("data connection failed")
+
+        position = start
+
+        def write_at(chunk):
+            nonlocal position
+            # pwrite 可能只写入一部分（例如被信号中断或磁盘将满），循环直到整块写完
+            chunk = memoryview(chunk)
+            while chunk:
+                written = os.pwrite(fd, chunk, position)
+                if written == 0:
+                    raise OSError(f"pwrite wrote nothing at offset {position}")
+                position += written
+                chunk = chunk[written:]
+
+        try:
+            received = self.recv_stream(data_socket, write_at, limit=length, progress_callback=progress_callback)
+        finally:
+            # 读够本段后直接关闭数据连接，服务器剩余的数据不再需要
+            data_socket.close()
+        if received != length:
+            raise ConnectionError(f"short read at offset {start}: {received}/{length} bytes")
+
+    def get_transfer_buffer(self):
+        """返回数据连接复用的传输缓冲区，避免每个数据块都重新分配内存"""
+        if self.transfer_buffer is None or len(self.transfer_buffer) != self.buffer_size:
+            self.transfer_buffer = bytearray(self.buffer_size)
+        return self.transfer_buffer
+
+    def recv_stream(self, data_socket, write, limit=None, progress_callback=None):
+        """从数据连接接收数据直到对端关闭（或收满 limit 字节），每块数据直接交给 write
+
+        progress_callback(已接收字节数) 在每块数据写出后调用。返回接收的总字节数（MODE Z 时为解压后的字节数）。
+        """
+        received = 0
+        for chunk in self.iter_data(data_socket, limit):
+            write(chunk)
+            received += len(chunk)
+            if progress_callback:
+                progress_callback(received)
+        return received
+
+    def iter_data(self, data_socket, limit=None):
+        """逐块产生从数据连接收到的数据，直到对端关闭或产生了 limit 字节
+
+        所有数据连接的读取共用同一块预分配缓冲区，用 recv_into 填充，产生的 memoryview 在取下一块之前有效，
+        不为每个数据块分配新的 bytes。MODE Z 时产生解压后的数据，limit 也按解压后的字节数计算。
+        """
+        buffer = self.get_transfer_buffer()
+        view = memoryview(buffer)
+        self.wire_bytes = 0
+        if self.mode_z:
+            yield from self.iter_inflate(data_socket, buffer, limit)
+            return
+        received = 0
+        while limit is None or received < limit:
+            size = len(buffer) if limit is None else min(len(buffer), limit - received)
+            read = data_socket.recv_into(buffer, size)
+            if read == 0:
+                break
+            self.wire_bytes += read
+            yield view[:read]
+            received += read
+
+    def iter_inflate(self, data_socket, buffer, limit=None):
+        """MODE Z 的 iter_data：每次最多解压出一个缓冲区大小的数据，避免压缩率很高时占用大量内存
+
+        压缩数据损坏，或者数据连接在压缩流结束之前就关闭时抛出 ConnectionError（收满 limit 字节时不检查）。
+        """
+        view = memoryview(buffer)
+        inflater = zlib.decompressobj()
+        received = 0
+        while not inflater.eof and (limit is None or received < limit):
+            read = data_socket.recv_into(buffer)
+            if read == 0:
+                break
+            self.wire_bytes += read
+            data = view[:read]
+            while limit is None or received < limit:
+                size = len(buffer) if limit is None else min(len(buffer), limit - received)
+                try:
+                    chunk = inflater.decompress(data, size)
+                except zlib.error as e:
+                    raise ConnectionError(f"corrupt MODE Z data: {e}") from e
+                data = inflater.unconsumed_tail
+                if chunk:
+                    received += len(chunk)
+                    yield chunk
+                # 输出没有填满说明输入已经用完，否则 zlib 内部可能还有没取出的数据
+                if not data and len(chunk) < size:
+                    break
+        if limit is None and not inflater.eof:
+            raise ConnectionError("MODE Z data stream ended early")
+
+    def iter_lines(self, data_socket):
+        """从数据连接逐行读取（不含行尾），边接收边产生，不等待整个列表传输完"""
+        pending = bytearray()
+        for chunk in self.iter_data(data_socket):
+            pending += chunk
+            start = 0
+            while True:
+                index = pending.find(b"\n", start)
+                if index < 0:
+                    break
+                yield bytes(pending[start:index]).rstrip(b"\r")
+                start = index + 1
+            del pending[:start]
+        if pending.strip():
+            yield bytes(pending).rstrip(b"\r")
+
+    def send_file(self, data_socket, f, offset=0, count=None, progress_callback=None):
+        """把文件 f 从 offset 开始的 count 字节（默认直到文件末尾）发送到数据连接
+
+        优先使用 os.sendfile 由内核直接发送，平台或套接字不支持时退回到复用的大缓冲区循环。
+        MODE Z 时在本地压缩后发送。progress_callback(已发送字节数) 在每个数据块发送后调用，字节数按压缩前计算。
+        返回 (已发送字节数, "sendfile"、"buffered" 或 "deflate")。
+        """
+        end = os.fstat(f.fileno()).st_size if count is None else offset + count
+        if self.mode_z:
+            return self.send_deflate(data_socket, f, offset, end, progress_callback)
+        position = offset
+        # 带超时的套接字底层是非阻塞的，os.sendfile 会返回 EAGAIN，此时直接使用缓冲区方式
+        if hasattr(os, "sendfile") and data_socket.gettimeout() is None:
+            try:
+                while position < end:
+                    sent = os.sendfile(data_socket.fileno(), f.fileno(), position, min(self.buffer_size, end - position))
+                    if sent == 0:
+                        break
+                    position += sent
+                    if progress_callback:
+                        progress_callback(position - offset)
+                self.wire_bytes = position - offset
+                return position - offset, "sendfile"
+            except OSError as e:
+                # 只有一个字节都没发出去时才能安全地换用缓冲区方式
+                if position > offset or e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP):
+                    raise
+
+        buffer = memoryview(self.get_transfer_buffer())
+        f.seek(position)
+        while position < end:
+            read = f.readinto(buffer[:min(len(buffer), end - position)])
+            if not read:
+                break
+            data_socket.sendall(buffer[:read])
+            position += read
+            if progress_callback:
+                progress_callback(position - offset)
+        self.wire_bytes = position - offset
+        return position - offset, "buffered"
+
+    def send_deflate(self, data_socket, f, offset, end, progress_callback=None):
+        """MODE Z 的 send_file：流式压缩 [offset, end) 并发送，内容压缩不了（已经压缩过的文件）时自动改用级别 0"""
+        stream = AdaptiveDeflate(self.compress_level, is_compressed_name(getattr(f, "name", "")))
+        buffer = memoryview(self.get_transfer_buffer())
+        position = offset
+        f.seek(position)
+        while position < end:
+            read = f.readinto(buffer[:min(len(buffer), end - position)])
+            if not read:
+                break
+            data = stream.compress(buffer[:read])
+            if data:
+                data_socket.sendall(data)
+            position += read
+            if progress_callback:
+                progress_callback(position - offset)
+        data_socket.sendall(stream.flush())
+        self.wire_bytes = stream.total_out
+        return position - offset, "deflate"
+
+    def send_range(self, local_filename, remote_name, start, length, progress_callback=None, segment=False):
+        """在当前会话上用 REST + STOR 把本地文件的 [start, start + length) 上传到服务器文件的相同偏移处
+
+        progress_callback(sent) 在每发送一块数据后被调用，它抛出的异常会中止上传。
+        segment 为 True 表示这是并行分段上传中的一段（"STOR 文件名 -segment"）：服务器允许多个分段同时写入同一个文件，
+        偏移量也可以超过文件当前的大小；否则服务器独占文件，偏移量不能超过文件大小。
+        """
+        if not self.enter_pasv_mode():
+            raise ConnectionError("PASV failed")
+        if start > 0:
+            self.send_command(f"REST {start}")
+            response = self.receive_response()
+            if not response.startswith("350"):
+                raise ConnectionError(f"REST: {response}")
+        self.send_command(f"STOR {remote_name} -segment" if segment else f"STOR {remote_name}")
+        response = self.receive_response()
+        if not (response.startswith("150") or response.startswith("125")):
+            raise ConnectionError(f"STOR: {response}")
+        data_socket = self.data_connect()
+        if data_socket is None:
+            raise ConnectionError("data connection failed")
+
+        try:
+            with open(local_filename, "rb") as f:
+                sent, _ = self.send_file(data_socket, f, start, length, progress_callback)
+        finally:
+            data_socket.close()
+        response = self.receive_response()
+        if sent != length:
+            raise ConnectionError(f"local file shrank at offset {start}: {sent}/{length} bytes")
+        if not response.startswith("226"):
+            raise ConnectionError(f"STOR: {response}")
+
+    def download(self, remote_name, local_path, offset=0, progress_callback=None):
+        """在当前会话上把 remote_name 下载到 local_path，返回接收的字节数
+
+        offset > 0 时用 REST 续传：本地文件截断到 offset 后从该处继续写入，否则覆盖本地文件。
+        失败时抛出 ConnectionError；progress_callback(received) 在每收到一块数据后被调用，它抛出的异常会中止下载。
+        """
+        if not self.enter_pasv_mode():
+            raise ConnectionError("PASV failed")
+        if offset > 0:
+            self.send_command(f"REST {offset}")
+            response = self.receive_response()
+            if not response.startswith("350"):
+                raise ConnectionError(f"REST: {response}")
+        self.send_command(f"RETR {remote_name}")
+        response = self.receive_response()
+        if not (response.startswith("150") or response.startswith("125")):
+            self.pasv_mode = False
+            raise ConnectionError(f"RETR: {response}")
+        data_socket = self.data_connect()
+        if data_socket is None:
+            raise ConnectionError("data connection failed")
+
+        try:
+            with open(local_path, "r+b" if offset > 0 else "wb") as f:
+                if offset > 0:
+                    f.truncate(offset)
+                    f.seek(offset)
+                received = self.recv_stream(data_socket, f.write, progress_callback=progress_callback)
+        finally:
+            data_socket.close()
+        response = self.receive_response()
+        self.pasv_mode = False
+        if not response.startswith("226"):
+            raise ConnectionError(f"RETR: {response}")
+        return received
+
+    def segmented_stor(self, local_filename, segments=4, retries=2):
+        """用多个并行连接分段上传文件，每段通过独立会话的 REST + STOR 写入服务器文件的对应位置
+
+        第一段不带 REST（服务器会截断并创建文件），先单独上传；其余分段随后并行上传。
+        返回整个上传任务的状态：{"file", "size", "segments", "done"}，segments 中记录每段的重试次数和错误。
+        """
+        if not os.path.isfile(local_filename):
+            print("[ERROR] 本地文件不存在")
+            return None
+        total_size = os.path.getsize(local_filename)
+        remote_name = os.path.basename(local_filename)
+        directory = self.pwd()
+
+        # 每段一个进度回调，重试时从 0 重新计数，进度为各段之和
+        reporter = ProgressReporter(console_progress("上传进度"), total_size)
+        callbacks = {}
+
+        def worker(start, length):
+            session = self.open_session(directory)
+            try:
+                # 第一段截断并创建文件，之后的分段共享写入
+                session.send_range(local_filename, remote_name, start, length, callbacks[start], segment=start > 0)
+            finally:
+                session.close()
+
+        # 第一段只取很小的头部，尽量减少串行部分
+        head = min(total_size, 65536)
+        job = {"file": remote_name, "size": total_size, "segments": [], "done": False}
+        with reporter:
+            callbacks[0] = reporter.part()
+            job["segments"] += run_segments([(0, head)], worker, retries)
+            if job["segments"][0]["done"] and total_size > head:
+                rest = [(head + start, length) for start, length in split_ranges(total_size - head, segments)]
+                rest = [r for r in rest if r[1] > 0]
+                callbacks.update((start, reporter.part()) for start, _ in rest)
+                job["segments"] += run_segments(rest, worker, retries)
+        # 分段由其它会话写入，本会话的缓存列表需要手动失效
+        self.invalidate_listing(remote_name)
+
+        failed = [r for r in job["segments"] if not r["done"]]
+        for r in failed:
+            print(f"[ERROR] 分段 {r['start']}+{r['length']} 上传失败 (尝试 {r['attempts']} 次): {r['error']}")
+        remote_size = None if failed else self.size_many([remote_name])[remote_name]
+        job["done"] = not failed and remote_size == total_size
+        if job["done"]:
+            print(f"[INFO] 文件分段上传完成: {local_filename} ({total_size} bytes, {len(job['segments'])} 个分段)")
+        else:
+            print(f"[ERROR] 分段上传失败: {local_filename}")
+        return job
+
+    def segmented_retr(self, filename, segments=4):
+        """用多个并行连接分段下载文件：每个连接用 REST 定位到本段起点，写入预分配本地文件的对应位置"""
+        self.send_command(f"SIZE {filename}")
+        size_response = self.receive_response()
+        if not size_response.startswith("213"):
+            print("[ERROR] 获取文件大小失败")
+            return False
+        total_size = int(size_response.split()[1])
+        directory = self.pwd()
+
+        local_filename = filename.split("/")[-1]
+        fd = os.open(local_filename, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, total_size)  # 预分配文件，各分段按偏移写入
+
+            ranges = [r for r in split_ranges(total_size, segments) if r[1] > 0]
+            reporter = ProgressReporter(console_progress("下载进度"), total_size)
+            callbacks = {start: reporter.part() for start, _ in ranges}
+
+            def worker(start, length):
+                session = self.open_session(directory)
+                try:
+                    session.fetch_range(filename, fd, start, length, callbacks[start])
+                finally:
+                    session.close()
+
+            with reporter:
+                results = run_segments(ranges, worker)
+            local_size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+
+        failed = [r for r in results if not r["done"]]
+        for r in failed:
+            print(f"[ERROR] 分段 {r['start']}+{r['length']} 下载失败: {r['error']}")
+        if failed or local_size != total_size:
+            print(f"[ERROR] 分段下载失败: {local_filename}")
+            return False
+        print(f"[INFO] 文件分段下载完成: {local_filename} ({total_size} bytes, {len(results)} 个连接)")
+        return True
+
     def login(self, username, password):
         """发送 USER 和 PASS 命令进行登录"""
         # 发送 USER 命令
@@ -132,12 +825,8 @@ class FTP_CLIENT:
         if not data_connection:
             return
 
-        data = b""
-        while True:
-            chunk = data_connection.recv(4096)
-            if not chunk:
-                break
-            data += chunk
+        data = bytearray()
+        self.recv_stream(data_connection, data.extend)
 
         data_connection.close()
         print(data.decode('utf-8').strip())
@@ -146,6 +835,46 @@ class FTP_CLIENT:
         self.active_mode = False
         self.pasv_mode = False
 
+    def mlsd(self, directory=None):
+        """发送 MLSD 命令，逐个产生目录中的 MLSXEntry（边接收边解析）
+
+        不需要按列猜测 ls -l 的格式，也不需要再为每个文件发送 SIZE。
+        服务器不支持 MLSD 或命令失败时抛出 ConnectionError，调用者可以改用 LIST。
+        """
+        if not self.enter_pasv_mode():
+            raise ConnectionError("PASV failed")
+        self.send_command(f"MLSD {directory}" if directory else "MLSD")
+        response = self.receive_response()
+        if not (response.startswith("150") or response.startswith("125")):
+            self.pasv_mode = False
+            raise ConnectionError(response)
+        data_socket = self.data_connect()
+        if data_socket is None:
+            self.receive_response()
+            self.pasv_mode = False
+            raise ConnectionError("MLSD data connection failed")
+        try:
+            for line in self.iter_lines(data_socket):
+                entry = parse_mlsx_line(line.decode('utf-8', errors='replace'))
+                # 跳过当前目录和上级目录本身
+                if entry and entry.type not in ("cdir", "pdir"):
+                    yield entry
+        finally:
+            data_socket.close()
+            self.receive_response()
+            self.active_mode = False
+            self.pasv_mode = False
+
+    def mlst(self, path=None):
+        """发送 MLST 命令获取单个文件或目录的信息，返回 MLSXEntry，失败时返回 None"""
+        self.send_command(f"MLST {path}" if path else "MLST")
+        response = self.receive_response()
+        lines = response.split("\r\n")
+        if not response.startswith("250") or len(lines) < 2:
+            return None
+        # 事实行以一个空格开头
+        return parse_mlsx_line(lines[1][1:])
+
     def enter_pasv_mode(self):
         """进入 PASV 模式（被动模式）"""
         self.send_command("PASV")
@@ -177,6 +906,12 @@ class FTP_CLIENT:
         if os.path.exists(local_filename):
             file_offset = os.path.getsize(local_filename)
 
+        # 续传之前确认本地已有的部分与服务器上的文件一致，不一致时从头下载
+        if file_offset > 0 and self.verify_prefix(filename, local_filename, file_offset) is False:
+            print("[WARN] 本地文件与服务器上的文件不一致，重新下载")
+            os.truncate(local_filename, 0)
+            file_offset = 0
+
         if file_offset > 0:
             self.send_command(f"REST {file_offset}")
             rest_response = self.receive_response()
@@ -199,14 +934,8 @@ class FTP_CLIENT:
         if data_socket is None:
             return
 
-        bytes_received = file_offset
-        with open(local_filename, "wb") as f:
-            while True:
-                chunk = data_socket.recv(4096)
-                if not chunk:
-                    break
-                f.write(chunk)
-                bytes_received += len(chunk)
+        with open(local_filename, "ab" if file_offset > 0 else "wb") as f:
+            self.recv_stream(data_socket, f.write)
 
         data_socket.close()
         self.receive_response()
@@ -222,23 +951,32 @@ class FTP_CLIENT:
             return
 
         file_size = os.path.getsize(local_filename)
-        self.send_command(f"SIZE {local_filename}")
+        # STOR 写入的是当前远程目录下的同名文件，SIZE 和校验也要针对这个文件
+        filename = os.path.basename(local_filename)
+        self.send_command(f"SIZE {filename}")
         size_response = self.receive_response()
         if not size_response.startswith("213"):
             file_offset = 0
         else:
             file_offset = int(size_response.split()[1])
+        # 服务器上的文件不比本地文件短时不能续传：不带 REST 的 STOR 会截断文件，必须从头上传
+        if file_offset >= file_size:
+            file_offset = 0
 
-        if file_offset > 0 and file_offset < file_size:
+        # 续传之前确认服务器上已有的部分与本地文件一致，不一致时从头上传
+        if file_offset > 0 and self.verify_prefix(filename, local_filename, file_offset) is False:
+            print("[WARN] 服务器上的文件与本地文件不一致，重新上传")
+            file_offset = 0
+
+        if file_offset > 0:
             self.send_command(f"REST {file_offset}")
             rest_response = self.receive_response()
             if not rest_response.startswith("350"):
                 return
 
-        filename = os.path.basename(local_filename)
         self.send_command(f"STOR {filename}")
         response = self.receive_response()
-        if not response.startswith("150") or not response.startswith("125"):
+        if not (response.startswith("150") or response.startswith("125")):
             print(f"[ERROR] STOR 命令失败: {response}")
             return
 
@@ -247,16 +985,12 @@ class FTP_CLIENT:
             print("[ERROR] 无法建立数据连接")
             return
 
-        bytes_sent = file_offset
         with open(local_filename, "rb") as f:
-            f.seek(file_offset)
-            while True:
-                chunk = f.read(4096)
-                if not chunk:
-                    break
-                data_socket.sendall(chunk)
+            bytes_sent, method = self.send_file(data_socket, f, file_offset)
 
-        print(f"[INFO] 文件上传完成: {local_filename}")
+        if method == "deflate":
+            method += f", {self.wire_bytes} bytes compressed"
+        print(f"[INFO] 文件上传完成: {local_filename} ({bytes_sent} bytes, {method})")
         data_socket.close()
         self.receive_response()
         self.active_mode = False
@@ -281,6 +1015,12 @@ class FTP_CLIENT:
         if os.path.exists(local_filename):
             file_offset = os.path.getsize(local_filename)
 
+        # 续传之前确认本地已有的部分与服务器上的文件一致，不一致时从头下载
+        if file_offset > 0 and self.verify_prefix(filename, local_filename, file_offset) is False:
+            print("[WARN] 本地文件与服务器上的文件不一致，重新下载")
+            os.truncate(local_filename, 0)
+            file_offset = 0
+
         if file_offset > 0:
             self.send_command(f"REST {file_offset}")
             rest_response = self.receive_response()
@@ -306,20 +1046,12 @@ class FTP_CLIENT:
         if data_socket is None:
             return
 
-        # 显示下载进度
-        bytes_received = file_offset
-        with open(local_filename, "ab") as f:  # 以追加模式打开文件
-            while True:
-                chunk = data_socket.recv(4096)
-                if not chunk:
-                    break
-                f.write(chunk)
-                bytes_received += len(chunk)
-                # 计算下载百分比并显示
-                progress = (bytes_received / total_size) * 100
-                print(f"\r[INFO] 下载进度: {progress:.2f}% ({bytes_received}/{total_size} bytes)", end='')
+        # 显示下载进度：每 0.1 秒刷新一次，不在每个数据块上输出
+        with open(local_filename, "ab") as f, \
+                ProgressReporter(console_progress("下载进度"), total_size, file_offset) as reporter:  # 以追加模式打开文件
+            self.recv_stream(data_socket, f.write, progress_callback=reporter.update)
 
-        print(f"\n[INFO] 文件下载完成: {local_filename}")
+        print(f"[INFO] 文件下载完成: {local_filename}")
         data_socket.close()
         self.receive_response()
         
@@ -343,6 +1075,12 @@ class FTP_CLIENT:
         else:
             file_offset = int(size_response.split()[1])
 
+        # 续传之前确认服务器上已有的部分与本地文件一致，不一致时从头上传
+        if 0 < file_offset < file_size and \
+                self.verify_prefix(os.path.basename(local_filename), local_filename, file_offset) is False:
+            print("[WARN] 服务器上的文件与本地文件不一致，重新上传")
+            file_offset = 0
+
         if file_offset > 0 and file_offset < file_size:
             self.send_command(f"REST {file_offset}")
             rest_response = self.receive_response()
@@ -362,21 +1100,12 @@ class FTP_CLIENT:
             print("[ERROR] 无法建立数据连接")
             return
 
-        # 显示上传进度
-        bytes_sent = file_offset
-        with open(local_filename, "rb") as f:
-            f.seek(file_offset)
-            while True:
-                chunk = f.read(4096)
-                if not chunk:
-                    break
-                data_socket.sendall(chunk)
-                bytes_sent += len(chunk)
-                # 计算上传百分比并显示
-                progress = (bytes_sent / file_size) * 100
-                print(f"\r[INFO] 上传进度: {progress:.2f}% ({bytes_sent}/{file_size} bytes)", end='')
+        # 显示上传进度：每 0.1 秒刷新一次，不在每个数据块上输出
+        with open(local_filename, "rb") as f, \
+                ProgressReporter(console_progress("上传进度"), file_size, file_offset) as reporter:
+            _, method = self.send_file(data_socket, f, file_offset, progress_callback=reporter.update)
 
-        print(f"\n[INFO] 文件上传完成: {local_filename}")
+        print(f"[INFO] 文件上传完成: {local_filename} ({method})")
         data_socket.close()
         self.receive_response()
         
@@ -389,18 +1118,20 @@ def parse_arguments():
     # 添加 -ip 和 -port 参数，带默认值
     parser.add_argument('-ip', type=str, default="127.0.0.1")
     parser.add_argument('-port', type=int, default=21)
+    # 数据连接的传输缓冲区大小（KiB），建议 256 ~ 4096
+    parser.add_argument('-buffer', type=int, default=1024)
 
     # 解析命令行参数
     args = parser.parse_args()
 
-    return args.ip, args.port
+    return args.ip, args.port, args.buffer * 1024
 
 def main():
     # 从命令行参数中获取服务器 IP 和端口（可以根据你的需要调整）
-    server_ip, server_port = parse_arguments()
+    server_ip, server_port, buffer_size = parse_arguments()
 
     # 创建 FTP 客户端实例
-    client = FTP_CLIENT(server_ip, server_port)
+    client = FTP_CLIENT(server_ip, server_port, buffer_size)
 
     # 连接到 FTP 服务器
     client.connect()
@@ -430,6 +1161,33 @@ def main():
                 client.send_command(user_input)
                 client.receive_response()
 
+            elif user_input.upper().startswith("MODE"):
+                # MODE Z [级别] 打开数据连接的压缩，MODE S 关闭
+                parts = user_input.split()
+                mode = parts[1].upper() if len(parts) > 1 else ""
+                level = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else None
+                if mode in ("S", "Z"):
+                    client.set_mode_z(mode == "Z", level)
+                else:
+                    print("[ERROR] 用法: MODE Z [0-9] 或 MODE S")
+
+            elif user_input.upper().startswith("HASH"):
+                # HASH <远程文件> [算法]，本地有同名文件时一并比较
+                parts = user_input.split()
+                algorithm = parts[2].upper() if len(parts) > 2 else "SHA-256"
+                if len(parts) < 2 or algorithm not in HASH_ALGORITHMS:
+                    print(f"[ERROR] 用法: HASH <文件> [{'|'.join(HASH_ALGORITHMS)}]")
+                    continue
+                checksum = client.remote_checksum(parts[1], algorithm)
+                if checksum is None:
+                    print("[ERROR] 服务器无法计算校验和")
+                    continue
+                print(f"[INFO] {algorithm} {checksum} {parts[1]}")
+                local_filename = parts[1].split("/")[-1]
+                if os.path.isfile(local_filename):
+                    same = local_checksum(local_filename, algorithm) == checksum
+                    print(f"[INFO] 本地文件 {local_filename}: {'一致' if same else '不一致'}")
+
             elif user_input.upper().startswith("PORT"):
                 client.enter_port_mode(user_input.upper())
 
@@ -441,19 +1199,58 @@ def main():
                 directory = parts[1].strip() if len(parts) > 1 else None
                 client.list_files(directory)
 
+            elif user_input.upper().startswith("MLSD"):
+                parts = user_input.split(maxsplit=1)
+                directory = parts[1].strip() if len(parts) > 1 else None
+                try:
+                    for entry in client.mlsd(directory):
+                        size = "" if entry.size is None else entry.size
+                        print(f"{entry.type or '?':5} {size:>12} {entry.perm:6} {entry.name}")
+                except ConnectionError as e:
+                    print(f"[ERROR] MLSD 命令失败: {e}")
+
+            elif user_input.upper().startswith("MIRROR"):
+                # MIRROR <远程目录> <本地目录> [-upload] [-delete] [-dry-run] [-workers N]
+                parts = user_input.split()
+                if len(parts) < 3:
+                    print("[ERROR] 用法: MIRROR <远程目录> <本地目录> [-upload] [-delete] [-dry-run] [-workers N]")
+                    continue
+                options = [option.lower() for option in parts[3:]]
+                workers = 4
+                if "-workers" in options and options.index("-workers") + 1 < len(options):
+                    workers = int(options[options.index("-workers") + 1])
+                from mirror import run_mirror, print_summary
+                try:
+                    summary = run_mirror(server_ip, server_port, client.username, client.password,
+                                         client.remote_path(parts[1]), parts[2],
+                                         "upload" if "-upload" in options else "download",
+                                         workers, "-delete" in options, True, "-dry-run" in options,
+                                         buffer_size=buffer_size)
+                    print_summary(summary)
+                except (OSError, ConnectionError) as e:
+                    print(f"[ERROR] MIRROR 命令失败: {e}")
+
             elif user_input.upper().startswith("RETR"):
                 parts = user_input.split(maxsplit=2)  # 允许处理多部分命令
                 filename = parts[1].strip() if len(parts) > 1 else None
-                if len(parts) > 2 and parts[2].strip().lower() == "-resume":
+                options = parts[2].split() if len(parts) > 2 else []
+                if options and options[0].lower() == "-resume":
                     client.resume_retr(filename)  # 调用断点续传下载功能
+                elif options and options[0].lower() == "-parallel":
+                    segments = int(options[1]) if len(options) > 1 else 4
+                    client.segmented_retr(filename, segments)  # 多连接分段下载
                 else:
                     client.retr(filename)  # 调用正常的下载功能
 
             elif user_input.upper().startswith("STOR"):
                 parts = user_input.split(maxsplit=2)  # 允许处理多部分命令
                 local_filename = parts[1].strip() if len(parts) > 1 else None
-                if len(parts) > 2 and parts[2].strip().lower() == "-resume":
+                options = parts[2].split() if len(parts) > 2 else []
+                if options and options[0].lower() == "-resume":
                     client.resume_stor(local_filename)  # 调用断点续传上传功能
+                elif options and options[0].lower() == "-parallel":
+                    segments = int(options[1]) if len(options) > 1 else 4
+                    client.segmented_stor(local_filename, segments)  # 多连接分段上传
                 else:
                     client.stor(local_filename)  # 调用正常的上传功能
 
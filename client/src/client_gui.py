@@ -9,11 +9,28 @@ from tkinter import filedialog, messagebox, ttk, simpledialog
 import threading
 from ttkthemes import ThemedTk
 import time
+import errno
+import posixpath
+import queue
+from collections import deque
+from client import parse_mlsx_line
+from connection_pool import FTPConnectionPool
+from file_list import FileListModel, format_modify, row_from_list_line, row_from_mlsx
+from listing_cache import ListingCache
+from progress import ProgressReporter, format_bytes, format_eta
+from transfer_queue import (TransferQueue, DONE, FAILED, RUNNING, PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL)
+
+QUEUE_REFRESH_MS = 250  # 传输队列显示的刷新间隔
+PRIORITY_NAMES = {PRIORITY_HIGH: "High", PRIORITY_NORMAL: "Normal", PRIORITY_LOW: "Low"}
+LISTING_BATCH = 1000  # 后台线程每解析这么多行交给界面一次
+LISTING_POLL_MS = 50  # 界面取出新解析的行的间隔
+LISTING_ROWS_PER_TICK = 20000  # 每次最多加入模型的行数，避免一次处理太多阻塞界面
+FILE_COLUMNS = (("name", "Name"), ("type", "Type"), ("size", "Size"), ("modified", "Last Modified"))
 
 
 class FTP_CLIENT:
     def __init__(self, server_ip, server_port, download_callback=None, upload_callback=None,
-                 client_output_callback=None, server_output_callback=None):
+                 client_output_callback=None, server_output_callback=None, buffer_size=1 << 20):
         self.server_ip = server_ip
         self.server_port = server_port
         self.control_socket = None
@@ -23,13 +40,20 @@ class FTP_CLIENT:
         self.active_mode = False
         self.pasv_mode = False
         self.output_buffer = []
+        self.recv_buffer = bytearray()  # 控制连接的接收缓冲区，保存尚未解析成完整响应的字节
         self.download_callback = download_callback  # 用于更新下载进度
         self.upload_callback = upload_callback      # 用于更新上传进度
         self.client_output_callback = client_output_callback    # 客户端输出回调
         self.server_output_callback = server_output_callback    # 服务器输出回调
+        self.buffer_size = buffer_size   # 数据连接复用的传输缓冲区大小
+        self.transfer_buffer = None
+        # 已知的远程当前目录（None 表示需要用 PWD 查询）和按绝对路径缓存的目录列表
+        self.current_dir = None
+        self.listing_cache = ListingCache()
 
     def connect(self):
         self.control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.recv_buffer.clear()
         try:
             self.client_output_callback("Connecting to server...\n")
             self.control_socket.connect((self.server_ip, self.server_port))
@@ -40,21 +64,62 @@ class FTP_CLIENT:
             self.client_output_callback(f"Connection failed: {e}\n")
             sys.exit(1)
 
-    def receive_response(self):
-        response = ""
+    def read_line(self):
+        """从控制连接读取一行（不含行尾的 CRLF），连接关闭且缓冲区为空时返回 None"""
         while True:
-            chunk = self.control_socket.recv(4096).decode('utf-8')
-            response += chunk
-            if '\r\n' in chunk:
-                break
-        self.server_output_callback(response.strip() + "\n")
-        return response.strip()
+            index = self.recv_buffer.find(b"\n")
+            if index >= 0:
+                line = bytes(self.recv_buffer[:index]).rstrip(b"\r")
+                del self.recv_buffer[:index + 1]
+                return line
+            chunk = self.control_socket.recv(4096)
+            if not chunk:
+                # 连接已关闭，把剩余的不完整数据作为最后一行返回
+                if not self.recv_buffer:
+                    return None
+                line = bytes(self.recv_buffer).rstrip(b"\r")
+                self.recv_buffer.clear()
+                return line
+            self.recv_buffer += chunk
+
+    def read_reply(self):
+        """读取一条完整的响应（包括 "NNN-" 开头的多行响应），多余的字节留在缓冲区中"""
+        line = self.read_line()
+        if line is None:
+            return ""
+        lines = [line]
+        # 多行响应以 "NNN-" 开始，以 "NNN " 结束
+        if len(line) >= 4 and line[:3].isdigit() and line[3:4] == b"-":
+            code = line[:3]
+            while True:
+                line = self.read_line()
+                if line is None:
+                    break
+                lines.append(line)
+                if line[:3] == code and line[3:4] != b"-":
+                    break
+        return b"\r\n".join(lines).decode('utf-8', errors='replace').strip()
+
+    def receive_response(self):
+        response = self.read_reply()
+        self.server_output_callback(response + "\n")
+        return response
 
     def send_command(self, command):
         self.client_output_callback(f">>> {command}\n")
+        self.track_command(command)
         command += "\r\n"
         self.control_socket.sendall(command.encode('utf-8'))
 
+    def track_command(self, command):
+        """根据即将发送的命令更新会话状态和缓存（send_command 和 pipeline 共用）"""
+        verb, _, arg = command.partition(" ")
+        if verb.upper() in ("CWD", "CDUP"):
+            self.current_dir = None
+        elif verb.upper() in ("MKD", "RMD", "STOR", "DELE"):
+            # 我们自己修改了远程目录，对应的缓存列表不再可信
+            self.invalidate_listing(arg, tree=verb.upper() == "RMD")
+
     def close(self):
         if self.control_socket:
             self.send_command("QUIT")
@@ -108,7 +173,8 @@ class FTP_CLIENT:
         pattern = r'"(.+)"'
         match = re.search(pattern, response)
         if match:
-            return match.group(1)
+            self.current_dir = match.group(1)
+            return self.current_dir
         else:
             self.client_output_callback("[ERROR] Unable to parse PWD response.\n")
             return None
@@ -120,6 +186,29 @@ class FTP_CLIENT:
             self.client_output_callback(f"CWD command failed: {response}\n")
         else:
             self.client_output_callback(f"Changed directory to {directory}\n")
+            # 响应中带有新目录的绝对路径时直接记下，省去一次 PWD
+            match = re.search(r'"(/.*)"', response)
+            if match:
+                self.current_dir = match.group(1)
+
+    def remote_path(self, name=None):
+        """把相对于当前目录的远程路径转换为绝对路径，当前目录未知时先发送一次 PWD"""
+        if name and name.startswith("/"):
+            return posixpath.normpath(name)
+        if self.current_dir is None and self.pwd() is None:
+            self.current_dir = "/"
+        return posixpath.normpath(posixpath.join(self.current_dir, name or "."))
+
+    def invalidate_listing(self, name, tree=False):
+        """使 name 所在目录的缓存列表失效；tree 为 True 时 name 下的整棵子树也失效"""
+        name = name.split()[0] if name.strip() else "."
+        if self.current_dir is None and not name.startswith("/"):
+            self.listing_cache.clear()
+            return
+        path = posixpath.normpath(posixpath.join(self.current_dir or "/", name))
+        self.listing_cache.invalidate(posixpath.dirname(path))
+        if tree:
+            self.listing_cache.invalidate_tree(path)
 
     def mkd(self, directory_name):
         self.send_command(f"MKD {directory_name}")
@@ -137,6 +226,28 @@ class FTP_CLIENT:
         else:
             self.client_output_callback(f"Directory '{directory_name}' removed successfully.\n")
 
+    def pipeline(self, commands, window=64):
+        """批量发送命令：每次用一次 sendall 写出一批命令，再按顺序读取对应的响应
+
+        返回与 commands 一一对应的结果列表，每项为 {"command", "response", "ok"}，
+        单条命令失败不影响其余命令。window 限制同时在途的命令数量。
+        """
+        results = []
+        for start in range(0, len(commands), window):
+            batch = commands[start:start + window]
+            for command in batch:
+                self.client_output_callback(f">>> {command}\n")
+                self.track_command(command)
+            payload = "".join(f"{command}\r\n" for command in batch)
+            self.control_socket.sendall(payload.encode('utf-8'))
+            for command in batch:
+                response = self.receive_response()
+                ok = response[:1] in ("1", "2", "3")
+                if not ok:
+                    self.client_output_callback(f"{command.split()[0]} command failed: {response}\n")
+                results.append({"command": command, "response": response, "ok": ok})
+        return results
+
     def enter_port_mode(self, user_input):
         """进入 PORT 模式（主动模式）"""
         pattern = r"PORT (\d+),(\d+),(\d+),(\d+),(\d+),(\d+)"
@@ -197,46 +308,84 @@ class FTP_CLIENT:
             return None
 
     def list_files(self, directory=None):
-        """发送 LIST 命令并接收服务器返回的文件列表"""
-        # 防止命令接受出错，间隔1秒发送
-        time.sleep(0.5)
-        self.enter_pasv_mode()
-
-        if directory:
-            self.send_command(f"LIST {directory}")
-        else:
-            self.send_command("LIST")
-
-        response = self.receive_response()
-        if not response.startswith("150"):
-            self.client_output_callback(f"LIST command failed: {response}\n")
+        """发送 LIST 命令并接收服务器返回的文件列表（ls -l 格式的行）"""
+        try:
+            return list(self.iter_list(directory))
+        except ConnectionError as e:
+            self.client_output_callback(f"LIST command failed: {e}\n")
             return None  # 如果命令失败，返回 None
 
-        data_connection = self.data_connect()
-        
-        if not data_connection:
-            self.client_output_callback("Failed to establish data connection for LIST.\n")
-            return None
+    def iter_list(self, directory=None):
+        """发送 LIST 命令，边接收边逐行产生 ls -l 格式的行（过滤掉 "total" 行）；失败时抛出 ConnectionError"""
+        if not self.enter_pasv_mode():
+            raise ConnectionError("PASV failed")
+        self.send_command(f"LIST {directory}" if directory else "LIST")
+        response = self.receive_response()
+        if not (response.startswith("150") or response.startswith("125")):
+            self.pasv_mode = False
+            raise ConnectionError(response)
+        data_socket = self.data_connect()
+        if data_socket is None:
+            self.receive_response()
+            self.pasv_mode = False
+            raise ConnectionError("LIST data connection failed")
+        try:
+            for line in self.iter_lines(data_socket):
+                line = line.decode('utf-8', errors='replace').strip()
+                if line and not line.lower().startswith("total"):
+                    yield line
+        finally:
+            data_socket.close()
+            final_response = self.receive_response()
+            if not final_response.startswith("226"):
+                self.client_output_callback(f"LIST command final response: {final_response}\n")
+            self.active_mode = False
+            self.pasv_mode = False
 
-        data = b""
+    def iter_lines(self, data_socket):
+        """从数据连接逐行读取（不含行尾），边接收边产生"""
+        buffer = self.get_transfer_buffer()
+        pending = bytearray()
         while True:
-            chunk = data_connection.recv(4096)
-            if not chunk:
+            read = data_socket.recv_into(buffer)
+            if read == 0:
                 break
-            data += chunk
-
-        data_connection.close()
-        final_response = self.receive_response()
-        if not final_response.startswith("226"):
-            self.client_output_callback(f"LIST command final response: {final_response}\n")
-
-        # 解析文件列表，并过滤掉 'total' 行
-        files = data.decode('utf-8').strip().split('\n')
-        # 过滤掉开头包含 "total" 的那一行
-        files = [file.strip() for file in files if not file.lower().startswith("total")]
-        self.active_mode = False
-        self.pasv_mode = False
-        return files
+            pending += memoryview(buffer)[:read]
+            start = 0
+            while True:
+                index = pending.find(b"\n", start)
+                if index < 0:
+                    break
+                yield bytes(pending[start:index]).rstrip(b"\r")
+                start = index + 1
+            del pending[:start]
+        if pending.strip():
+            yield bytes(pending).rstrip(b"\r")
+
+    def mlsd(self, directory=None):
+        """发送 MLSD 命令，逐个产生目录中的 MLSXEntry；服务器不支持时抛出 ConnectionError"""
+        if not self.enter_pasv_mode():
+            raise ConnectionError("PASV failed")
+        self.send_command(f"MLSD {directory}" if directory else "MLSD")
+        response = self.receive_response()
+        if not (response.startswith("150") or response.startswith("125")):
+            self.pasv_mode = False
+            raise ConnectionError(response)
+        data_socket = self.data_connect()
+        if data_socket is None:
+            self.receive_response()
+            self.pasv_mode = False
+            raise ConnectionError("MLSD data connection failed")
+        try:
+            for line in self.iter_lines(data_socket):
+                entry = parse_mlsx_line(line.decode('utf-8', errors='replace'))
+                if entry and entry.type not in ("cdir", "pdir"):
+                    yield entry
+        finally:
+            data_socket.close()
+            self.receive_response()
+            self.active_mode = False
+            self.pasv_mode = False
 
     def enter_pasv_mode(self):
         """进入 PASV 模式（被动模式）"""
@@ -294,16 +443,9 @@ class FTP_CLIENT:
             self.client_output_callback("Failed to establish data connection for RETR.\n")
             return
 
-        bytes_received = file_offset
-        with open(local_filename, "ab" if file_offset > 0 else "wb") as f:
-            while True:
-                chunk = data_socket.recv(4096)
-                if not chunk:
-                    break
-                f.write(chunk)
-                bytes_received += len(chunk)
-                if self.download_callback:
-                    self.download_callback(bytes_received, 0)  # 0 as total_size is unknown here
+        with open(local_filename, "ab" if file_offset > 0 else "wb") as f, \
+                self.progress_reporter(self.download_callback, None, file_offset) as reporter:  # 文件大小未知
+            self.recv_stream(data_socket, f.write, progress_callback=reporter.update)
 
         data_socket.close()
         final_response = self.receive_response()
@@ -354,24 +496,16 @@ class FTP_CLIENT:
             self.client_output_callback("Failed to establish data connection for STOR.\n")
             return
 
-        bytes_sent = file_offset
-        with open(local_filename, "rb") as f:
-            f.seek(file_offset)
-            while True:
-                chunk = f.read(4096)
-                if not chunk:
-                    break
-                try:
-                    data_socket.sendall(chunk)
-                    bytes_sent += len(chunk)
-                    if self.upload_callback:
-                        self.upload_callback(bytes_sent, file_size)
-                except Exception as e:
-                    self.client_output_callback(f"Error during upload: {e}\n")
-                    messagebox.showerror("Error", f"Failed to upload '{local_filename}': {e}")
-                    break
+        method = None
+        with open(local_filename, "rb") as f, self.progress_reporter(self.upload_callback, file_size, file_offset) as reporter:
+            try:
+                _, method = self.send_file(data_socket, f, file_offset, progress_callback=reporter.update)
+            except Exception as e:
+                self.client_output_callback(f"Error during upload: {e}\n")
+                messagebox.showerror("Error", f"Failed to upload '{local_filename}': {e}")
 
-        self.client_output_callback(f"File '{local_filename}' uploaded successfully.\n")
+        if method:
+            self.client_output_callback(f"File '{local_filename}' uploaded successfully ({method}).\n")
         data_socket.close()
         final_response = self.receive_response()
         if not final_response.startswith("226"):
@@ -380,6 +514,69 @@ class FTP_CLIENT:
         self.active_mode = False
         self.pasv_mode = False
 
+    def progress_reporter(self, callback, total, initial):
+        """传输进度每 0.1 秒合并一次交给 callback(ProgressSnapshot)，而不是每个数据块都调用一次"""
+        return ProgressReporter(callback or (lambda snapshot: None), total, initial)
+
+    def get_transfer_buffer(self):
+        """返回数据连接复用的传输缓冲区，避免每个数据块都重新分配内存"""
+        if self.transfer_buffer is None or len(self.transfer_buffer) != self.buffer_size:
+            self.transfer_buffer = bytearray(self.buffer_size)
+        return self.transfer_buffer
+
+    def recv_stream(self, data_socket, write, limit=None, progress_callback=None):
+        """从数据连接接收数据直到对端关闭（或收满 limit 字节），每块数据以 memoryview 的形式直接交给 write
+
+        所有数据连接的读取共用同一块预分配缓冲区，用 recv_into 填充。返回接收的总字节数。
+        """
+        buffer = self.get_transfer_buffer()
+        view = memoryview(buffer)
+        received = 0
+        while limit is None or received < limit:
+            size = len(buffer) if limit is None else min(len(buffer), limit - received)
+            read = data_socket.recv_into(buffer, size)
+            if read == 0:
+                break
+            write(view[:read])
+            received += read
+            if progress_callback:
+                progress_callback(received)
+        return received
+
+    def send_file(self, data_socket, f, offset=0, count=None, progress_callback=None):
+        """把文件 f 从 offset 开始的 count 字节（默认直到文件末尾）发送到数据连接
+
+        优先使用 os.sendfile 由内核直接发送，不支持时退回到复用的大缓冲区循环。
+        返回 (已发送字节数, "sendfile" 或 "buffered")。
+        """
+        end = os.fstat(f.fileno()).st_size if count is None else offset + count
+        position = offset
+        if hasattr(os, "sendfile") and data_socket.gettimeout() is None:
+            try:
+                while position < end:
+                    sent = os.sendfile(data_socket.fileno(), f.fileno(), position, min(self.buffer_size, end - position))
+                    if sent == 0:
+                        break
+                    position += sent
+                    if progress_callback:
+                        progress_callback(position - offset)
+                return position - offset, "sendfile"
+            except OSError as e:
+                if position > offset or e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP):
+                    raise
+
+        buffer = memoryview(self.get_transfer_buffer())
+        f.seek(position)
+        while position < end:
+            read = f.readinto(buffer[:min(len(buffer), end - position)])
+            if not read:
+                break
+            data_socket.sendall(buffer[:read])
+            position += read
+            if progress_callback:
+                progress_callback(position - offset)
+        return position - offset, "buffered"
+
     def ensure_data_connection(self):
         if self.active_mode:
             if not self.data_socket or self.data_socket.fileno() == -1:
@@ -427,23 +624,15 @@ class FTP_CLIENT:
             self.client_output_callback("Failed to establish data connection for RESUME RETR.\n")
             return
 
-        bytes_received = file_offset
-        with open(local_filename, "ab") as f:  # 以追加模式打开文件
-            while True:
-                chunk = data_socket.recv(4096)
-                if not chunk:
-                    break
-                f.write(chunk)
-                bytes_received += len(chunk)
-                if self.download_callback:
-                    self.download_callback(bytes_received, total_size)  # 调用下载进度更新回调
+        with open(local_filename, "ab") as f, \
+                self.progress_reporter(self.download_callback, total_size, file_offset) as reporter:  # 以追加模式打开文件
+            self.recv_stream(data_socket, f.write, progress_callback=reporter.update)
 
         self.client_output_callback(f"File '{local_filename}' downloaded successfully (resumed).\n")
         data_socket.close()
         final_response = self.receive_response()
         if not final_response.startswith("226"):
             self.client_output_callback(f"RETR command final response: {final_response}\n")
-        self.receive_response()
         self.active_mode = False
         self.pasv_mode = False
 
@@ -485,19 +674,10 @@ class FTP_CLIENT:
             self.client_output_callback("Failed to establish data connection for RESUME STOR.\n")
             return
 
-        bytes_sent = file_offset
-        with open(local_filename, "rb") as f:
-            f.seek(file_offset)
-            while True:
-                chunk = f.read(4096)
-                if not chunk:
-                    break
-                data_socket.sendall(chunk)
-                bytes_sent += len(chunk)
-                if self.upload_callback:
-                    self.upload_callback(bytes_sent, file_size)  # 调用上传进度更新回调
+        with open(local_filename, "rb") as f, self.progress_reporter(self.upload_callback, file_size, file_offset) as reporter:
+            _, method = self.send_file(data_socket, f, file_offset, progress_callback=reporter.update)
 
-        self.client_output_callback(f"File '{local_filename}' uploaded successfully (resumed).\n")
+        self.client_output_callback(f"File '{local_filename}' uploaded successfully (resumed, {method}).\n")
         data_socket.close()
         final_response = self.receive_response()
         if not final_response.startswith("226"):
@@ -580,6 +760,15 @@ class FTPClientGUI:
         self.path_label = ttk.Label(path_frame, text="Current Path: /")
         self.path_label.pack(side=tk.LEFT, padx=5)
 
+        # 按文件名过滤当前目录，以及显示条目数
+        self.filter_var = tk.StringVar()
+        self.filter_var.trace_add("write", self.schedule_filter)
+        self.filter_entry = ttk.Entry(path_frame, textvariable=self.filter_var)
+        self.filter_entry.pack(side=tk.RIGHT, padx=5)
+        ttk.Label(path_frame, text="Filter:").pack(side=tk.RIGHT, padx=5)
+        self.listing_label = ttk.Label(path_frame, text="")
+        self.listing_label.pack(side=tk.RIGHT, padx=10)
+
         # 主体区域
         main_frame = ttk.Frame(master)
         main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
@@ -594,17 +783,34 @@ class FTPClientGUI:
         self.create_folder_button = self.create_rounded_button("New Folder", self.create_new_folder, left_button_frame, width=15, height=2)
         self.create_folder_button.pack(pady=10)
 
+        self.download_button = self.create_rounded_button("Download", self.download_selected, left_button_frame, width=15, height=2)
+        self.download_button.pack(pady=10)
+
         # 文件列表区域
         file_frame = ttk.Frame(main_frame)
         file_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
-        self.file_tree = ttk.Treeview(file_frame, columns=("name", "type", "size", "modified"), show="headings")
-        self.file_tree.heading("name", text="Name")
-        self.file_tree.heading("type", text="Type")
-        self.file_tree.heading("size", text="Size")
-        self.file_tree.heading("modified", text="Last Modified")
-        self.file_tree.pack(fill=tk.BOTH, expand=True)
+        # 虚拟滚动：Treeview 中只有刚好能显示的几十行，滚动时用这些行显示模型中的不同部分，
+        # 所以滚动条由我们自己根据模型的行数控制，而不是由 Treeview 控制
+        self.file_tree = ttk.Treeview(file_frame, columns=[column for column, _ in FILE_COLUMNS], show="headings")
+        for column, text in FILE_COLUMNS:
+            self.file_tree.heading(column, text=text, command=lambda column=column: self.sort_file_list(column))
+        self.file_scrollbar = ttk.Scrollbar(file_frame, command=self.on_file_scroll)
+        self.file_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.file_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.file_tree.bind("<Double-1>", self.on_double_click)
+        self.file_tree.bind("<Configure>", lambda event: self.measure_file_rows() and self.render_file_list())
+        self.file_tree.bind("<<TreeviewSelect>>", self.on_file_select)
+        # 不带修饰键的单击开始新的选择，清除已经滚出可见范围的选中项
+        self.file_tree.bind("<Button-1>", self.on_file_click)
+        self.file_tree.bind("<Control-Button-1>", lambda event: None)
+        self.file_tree.bind("<Shift-Button-1>", lambda event: None)
+        self.file_tree.bind("<MouseWheel>", lambda event: self.scroll_file_list(self.file_top + (-3 if event.delta > 0 else 3)))
+        self.file_tree.bind("<Button-4>", lambda event: self.scroll_file_list(self.file_top - 3))
+        self.file_tree.bind("<Button-5>", lambda event: self.scroll_file_list(self.file_top + 3))
+        for key, step in (("<Up>", -1), ("<Down>", 1), ("<Prior>", "-page"), ("<Next>", "page"),
+                          ("<Home>", "home"), ("<End>", "end")):
+            self.file_tree.bind(key, lambda event, step=step: self.move_file_cursor(step))
 
         # 右侧按钮区域
         right_button_frame = ttk.Frame(main_frame)
@@ -644,7 +850,7 @@ class FTPClientGUI:
         self.upload_button = self.create_rounded_button("Upload File", self.upload_file, bottom_frame, width=15, height=2)
         self.upload_button.pack(side=tk.RIGHT, padx=5)
         # 刷新按钮
-        self.refresh_button = self.create_rounded_button("Refresh", self.load_file_list, bottom_frame, width=15, height=2)
+        self.refresh_button = self.create_rounded_button("Refresh", lambda: self.load_file_list(refresh=True), bottom_frame, width=15, height=2)
         self.refresh_button.pack(side=tk.RIGHT, padx=5)
         
         # 输出区域
@@ -673,9 +879,59 @@ class FTPClientGUI:
         server_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.server_output_text['yscrollcommand'] = server_scrollbar.set
 
+        # 传输队列：每个任务一行，右侧是操作按钮，底部显示任务数和总吞吐量
+        queue_frame = ttk.LabelFrame(master, text="Transfer Queue")
+        queue_frame.pack(side=tk.BOTTOM, fill=tk.BOTH, padx=10, pady=5)
+
+        queue_button_frame = ttk.Frame(queue_frame)
+        queue_button_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=5)
+        for text, command in (("Pause", self.pause_selected), ("Resume", self.resume_selected),
+                              ("Remove", self.remove_selected), ("Move Up", lambda: self.move_selected(-1)),
+                              ("Move Down", lambda: self.move_selected(1)), ("Priority +", lambda: self.change_priority(1)),
+                              ("Priority -", lambda: self.change_priority(-1)), ("Clear Done", self.clear_finished)):
+            self.create_rounded_button(text, command, queue_button_frame, width=10).pack(fill=tk.X, pady=1)
+
+        queue_status_frame = ttk.Frame(queue_frame)
+        queue_status_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=5)
+        ttk.Label(queue_status_frame, text="Parallel sessions:").pack(side=tk.LEFT)
+        self.parallel_var = tk.StringVar(value="4")
+        self.parallel_spinbox = ttk.Spinbox(queue_status_frame, from_=1, to=16, width=4, textvariable=self.parallel_var,
+                                            command=self.change_concurrency)
+        self.parallel_spinbox.pack(side=tk.LEFT, padx=5)
+        self.queue_label = ttk.Label(queue_status_frame, text="Queue is empty")
+        self.queue_label.pack(side=tk.LEFT, padx=10)
+
+        self.queue_tree = ttk.Treeview(queue_frame, columns=("direction", "name", "size", "progress", "state", "priority"),
+                                       show="headings", height=6)
+        for column, text, width in (("direction", "Direction", 90), ("name", "Name", 300), ("size", "Size", 110),
+                                    ("progress", "Progress", 90), ("state", "State", 220), ("priority", "Priority", 80)):
+            self.queue_tree.heading(column, text=text)
+            self.queue_tree.column(column, width=width)
+        self.queue_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5, pady=5)
+        queue_scrollbar = ttk.Scrollbar(queue_frame, command=self.queue_tree.yview)
+        queue_scrollbar.pack(side=tk.LEFT, fill=tk.Y)
+        self.queue_tree['yscrollcommand'] = queue_scrollbar.set
+
         # FTP客户端实例
         self.ftp_client = None
         self.mode = None
+        self.use_mlsd = True  # 服务器不支持 MLSD 时改为 False，之后直接使用 LIST
+        # 当前目录的列表：模型保存全部条目，Treeview 只显示从 file_top 开始的 file_visible 行
+        self.file_model = FileListModel()
+        self.file_top = 0
+        self.file_visible = 40  # 第一次显示后按实际的行高重新计算
+        self.file_cursor = 0  # 键盘移动的当前行（模型中的位置）
+        self.selected_names = set()  # 按文件名记录选中项，滚动或重新排序后仍然有效
+        self.listing_thread = None
+        self.listing_cancel = None
+        self.filter_job = None
+        # 传输队列在独立的会话上执行下载和上传，不占用浏览目录用的控制连接
+        self.connection_pool = None
+        self.transfer_queue = None
+        self.queue_rows = {}  # 任务 id -> 当前显示的各列的值，只更新发生变化的行
+        self.queue_order = []  # 当前显示的任务顺序
+        self.finished_uploads = deque()  # worker 线程中完成的上传，由刷新函数在主线程中处理
+        self.master.after(QUEUE_REFRESH_MS, self.refresh_queue)
 
     def set_theme(self):
         """设置浅色主题"""
@@ -716,12 +972,17 @@ class FTPClientGUI:
         self.ftp_client = FTP_CLIENT(ip, port, self.update_download_progress, self.update_upload_progress,
                                      self.append_client_output, self.append_server_output)
         self.ftp_client.connect()
+        self.use_mlsd = True
 
         # 登录服务器
         self.ftp_client.login(username, password)
-        
-        # 登录成功后，加载文件列表并启用模式按钮
-        self.load_file_list()
+
+        # 传输队列使用的连接池：每个并行任务借用一条独立的已登录会话
+        self.connection_pool = FTPConnectionPool(ip, port, username, password, size=self.parallel_sessions())
+        self.transfer_queue = TransferQueue(self.connection_pool, on_finish=self.on_transfer_finished)
+
+        # 登录成功后，加载文件列表并启用模式按钮（界面只能在主线程中更新）
+        self.master.after(0, self.load_file_list)
 
         self.connect_button.config(state=tk.DISABLED)
         self.disconnect_button.config(state=tk.NORMAL)
@@ -730,7 +991,13 @@ class FTPClientGUI:
 
     def disconnect(self):
         # 发送QUIT命令并关闭连接
-
+        self.cancel_listing()
+        if self.transfer_queue:
+            # 中止正在进行的传输并关闭队列使用的会话
+            self.transfer_queue.close()
+            self.connection_pool.close()
+            self.transfer_queue = None
+            self.connection_pool = None
         if self.ftp_client:
             # self.ftp_client.send_command("QUIT")
             self.ftp_client.close()
@@ -765,45 +1032,239 @@ class FTPClientGUI:
             self.server_output_text.config(state=tk.DISABLED)
         self.master.after(0, append)
 
-    def load_file_list(self):
-        # 清除旧的文件列表
-        for item in self.file_tree.get_children():
-            self.file_tree.delete(item)
-
-        # 获取服务器文件列表
-        files = self.ftp_client.list_files()  # list_files 方法返回文件信息的列表
-        if files is None:
+    def load_file_list(self, refresh=False):
+        """显示当前目录的文件列表；浏览过的目录直接使用缓存，refresh 为 True 时重新从服务器获取
+
+        列表在后台线程中边接收边解析，主线程每隔 LISTING_POLL_MS 毫秒把新的一批加入模型并刷新可见的行，
+        所以即使目录中有十万个文件，界面也不会停止响应。
+        """
+        self.cancel_listing()
+
+        # 当前路径通常已经从 CWD 的响应中得知，不需要每次都发送 PWD
+        current_path = self.ftp_client.remote_path()
+        self.path_label.config(text=f"Current Path: {current_path}")
+        self.file_top = 0
+        self.file_cursor = 0
+        self.selected_names.clear()
+
+        rows = None if refresh else self.ftp_client.listing_cache.get(current_path)
+        if rows is not None:
+            self.file_model.set_rows(rows)
+            self.render_file_list()
+            self.update_listing_label()
             return
 
-        # 获取当前路径
-        current_path = self.ftp_client.pwd()
-        if current_path:
-            self.path_label.config(text=f"Current Path: {current_path}")
-        else:
-            self.path_label.config(text="Current Path: /")
+        self.file_model.clear()
+        self.render_file_list()
+        self.listing_label.config(text="Loading...")
+        batches = queue.Queue()
+        self.listing_cancel = threading.Event()
+        self.listing_thread = threading.Thread(target=self.fetch_file_list, args=(batches, self.listing_cancel), daemon=True)
+        self.listing_thread.start()
+        self.master.after(LISTING_POLL_MS, self.poll_file_list, batches, current_path, self.listing_cancel)
+
+    def cancel_listing(self):
+        """停止显示正在加载的列表；后台线程要读完剩余的数据，控制连接才能发送下一条命令，所以等它结束"""
+        if self.listing_thread is not None:
+            self.listing_cancel.set()
+            self.listing_thread.join()
+            self.listing_thread = None
+
+    def fetch_file_list(self, batches, cancel):
+        """在后台线程中获取列表，每 LISTING_BATCH 行放入 batches 一次，结束时放入 None，出错时放入异常"""
+        batch = []
+        try:
+            for row in self.iter_file_rows():
+                if cancel.is_set():
+                    continue  # 已经不需要显示了，只是读完剩余的数据
+                batch.append(row)
+                if len(batch) >= LISTING_BATCH:
+                    batches.put(batch)
+                    batch = []
+            batches.put(batch)
+            batches.put(None)
+        except Exception as e:
+            # 任何异常都要通知界面线程，否则 poll_file_list 会一直等待结束标记
+            batches.put(e)
 
-        if len(files) == 0:  # 处理空文件夹的情况
-            # 这里不弹出错误，只是不显示任何内容
+    def iter_file_rows(self):
+        """优先用 MLSD 获取文件列表，服务器不支持时改用 LIST 并解析 ls -l 格式；与 ls -l 一样不显示隐藏文件"""
+        if self.use_mlsd:
+            received = False
+            try:
+                for entry in self.ftp_client.mlsd():
+                    received = True
+                    if not entry.name.startswith("."):
+                        yield row_from_mlsx(entry)
+                return
+            except ConnectionError:
+                if received:
+                    raise
+                self.use_mlsd = False
+        for line in self.ftp_client.iter_list():
+            row = row_from_list_line(line)
+            if row is not None and not row.name.startswith("."):
+                yield row
+
+    def poll_file_list(self, batches, path, cancel):
+        """把后台线程解析好的行加入模型；列表完整接收后放入缓存"""
+        if cancel.is_set():
             return
+        rows = []
+        finished = False
+        while len(rows) < LISTING_ROWS_PER_TICK:
+            try:
+                batch = batches.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(batch, Exception):
+                self.append_client_output(f"Failed to list {path}: {batch}\n")
+                finished = True
+                break
+            if batch is None:
+                self.ftp_client.listing_cache.put(path, self.file_model.rows + rows)
+                finished = True
+                break
+            rows.extend(batch)
+        if rows:
+            self.file_model.extend(rows)
+            self.render_file_list()
+        if finished:
+            self.update_listing_label()
+        else:
+            self.update_listing_label(loading=True)
+            self.master.after(1 if len(rows) >= LISTING_ROWS_PER_TICK else LISTING_POLL_MS,
+                              self.poll_file_list, batches, path, cancel)
+
+    def update_listing_label(self, loading=False):
+        total = len(self.file_model.rows)
+        text = f"{len(self.file_model):,} of {total:,} entries" if self.file_model.filter_text else f"{total:,} entries"
+        self.listing_label.config(text=f"Loading... {text}" if loading else text)
+
+    def render_file_list(self):
+        """让 Treeview 中的行显示模型中从 file_top 开始的部分，并更新滚动条"""
+        total = len(self.file_model)
+        self.file_top = max(0, min(self.file_top, total - self.file_visible))
+        count = min(self.file_visible, total - self.file_top)
+        children = self.file_tree.get_children()
+        now = time.time()
+        selected = []
+        for i in range(count):
+            row = self.file_model[self.file_top + i]
+            values = (row.name, "Directory" if row.is_dir else "File", "" if row.size is None else row.size,
+                      format_modify(row.modify, now))
+            # 行的 iid 是它在可见部分中的位置，滚动时只修改已有行的值
+            if i < len(children):
+                self.file_tree.item(children[i], values=values)
+            else:
+                self.file_tree.insert("", "end", iid=str(i), values=values)
+            if row.name in self.selected_names:
+                selected.append(str(i))
+        if len(children) > count:
+            self.file_tree.delete(*children[count:])
+        self.file_tree.selection_set(selected)
+        self.file_tree.yview_moveto(0)
+        if total:
+            self.file_scrollbar.set(self.file_top / total, (self.file_top + count) / total)
+        else:
+            self.file_scrollbar.set(0, 1)
+        if self.measure_file_rows():
+            self.render_file_list()
+
+    def measure_file_rows(self):
+        """根据第一行的位置和行高计算能完整显示的行数，改变时返回 True"""
+        children = self.file_tree.get_children()
+        bbox = self.file_tree.bbox(children[0]) if children else ""
+        if not bbox:
+            return False  # 还没有显示出来
+        _, y, _, height = bbox
+        visible = max(1, (self.file_tree.winfo_height() - y) // max(1, height))
+        if visible == self.file_visible:
+            return False
+        self.file_visible = visible
+        return True
 
-        # 解析并添加文件信息到Treeview
-        for file in files:
-            file_info = self.parse_file_info(file)
-            self.file_tree.insert("", "end", values=(file_info["name"], file_info["type"], file_info["size"], file_info["modified"]))
-
-    def parse_file_info(self, file):
-        # 假设服务器返回的文件信息类似于：drwxr-xr-x  2 user group 4096 Oct 14 2024 folder_name
-        parts = file.split()
-        file_type = "Directory" if file.startswith("d") else "File"
-        file_size = parts[4]
-        file_modified = " ".join(parts[5:8])
-        file_name = parts[8]
-
-        return {"name": file_name, "type": file_type, "size": file_size, "modified": file_modified}
+    def scroll_file_list(self, top):
+        top = max(0, min(top, len(self.file_model) - self.file_visible))
+        if top != self.file_top:
+            self.file_top = top
+            self.render_file_list()
+        return "break"  # 不让 Treeview 自己滚动
+
+    def on_file_scroll(self, *args):
+        """滚动条的命令：moveto 比例，或 scroll 数量 units/pages"""
+        if args[0] == "moveto":
+            self.scroll_file_list(int(float(args[1]) * len(self.file_model)))
+        elif args[0] == "scroll":
+            step = self.file_visible if args[2] == "pages" else 1
+            self.scroll_file_list(self.file_top + int(args[1]) * step)
+
+    def move_file_cursor(self, step):
+        """键盘移动当前行并选中它，需要时滚动"""
+        total = len(self.file_model)
+        if total == 0:
+            return "break"
+        steps = {"page": self.file_visible, "-page": -self.file_visible, "home": -total, "end": total}
+        index = max(0, min(total - 1, self.file_cursor + steps.get(step, step)))
+        self.file_cursor = index
+        self.selected_names = {self.file_model[index].name}
+        if index < self.file_top:
+            self.file_top = index
+        elif index >= self.file_top + self.file_visible:
+            self.file_top = index - self.file_visible + 1
+        self.render_file_list()
+        self.file_tree.focus(str(index - self.file_top))
+        return "break"
+
+    def on_file_click(self, event):
+        if self.file_tree.identify_region(event.x, event.y) in ("cell", "tree"):
+            self.selected_names.clear()
+
+    def on_file_select(self, event):
+        """把 Treeview 中可见行的选择同步到 selected_names"""
+        children = self.file_tree.get_children()
+        if self.file_top + len(children) > len(self.file_model):
+            return
+        visible = {self.file_model[self.file_top + int(iid)].name for iid in children}
+        selected = {self.file_model[self.file_top + int(iid)].name for iid in self.file_tree.selection()}
+        self.selected_names = (self.selected_names - visible) | selected
+        focus = self.file_tree.focus()
+        if focus:
+            self.file_cursor = self.file_top + int(focus)
+
+    def selected_rows(self):
+        """按显示顺序返回选中的条目（包括滚出可见范围的）"""
+        if not self.selected_names:
+            return []
+        return [row for row in self.file_model.view if row.name in self.selected_names]
+
+    def sort_file_list(self, column):
+        """点击列标题排序，再次点击同一列时反向"""
+        reverse = not self.file_model.sort_reverse if column == self.file_model.sort_column else False
+        self.file_model.set_sort(column, reverse)
+        for name, text in FILE_COLUMNS:
+            arrow = (" \u25bc" if reverse else " \u25b2") if name == column else ""
+            self.file_tree.heading(name, text=text + arrow)
+        self.file_top = 0
+        self.render_file_list()
+
+    def schedule_filter(self, *args):
+        # 输入停顿一下再过滤，避免每个按键都遍历整个列表
+        if self.filter_job is not None:
+            self.master.after_cancel(self.filter_job)
+        self.filter_job = self.master.after(150, self.apply_filter)
+
+    def apply_filter(self):
+        self.filter_job = None
+        if self.file_model.set_filter(self.filter_var.get()):
+            self.file_top = 0
+            self.render_file_list()
+            self.update_listing_label()
 
     def set_port_mode(self):
         """切换到PORT模式并允许用户输入端口号"""
         if self.ftp_client:
+            self.cancel_listing()
             # 弹出输入框让用户输入端口号
             port_input = simpledialog.askstring("PORT Mode", "Enter port number:")
             if port_input:
@@ -827,6 +1288,7 @@ class FTPClientGUI:
     def set_pasv_mode(self):
         """切换到PASV模式"""
         if self.ftp_client:
+            self.cancel_listing()
             if self.ftp_client.enter_pasv_mode():
                 self.mode = "PASV"
                 messagebox.showinfo("Info", "Switched to PASV mode.")
@@ -834,93 +1296,205 @@ class FTPClientGUI:
                 messagebox.showerror("Error", "Failed to switch to PASV mode.")
 
     def on_double_click(self, event):
-        # 获取选中的文件
-        selected_item = self.file_tree.selection()[0]  # 获取选中的行
-        file_name = self.file_tree.item(selected_item)['values'][0]  # 获取文件名
+        # 获取双击的行对应的条目
+        item = self.file_tree.identify_row(event.y)
+        if not item or self.file_top + int(item) >= len(self.file_model):
+            return
+        row = self.file_model[self.file_top + int(item)]
 
         # 判断是否是目录，如果是则进入目录
-        file_type = self.file_tree.item(selected_item)['values'][1]
-        if file_type == "Directory":
-            self.ftp_client.cwd(file_name)  # 进入选中的目录
+        if row.is_dir:
+            self.cancel_listing()
+            self.ftp_client.cwd(row.name)  # 进入选中的目录
             self.load_file_list()  # 进入目录后刷新文件列表
         else:
-            threading.Thread(target=self.download_thread, args=(file_name,), daemon=True).start()
+            self.queue_downloads([row])
 
     def go_to_parent_directory(self):
+        self.cancel_listing()
         self.ftp_client.cwd("..")  # 进入上一级目录
         self.load_file_list()  # 刷新文件列表
 
     def create_new_folder(self):
         folder_name = simpledialog.askstring("New Folder", "Enter folder name:")  # 弹出输入框
         if folder_name:
+            self.cancel_listing()
             self.ftp_client.mkd(folder_name)  # 创建新文件夹
             self.load_file_list()  # 刷新文件列表
 
-    def download_thread(self, filename):
-        # 如果没有ensure_data_connection，说明没有建立有效的数据连接 弹窗错误
-        if not self.ftp_client.ensure_data_connection():
-            messagebox.showerror("Error", "Failed to establish a valid data connection")
+    def download_selected(self):
+        """把文件列表中选中的所有文件加入下载队列（目录被忽略）"""
+        self.queue_downloads(self.selected_rows())
+
+    def queue_downloads(self, rows):
+        if not self.transfer_queue:
+            messagebox.showerror("Error", "Not connected")
+            return
+        for row in rows:
+            if row.is_dir:
+                continue
+            # 与原来一样保存到本地的当前目录
+            self.transfer_queue.add("download", self.ftp_client.remote_path(row.name), os.path.abspath(row.name), row.size)
+
+    def update_download_progress(self, snapshot):
+        # 由 ProgressReporter 的采样线程每 0.1 秒调用一次，使用 after 方法在主线程中执行 GUI 更新
+        self.master.after(0, self.show_progress, self.download_progress, self.download_label, "Download", snapshot)
+
+    def show_progress(self, bar, label, title, snapshot):
+        if snapshot.finished or not snapshot.total:
+            # 传输完成（或大小未知）时重置进度条
+            bar['value'] = 0
+            label.config(text=f"{title} progress: 0%")
             return
-        self.download_progress['value'] = 0  # 重置进度条
-        self.download_label.config(text="Download progress: 0%")
-        threading.Thread(target=self.ftp_client.resume_retr, args=(filename,), daemon=True).start()
-
-
-    def update_download_progress(self, current, total):
-        def gui_update():
-            progress = (current / total) * 100
-            self.download_progress['value'] = progress
-            self.download_label.config(text=f"Download progress: {progress:.2f}%")
-            # 如果下载完成，重置进度条和刷新文件列表
-            if progress >= 100:
-                self.download_progress['value'] = 0
-                self.download_label.config(text="Download progress: 0%")
-                # time.sleep(1)
-                # self.load_file_list()
-        # 使用 after 方法在主线程中执行 GUI 更新
-        self.master.after(0, gui_update)
+        progress = snapshot.transferred * 100 / snapshot.total
+        bar['value'] = progress
+        label.config(text=f"{title} progress: {progress:.2f}% - {format_bytes(snapshot.rate)}/s, "
+                          f"ETA {format_eta(snapshot.eta)}")
 
     def upload_file(self):
-        # 如果没有ensure_data_connection，说明没有建立有效的数据连接 弹窗错误
-        if not self.ftp_client.ensure_data_connection():
-            messagebox.showerror("Error", "Failed to establish a valid data connection")
+        """选择一个或多个本地文件，加入上传队列，上传到当前远程目录"""
+        if not self.transfer_queue:
+            messagebox.showerror("Error", "Not connected")
             return
-        local_filename = filedialog.askopenfilename()
-        if local_filename:
-            self.upload_progress['value'] = 0  # 重置进度条
-            self.upload_label.config(text="Upload progress: 0%")
-            threading.Thread(target=self.upload_thread, args=(local_filename,), daemon=True).start()
-
-    def upload_thread(self, local_filename):
-        self.ftp_client.resume_stor(local_filename)
-
-
-    def update_upload_progress(self, current, total):
-        def gui_update():
-            progress = (current / total) * 100
-            self.upload_progress['value'] = progress
-            self.upload_label.config(text=f"Upload progress: {progress:.2f}%")
-            # 如果上传完成，重置进度条和刷新文件列表
-            if progress >= 100:
-                self.upload_progress['value'] = 0
-                self.upload_label.config(text="Upload progress: 0%")
-                #time.sleep(1)
-                # self.load_file_list()
-        # 使用 after 方法在主线程中执行 GUI 更新
-        self.master.after(0, gui_update)
+        for local_filename in filedialog.askopenfilenames():
+            remote_path = self.ftp_client.remote_path(os.path.basename(local_filename))
+            self.transfer_queue.add("upload", remote_path, local_filename, os.path.getsize(local_filename))
+
+    def update_upload_progress(self, snapshot):
+        self.master.after(0, self.show_progress, self.upload_progress, self.upload_label, "Upload", snapshot)
+
+    # ---------- 传输队列 ----------
+
+    def parallel_sessions(self):
+        try:
+            return max(1, min(16, int(self.parallel_var.get())))
+        except ValueError:
+            return 4
+
+    def change_concurrency(self):
+        if self.transfer_queue:
+            self.transfer_queue.set_concurrency(self.parallel_sessions())
+
+    def selected_jobs(self):
+        if not self.transfer_queue:
+            return []
+        return [int(iid) for iid in self.queue_tree.selection()]
+
+    def pause_selected(self):
+        for job_id in self.selected_jobs():
+            self.transfer_queue.pause(job_id)
+
+    def resume_selected(self):
+        for job_id in self.selected_jobs():
+            self.transfer_queue.resume(job_id)
+
+    def remove_selected(self):
+        for job_id in self.selected_jobs():
+            self.transfer_queue.remove(job_id)
+
+    def clear_finished(self):
+        if self.transfer_queue:
+            self.transfer_queue.clear_finished()
+
+    def move_selected(self, step):
+        # 前移时从最上面的任务开始移动，后移时从最下面的开始，多个选中的任务保持相对顺序
+        selected = [str(job_id) for job_id in self.selected_jobs()]
+        selected = [iid for iid in self.queue_order if iid in selected]
+        for iid in (selected if step < 0 else reversed(selected)):
+            self.transfer_queue.move(int(iid), step)
+
+    def change_priority(self, delta):
+        selected = set(self.selected_jobs())
+        for job in self.transfer_queue.snapshot() if selected else []:
+            if job.id in selected:
+                self.transfer_queue.set_priority(job.id, max(PRIORITY_LOW, min(PRIORITY_HIGH, job.priority + delta)))
+
+    def on_transfer_finished(self, job):
+        # 在 worker 线程中调用，只记录下来，由 refresh_queue 在主线程中处理
+        if job.direction == "upload" and job.state == DONE:
+            self.finished_uploads.append(job.remote_path)
+
+    def job_values(self, job):
+        size = "" if job.size is None else job.size
+        progress = f"{job.transferred * 100 / job.size:.1f}%" if job.size else ("100.0%" if job.state == DONE else "")
+        state = f"{job.state}: {job.error}" if job.state == FAILED else job.state
+        if job.state == RUNNING:
+            state = f"{state} {format_bytes(job.rate)}/s, ETA {format_eta(job.eta)}"
+        return ("Download" if job.direction == "download" else "Upload", job.name, size, progress, state,
+                PRIORITY_NAMES.get(job.priority, job.priority))
+
+    def refresh_queue(self):
+        """定时刷新传输队列：只更新发生变化的行，显示任务数、总吞吐量和上传/下载的总进度
+
+        这里同时是传输进度的采样点：传输线程只记录字节数，速率和剩余时间每 QUEUE_REFRESH_MS 毫秒计算一次。
+        """
+        transfer_queue = self.transfer_queue
+        rate = transfer_queue.throughput() if transfer_queue else 0.0
+        jobs = transfer_queue.snapshot() if transfer_queue else []
+
+        order = [str(job.id) for job in jobs]
+        for iid in set(self.queue_rows) - set(order):
+            self.queue_tree.delete(iid)
+            del self.queue_rows[iid]
+        for job, iid in zip(jobs, order):
+            values = self.job_values(job)
+            if iid not in self.queue_rows:
+                self.queue_tree.insert("", "end", iid=iid, values=values)
+            elif self.queue_rows[iid] != values:
+                self.queue_tree.item(iid, values=values)
+            self.queue_rows[iid] = values
+        if order != self.queue_order:
+            for index, iid in enumerate(order):
+                self.queue_tree.move(iid, "", index)
+            self.queue_order = order
+
+        if transfer_queue:
+            counts = transfer_queue.counts()
+            self.queue_label.config(text=f"{counts['running']} running, {counts['queued']} queued, "
+                                         f"{counts['paused']} paused, {counts['failed']} failed, "
+                                         f"{counts['done']} done - {format_bytes(rate)}/s")
+        else:
+            self.queue_label.config(text="Queue is empty")
+
+        # 进度条显示队列中全部下载/上传任务的总进度、总速率和剩余时间
+        for direction, bar, label, title in (("download", self.download_progress, self.download_label, "Download"),
+                                             ("upload", self.upload_progress, self.upload_label, "Upload")):
+            jobs_in_direction = [job for job in jobs if job.direction == direction]
+            total = sum(job.size or 0 for job in jobs_in_direction)
+            done = sum(job.transferred for job in jobs_in_direction)
+            direction_rate = sum(job.rate for job in jobs_in_direction if job.state == RUNNING)
+            progress = done * 100 / total if total else 0
+            bar['value'] = progress
+            text = f"{title} progress: {progress:.2f}%"
+            if direction_rate > 0:
+                text += f" - {format_bytes(direction_rate)}/s, ETA {format_eta(max(0, total - done) / direction_rate)}"
+            label.config(text=text)
+
+        # 其他会话上传的文件改变了远程目录，使缓存的列表失效；当前目录受影响时重新显示
+        reload = False
+        while self.finished_uploads:
+            directory = posixpath.dirname(self.finished_uploads.popleft())
+            if self.ftp_client:
+                self.ftp_client.listing_cache.invalidate(directory)
+                reload = reload or directory == self.ftp_client.current_dir
+        if reload:
+            self.load_file_list()
+        self.master.after(QUEUE_REFRESH_MS, self.refresh_queue)
 
     def on_right_click(self, event):
-        selected_item = self.file_tree.selection()
-        if selected_item:
+        if self.selected_rows():
             menu = tk.Menu(self.master, tearoff=0)
             menu.add_command(label="Delete Folder", command=self.delete_folder)
             menu.post(event.x_root, event.y_root)
 
     def delete_folder(self):
-        selected_item = self.file_tree.selection()[0]
-        folder_name = self.file_tree.item(selected_item)['values'][0]
+        selected = self.selected_rows()
+        if not selected:
+            return
+        folder_name = selected[0].name
         # 确认删除操作
         if messagebox.askyesno("Delete Folder", f"Are you sure you want to delete folder '{folder_name}'?"):
+            self.cancel_listing()
             self.ftp_client.rmd(folder_name)  # 删除文件夹
             self.load_file_list()  # 刷新文件列表
 def main():
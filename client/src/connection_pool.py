@@ -0,0 +1,195 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from client import FTP_CLIENT
+
+
+class FTPConnectionPool:
+    """保持若干条已登录的控制连接，供批量任务反复借用，省去每次连接、读欢迎信息和 USER/PASS 的开销
+
+    - acquire() 借出一个会话，空闲时间超过 check_after 秒的会话先用 NOOP 检查是否可用；
+    - release() 归还会话，并把 CWD、REST 和数据连接模式复位到初始状态；
+    - 空闲时间超过 max_idle 秒的会话会被关闭，不再复用。
+    同时借出的会话数不超过 size，超过时 acquire() 阻塞等待。
+    """
+
+    def __init__(self, server_ip, server_port, username, password, size=4, directory=None,
+                 max_idle=300, check_after=5, buffer_size=1 << 20, mode_z=False, compress_level=None):
+        # 用作模板的客户端只保存地址和登录凭据，实际会话由 open_session 建立
+        self.template = FTP_CLIENT(server_ip, server_port, buffer_size)
+        self.template.username = username
+        self.template.password = password
+        # mode_z 为 True 时每个会话登录后都用 MODE Z 压缩数据连接
+        self.template.mode_z = mode_z
+        if compress_level is not None:
+            self.template.compress_level = compress_level
+        self.directory = directory  # 会话的初始目录，归还时 CWD 回到这里
+        self.size = size
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.idle = deque()  # (会话, 归还时间)，最近归还的在右端
+        self.in_use = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def open_session(self):
+        session = self.template.open_session(self.directory)
+        if self.directory is None:
+            self.directory = session.pwd() or "/"
+        return session
+
+    def warm_up(self, count=None):
+        """预先建立 count 条（默认 size 条）连接放入空闲队列"""
+        count = self.size if count is None else min(count, self.size)
+        sessions = []
+        with self.condition:
+            count = max(0, count - len(self.idle) - self.in_use)
+            self.in_use += count
+        try:
+            for _ in range(count):
+                sessions.append(self.open_session())
+        finally:
+            with self.condition:
+                self.in_use -= count
+                now = time.monotonic()
+                self.idle.extend((session, now) for session in sessions)
+                self.condition.notify_all()
+        return len(sessions)
+
+    def acquire(self, timeout=None):
+        """借出一个可用的已登录会话，timeout 秒内没有可用会话时抛出 TimeoutError"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            stale = []
+            with self.condition:
+                while True:
+                    if self.closed:
+                        raise ConnectionError("connection pool is closed")
+                    stale += self.evict_locked()
+                    if self.idle or self.in_use + len(self.idle) < self.size:
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError("no FTP session available")
+                    self.condition.wait(remaining)
+                session, released_at = self.idle.pop() if self.idle else (None, None)
+                self.in_use += 1
+            for old in stale:
+                self.discard(old)
+
+            try:
+                if session is None:
+                    return self.open_session()
+                if time.monotonic() - released_at < self.check_after or self.is_healthy(session):
+                    return session
+            except Exception:
+                self.give_back_slot()
+                raise
+            # 健康检查失败：关闭这个会话，再取下一个
+            self.discard(session)
+            self.give_back_slot()
+
+    def release(self, session, discard=False):
+        """归还会话；discard 为 True（例如传输中途出错）时直接关闭而不复用"""
+        try:
+            if discard or self.closed or not self.reset(session):
+                self.discard(session)
+            else:
+                with self.condition:
+                    self.idle.append((session, time.monotonic()))
+        finally:
+            self.give_back_slot()
+
+    @contextmanager
+    def session(self, timeout=None):
+        """with pool.session() as ftp: ... 块内抛出异常时连接被丢弃而不是归还"""
+        session = self.acquire(timeout)
+        try:
+            yield session
+        except BaseException:
+            self.release(session, discard=True)
+            raise
+        self.release(session)
+
+    def is_healthy(self, session):
+        try:
+            session.control_socket.settimeout(5)
+            session.send_command("NOOP")
+            response = session.receive_response()
+            session.control_socket.settimeout(None)
+        except OSError:
+            return False
+        # 不支持 NOOP 的服务器会返回 5xx，但能收到响应就说明连接可用；421 表示服务器即将关闭连接
+        return bool(response) and not response.startswith("421")
+
+    def reset(self, session):
+        """把会话复位到刚登录时的状态，失败时返回 False"""
+        # 客户端状态：关闭 PORT 模式的监听套接字，清空模式标志
+        if session.data_socket:
+            session.data_socket.close()
+            session.data_socket = None
+        session.active_mode = False
+        session.pasv_mode = False
+        if session.recv_buffer:
+            # 还有未读取的响应，说明会话与服务器不同步
+            return False
+        try:
+            if "CWD" in session.session_changes:
+                session.send_command(f"CWD {self.directory}")
+                if not session.receive_response().startswith("250"):
+                    return False
+            if "REST" in session.session_changes:
+                session.send_command("REST 0")
+                if not session.receive_response().startswith("350"):
+                    return False
+        except OSError:
+            return False
+        session.session_changes.clear()
+        return True
+
+    def evict_locked(self):
+        """从空闲队列中取出超过 max_idle 的会话（调用者持有锁），返回需要关闭的会话"""
+        now = time.monotonic()
+        stale = []
+        # 最久未使用的会话在左端
+        while self.idle and now - self.idle[0][1] > self.max_idle:
+            stale.append(self.idle.popleft()[0])
+        return stale
+
+    def evict_idle(self):
+        """关闭空闲超过 max_idle 秒的会话，返回关闭的数量"""
+        with self.condition:
+            stale = self.evict_locked()
+            self.condition.notify_all()
+        for session in stale:
+            self.discard(session)
+        return len(stale)
+
+    def give_back_slot(self):
+        with self.condition:
+            self.in_use -= 1
+            self.condition.notify()
+
+    def discard(self, session):
+        try:
+            session.control_socket.settimeout(2)
+            session.send_command("QUIT")
+            session.receive_response()
+        except OSError:
+            pass
+        try:
+            session.close()
+        except OSError:
+            pass
+
+    def close(self):
+        """关闭所有空闲会话；之后归还的会话也会被直接关闭"""
+        with self.condition:
+            self.closed = True
+            sessions = [session for session, _ in self.idle]
+            self.idle.clear()
+            self.condition.notify_all()
+        for session in sessions:
+            self.discard(session)
@@ -0,0 +1,125 @@
+import time
+from collections import namedtuple
+
+# 目录列表中的一项：modify 是 Unix 时间戳，未知时为 None；size 未知时为 None
+FileRow = namedtuple("FileRow", "name is_dir size modify")
+
+LIST_MONTHS = {name: index for index, name in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), 1)}
+RECENT_SECONDS = 180 * 24 * 3600  # 与 ls -l 一样，半年以内的文件显示时间，更早的显示年份
+
+
+def row_from_mlsx(entry):
+    """把 MLSXEntry 转换成 FileRow"""
+    return FileRow(entry.name, entry.type == "dir", entry.size, entry.modify)
+
+
+def parse_list_time(month, day, year_or_time):
+    """解析 ls -l 中的 "Oct 14 2024" 或 "Oct 14 12:34"，失败时返回 None"""
+    try:
+        month = LIST_MONTHS[month]
+        day = int(day)
+        if ":" in year_or_time:
+            hour, minute = (int(part) for part in year_or_time.split(":", 1))
+            now = time.localtime()
+            year = now.tm_year
+            # 没有年份的时间在未来时说明是去年的文件
+            if (month, day) > (now.tm_mon, now.tm_mday):
+                year -= 1
+        else:
+            year, hour, minute = int(year_or_time), 0, 0
+        return time.mktime((year, month, day, hour, minute, 0, 0, 0, -1))
+    except (KeyError, ValueError, OverflowError):
+        return None
+
+
+def row_from_list_line(line):
+    """解析一行 ls -l 格式的 LIST 输出，例如 drwxr-xr-x 2 user group 4096 Oct 14 2024 folder_name；无法解析时返回 None"""
+    parts = line.split(None, 8)
+    if len(parts) < 9:
+        return None
+    size = int(parts[4]) if parts[4].isdigit() else None
+    name = parts[8]
+    if line.startswith("l") and " -> " in name:
+        name = name.split(" -> ", 1)[0]
+    return FileRow(name, line.startswith("d"), size, parse_list_time(parts[5], parts[6], parts[7]))
+
+
+def format_modify(modify, now=None):
+    if modify is None:
+        return ""
+    now = time.time() if now is None else now
+    if abs(now - modify) < RECENT_SECONDS:
+        return time.strftime("%b %d %H:%M", time.localtime(modify))
+    return time.strftime("%b %d  %Y", time.localtime(modify))
+
+
+class FileListModel:
+    """目录列表的内存模型：所有行保存为紧凑的 FileRow 元组，排序和过滤都在这里完成
+
+    rows 是收到的全部行，view 是过滤并排序后要显示的行；界面只为 view 中可见的一段创建控件。
+    """
+
+    SORT_KEYS = {
+        "name": lambda row: row.name,
+        "type": lambda row: (not row.is_dir, row.name),
+        "size": lambda row: (-1 if row.size is None else row.size, row.name),
+        "modified": lambda row: (0 if row.modify is None else row.modify, row.name),
+    }
+
+    def __init__(self):
+        self.rows = []
+        self.view = []
+        self.sort_column = "name"
+        self.sort_reverse = False
+        self.filter_text = ""
+
+    def __len__(self):
+        return len(self.view)
+
+    def __getitem__(self, index):
+        return self.view[index]
+
+    def matches(self, row):
+        return self.filter_text in row.name.lower()
+
+    def rebuild(self):
+        rows = self.rows if not self.filter_text else [row for row in self.rows if self.matches(row)]
+        self.view = sorted(rows, key=self.SORT_KEYS[self.sort_column], reverse=self.sort_reverse)
+
+    def set_rows(self, rows):
+        self.rows = list(rows)
+        self.rebuild()
+
+    def clear(self):
+        self.rows = []
+        self.view = []
+
+    def extend(self, rows):
+        """追加一批行；已经有序的 view 加上新的一段后重新排序，Timsort 只需合并两段"""
+        self.rows.extend(rows)
+        if self.filter_text:
+            rows = [row for row in rows if self.matches(row)]
+        if rows:
+            self.view.extend(rows)
+            self.view.sort(key=self.SORT_KEYS[self.sort_column], reverse=self.sort_reverse)
+
+    def set_sort(self, column, reverse=False):
+        self.sort_column = column
+        self.sort_reverse = reverse
+        self.view.sort(key=self.SORT_KEYS[column], reverse=reverse)
+
+    def set_filter(self, text):
+        """按文件名过滤（不区分大小写的子串匹配），返回过滤条件是否改变"""
+        text = text.strip().lower()
+        if text == self.filter_text:
+            return False
+        self.filter_text = text
+        self.rebuild()
+        return True
+
+    def index_of(self, name):
+        for index, row in enumerate(self.view):
+            if row.name == name:
+                return index
+        return -1
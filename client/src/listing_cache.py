@@ -0,0 +1,65 @@
+import posixpath
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_remote_path(path):
+    """把远程路径规范成以 "/" 开头、不含 "." 和 ".." 的绝对路径，作为缓存的键"""
+    return posixpath.normpath("/" + path.lstrip("/"))
+
+
+class ListingCache:
+    """按远程绝对路径缓存目录列表，每个会话一个
+
+    - 条目超过 ttl 秒视为过期，下次 get() 时丢弃；
+    - 缓存的目录数超过 max_entries 时淘汰最久未使用的目录（LRU）；
+    - 我们自己的 MKD/RMD/STOR 通过 invalidate()/invalidate_tree() 使受影响的目录失效，
+      其他客户端的修改只能等 TTL 过期或显式刷新。
+    """
+
+    def __init__(self, ttl=30, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # 路径 -> (写入时间, 列表)，最近使用的在末尾
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        """返回缓存的列表，没有缓存或已过期时返回 None"""
+        path = normalize_remote_path(path)
+        with self.lock:
+            item = self.entries.get(path)
+            if item is not None and time.monotonic() - item[0] <= self.ttl:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self.entries[path]
+            self.misses += 1
+            return None
+
+    def put(self, path, listing):
+        path = normalize_remote_path(path)
+        with self.lock:
+            self.entries[path] = (time.monotonic(), listing)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, path):
+        with self.lock:
+            self.entries.pop(normalize_remote_path(path), None)
+
+    def invalidate_tree(self, path):
+        """使 path 及其下所有子目录的缓存失效（用于 RMD 等会影响整棵子树的操作）"""
+        path = normalize_remote_path(path)
+        prefix = path.rstrip("/") + "/"
+        with self.lock:
+            for key in [key for key in self.entries if key == path or key.startswith(prefix)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,408 @@
+import argparse
+import os
+import posixpath
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from client import MLSXEntry
+from connection_pool import FTPConnectionPool
+
+# 树中的一项：相对于镜像根目录、以 "/" 分隔的路径 -> FileInfo
+FileInfo = namedtuple("FileInfo", "is_dir size")
+
+# 传输计划中的一步
+#   mkdir    目标端缺少的目录
+#   new      目标端没有的文件，完整传输
+#   resume   目标端的文件比源端短，用 REST 从 offset 处续传
+#   changed  目标端的文件比源端长，完整重传
+#   delete   源端已经没有的文件（只在 delete=True 时生成）
+#   rmdir    源端已经没有的目录（只在 delete=True 时生成）
+#   conflict 一端是文件、另一端是目录，不处理，只报告
+#   unsafe   名字中有空白字符，不处理，只报告：两个服务器都在第一个空白处截断命令参数，传输会落到另一个文件上
+Action = namedtuple("Action", "kind path size offset")
+
+TRANSFER_KINDS = ("new", "resume", "changed")
+
+# 上传不小于这个大小的文件前先用 ALLO 声明大小，服务器可以预先分配磁盘空间，空间不足时立即拒绝
+ALLO_THRESHOLD = 1 << 20
+
+
+def is_hidden(path):
+    return any(part.startswith(".") for part in path.split("/"))
+
+
+def has_whitespace(path):
+    return any(ch.isspace() for ch in path)
+
+
+def walk_local(root):
+    """遍历本地目录树，返回 {相对路径: FileInfo}；目录的符号链接不跟随，避免循环"""
+    tree = {}
+    pending = [""]
+    while pending:
+        directory = pending.pop()
+        with os.scandir(os.path.join(root, *directory.split("/"))) as it:
+            for entry in it:
+                path = f"{directory}/{entry.name}" if directory else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        tree[path] = FileInfo(True, 0)
+                        pending.append(path)
+                    elif entry.is_file():
+                        tree[path] = FileInfo(False, entry.stat().st_size)
+                except OSError:
+                    continue
+    return tree
+
+
+def list_remote_dir(ftp, directory):
+    """用 LIST 列出远程目录，返回 MLSXEntry 列表（不支持 MLSD 的服务器使用）
+
+    符号链接的目标类型无法从 ls -l 的输出看出，用 SIZE 查询：成功的按文件处理，失败的跳过。
+    """
+    if not ftp.enter_pasv_mode():
+        raise ConnectionError("PASV failed")
+    ftp.send_command(f"LIST {directory}" if directory else "LIST")
+    response = ftp.receive_response()
+    if not (response.startswith("150") or response.startswith("125")):
+        ftp.pasv_mode = False
+        raise ConnectionError(f"LIST: {response}")
+    data_socket = ftp.data_connect()
+    if data_socket is None:
+        ftp.receive_response()
+        ftp.pasv_mode = False
+        raise ConnectionError("LIST data connection failed")
+    try:
+        lines = [line.decode('utf-8', errors='replace') for line in ftp.iter_lines(data_socket)]
+    finally:
+        data_socket.close()
+        ftp.receive_response()
+        ftp.pasv_mode = False
+
+    entries = []
+    links = []
+    for line in lines:
+        # 权限 链接数 用户 组 大小 月 日 时间/年份 文件名
+        parts = line.split(None, 8)
+        if len(parts) < 9 or not parts[4].isdigit():
+            continue  # "total N" 行
+        mode, name = parts[0], parts[8]
+        if mode.startswith("d"):
+            entries.append(MLSXEntry(name, "dir", None, None, ""))
+        elif mode.startswith("-"):
+            entries.append(MLSXEntry(name, "file", int(parts[4]), None, ""))
+        elif mode.startswith("l"):
+            links.append(name.split(" -> ")[0])
+    commands = [f"SIZE {directory}/{name}" if directory else f"SIZE {name}" for name in links]
+    for name, result in zip(links, ftp.pipeline(commands)):
+        if result["response"].startswith("213"):
+            entries.append(MLSXEntry(name, "file", int(result["response"].split()[1]), None, ""))
+    return entries
+
+
+def make_plan(source, target, delete=False, resume=True):
+    """比较源端和目标端的树，按文件大小生成传输计划（Action 列表）
+
+    只比较大小：变长的文件假定只是在末尾追加了内容（例如日志、未传完的文件），用 REST 续传；
+    内容可能被整体改写的文件应该传 resume=False，这样变长的文件也完整重传。
+    计划的顺序就是执行的顺序：先建目录（父目录在前），再传文件，最后删除多余的文件和目录（子目录在前）。
+    """
+    actions = []
+    transfers = []
+    for path in sorted(source):
+        info = source[path]
+        existing = target.get(path)
+        if has_whitespace(path):
+            # 只报告名字本身有空白的项，这样的目录下面的内容随目录一起跳过
+            if has_whitespace(path.rsplit("/", 1)[-1]):
+                actions.append(Action("unsafe", path, info.size, 0))
+        elif existing is not None and existing.is_dir != info.is_dir:
+            actions.append(Action("conflict", path, info.size, 0))
+        elif info.is_dir:
+            if existing is None:
+                actions.append(Action("mkdir", path, 0, 0))
+        elif existing is None:
+            transfers.append(Action("new", path, info.size, 0))
+        elif existing.size < info.size and resume:
+            transfers.append(Action("resume", path, info.size, existing.size))
+        elif existing.size != info.size:
+            transfers.append(Action("changed", path, info.size, 0))
+    # 大文件先开始，避免最后只剩一个大文件在单个会话上传输
+    transfers.sort(key=lambda action: action.size - action.offset, reverse=True)
+    actions += transfers
+
+    if delete:
+        extra = [path for path in target if path not in source]
+        actions += [Action("unsafe", path, 0, 0) for path in sorted(extra)
+                    if has_whitespace(path.rsplit("/", 1)[-1])]
+        extra = [path for path in extra if not has_whitespace(path)]
+        # 源端的文件或目录被删除时，目标端它下面的所有项都在 extra 中，先删文件，再从最深的目录开始删
+        extra.sort(key=lambda path: (target[path].is_dir, -path.count("/"), path))
+        actions += [Action("rmdir" if target[path].is_dir else "delete", path, 0, 0) for path in extra]
+    return actions
+
+
+class Mirror:
+    """在本地目录和远程目录之间做递归镜像
+
+    direction 为 "download" 时以远程目录为源、本地目录为目标，为 "upload" 时相反。
+    远程目录的遍历和文件传输都在连接池的会话上并行进行，同时使用的会话数不超过 pool.size；
+    远程路径都相对于连接池的初始目录（pool.directory），也就是镜像的远程根目录。
+    """
+
+    def __init__(self, pool, local_root, direction="download", delete=False, resume=True, verbose=True):
+        if direction not in ("download", "upload"):
+            raise ValueError(f"unknown direction: {direction}")
+        self.pool = pool
+        self.local_root = local_root
+        self.direction = direction
+        self.delete = delete
+        self.resume = resume
+        self.verbose = verbose
+        self.use_mlsd = True
+        self.remote_missing = False  # 远程根目录不存在（只在 dry run 时出现），按空目录处理
+        self.lock = threading.Lock()
+        self.bytes_moved = 0
+        self.failed = []  # (Action, 错误信息)
+
+    def log(self, message):
+        if self.verbose:
+            print(message, flush=True)
+
+    def local_path(self, path):
+        return os.path.join(self.local_root, *path.split("/"))
+
+    # ---------- 遍历 ----------
+
+    def list_remote(self, directory):
+        with self.pool.session() as ftp:
+            if self.use_mlsd:
+                try:
+                    return list(ftp.mlsd(directory or None))
+                except ConnectionError as e:
+                    # 500/502 表示服务器不认识 MLSD，此后全部改用 LIST；其他错误（如 550）照常抛出
+                    if not str(e).startswith(("500", "502")):
+                        raise
+                    self.use_mlsd = False
+            return list_remote_dir(ftp, directory)
+
+    def walk_remote(self):
+        """并行遍历远程目录树，每个目录的列表在一个会话上获取，返回 {相对路径: FileInfo}"""
+        tree = {}
+        if self.remote_missing:
+            return tree
+        with ThreadPoolExecutor(max_workers=self.pool.size) as executor:
+            pending = {executor.submit(self.list_remote, ""): ""}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    directory = pending.pop(future)
+                    for entry in future.result():
+                        path = posixpath.join(directory, entry.name)
+                        if entry.type == "dir":
+                            tree[path] = FileInfo(True, 0)
+                            pending[executor.submit(self.list_remote, path)] = path
+                        elif entry.type == "file" and entry.size is not None:
+                            tree[path] = FileInfo(False, entry.size)
+        return tree
+
+    def scan(self):
+        """遍历两端，返回 (源端树, 目标端树)"""
+        remote = self.walk_remote()
+        local = walk_local(self.local_root) if os.path.isdir(self.local_root) else {}
+        if not self.use_mlsd:
+            # LIST 和 ls 一样不列出隐藏文件，本地的隐藏文件也不参与比较，否则会被反复上传或删除
+            local = {path: info for path, info in local.items() if not is_hidden(path)}
+        return (remote, local) if self.direction == "download" else (local, remote)
+
+    def plan(self):
+        source, target = self.scan()
+        return make_plan(source, target, self.delete, self.resume)
+
+    # ---------- 执行 ----------
+
+    def transfer(self, action):
+        with self.pool.session() as ftp:
+            if self.direction == "download":
+                moved = ftp.download(action.path, self.local_path(action.path), action.offset)
+            else:
+                local_path = self.local_path(action.path)
+                size = os.path.getsize(local_path)
+                length = size - action.offset
+                if size >= ALLO_THRESHOLD:
+                    # 不支持 ALLO 的服务器返回 5xx，不影响上传
+                    ftp.send_command(f"ALLO {size}")
+                    ftp.receive_response()
+                ftp.send_range(local_path, action.path, action.offset, length)
+                moved = length
+        with self.lock:
+            self.bytes_moved += moved
+        self.log(f"[MIRROR] {action.kind:7} {action.path} ({moved} bytes)")
+
+    def run_transfers(self, actions):
+        with ThreadPoolExecutor(max_workers=self.pool.size) as executor:
+            futures = {executor.submit(self.transfer, action): action for action in actions}
+            for future in futures:
+                try:
+                    future.result()
+                except (OSError, ConnectionError) as e:
+                    self.record_failure(futures[future], e)
+
+    def run_commands(self, actions, command):
+        """在一个会话上批量发送 MKD/DELE/RMD（流水线，服务器按顺序执行，父目录仍然先于子目录）"""
+        if not actions:
+            return
+        with self.pool.session() as ftp:
+            results = ftp.pipeline([f"{command} {action.path}" for action in actions])
+            for action, result in zip(actions, results):
+                if result["response"].startswith("2"):
+                    self.log(f"[MIRROR] {action.kind:7} {action.path}")
+                else:
+                    self.record_failure(action, result["response"])
+
+    def run_local(self, actions, operation):
+        for action in actions:
+            try:
+                operation(self.local_path(action.path))
+                self.log(f"[MIRROR] {action.kind:7} {action.path}")
+            except OSError as e:
+                self.record_failure(action, e)
+
+    def record_failure(self, action, error):
+        with self.lock:
+            self.failed.append((action, str(error)))
+        print(f"[ERROR] {action.kind} {action.path}: {error}", file=sys.stderr, flush=True)
+
+    def run(self, dry_run=False):
+        """遍历、生成计划并执行（dry_run 为 True 时只打印计划），返回统计信息"""
+        start = time.monotonic()
+        actions = self.plan()
+        scanned = time.monotonic() - start
+        by_kind = {}
+        for action in actions:
+            by_kind.setdefault(action.kind, []).append(action)
+
+        if dry_run:
+            for action in actions:
+                detail = f" (from {action.offset})" if action.kind == "resume" else ""
+                print(f"[PLAN] {action.kind:7} {action.path}{detail}")
+        else:
+            for action in by_kind.get("conflict", []):
+                self.record_failure(action, "file/directory type mismatch")
+            for action in by_kind.get("unsafe", []):
+                self.record_failure(action, "names containing whitespace are not supported by the server")
+            if self.direction == "download":
+                os.makedirs(self.local_root, exist_ok=True)
+                self.run_local(by_kind.get("mkdir", []), os.mkdir)
+            else:
+                self.run_commands(by_kind.get("mkdir", []), "MKD")
+            self.run_transfers([action for action in actions if action.kind in TRANSFER_KINDS])
+            if self.direction == "download":
+                self.run_local(by_kind.get("delete", []), os.remove)
+                self.run_local(by_kind.get("rmdir", []), os.rmdir)
+            else:
+                self.run_commands(by_kind.get("delete", []), "DELE")
+                self.run_commands(by_kind.get("rmdir", []), "RMD")
+
+        planned = sum(action.size - action.offset for action in actions if action.kind in TRANSFER_KINDS)
+        return {
+            "direction": self.direction,
+            "dry_run": dry_run,
+            "actions": dict(Counter(action.kind for action in actions)),
+            "planned_bytes": planned,
+            "bytes": self.bytes_moved,
+            "failed": [(action.path, error) for action, error in self.failed],
+            "scan_seconds": scanned,
+            "elapsed": time.monotonic() - start,
+        }
+
+
+def print_summary(summary):
+    actions = ", ".join(f"{kind} {count}" for kind, count in sorted(summary["actions"].items())) or "nothing to do"
+    print(f"[MIRROR] {summary['direction']}: {actions}")
+    if summary["dry_run"]:
+        print(f"[MIRROR] dry run: {summary['planned_bytes']} bytes would be transferred "
+              f"(scan took {summary['scan_seconds']:.2f}s)")
+        return
+    elapsed = summary["elapsed"]
+    rate = summary["bytes"] / elapsed / (1 << 20) if elapsed > 0 else 0.0
+    print(f"[MIRROR] transferred {summary['bytes']} bytes in {elapsed:.2f}s "
+          f"(scan {summary['scan_seconds']:.2f}s, {rate:.2f} MiB/s), {len(summary['failed'])} failed")
+
+
+def ensure_remote_dir(pool, directory, create=True):
+    """检查远程目录是否存在，不存在且 create 为 True 时逐级创建，返回目录最终是否存在"""
+    session = pool.template.open_session()
+    try:
+        session.send_command(f"CWD {directory}")
+        if session.receive_response().startswith("250"):
+            return True
+        if not create:
+            return False
+        parts = [part for part in directory.split("/") if part]
+        prefix = "/" if directory.startswith("/") else ""
+        # 已经存在的上级目录 MKD 会失败，忽略即可
+        for i in range(1, len(parts) + 1):
+            session.send_command(f"MKD {prefix}{'/'.join(parts[:i])}")
+            session.receive_response()
+        session.send_command(f"CWD {directory}")
+        return session.receive_response().startswith("250")
+    finally:
+        pool.discard(session)
+
+
+def run_mirror(server_ip, server_port, username, password, remote_dir, local_dir, direction="download",
+               workers=4, delete=False, resume=True, dry_run=False, verbose=True, buffer_size=1 << 20):
+    """建立连接池并执行一次镜像，返回统计信息"""
+    pool = FTPConnectionPool(server_ip, server_port, username, password, size=workers,
+                             directory=remote_dir, buffer_size=buffer_size)
+    try:
+        mirror = Mirror(pool, local_dir, direction, delete, resume, verbose)
+        if direction == "upload" and remote_dir not in (None, "", "/"):
+            # 上传到尚不存在的目录：先创建；只是 dry run 时不创建，当作空目录生成计划
+            if not ensure_remote_dir(pool, remote_dir, create=not dry_run):
+                if not dry_run:
+                    raise ConnectionError(f"cannot create remote directory {remote_dir}")
+                mirror.remote_missing = True
+        return mirror.run(dry_run)
+    finally:
+        pool.close()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Mirror a directory tree between the local disk and an FTP server.")
+    parser.add_argument("-ip", type=str, default="127.0.0.1", help="Server IP address (default: 127.0.0.1)")
+    parser.add_argument("-port", type=int, default=21, help="Server port (default: 21)")
+    parser.add_argument("-user", type=str, default="anonymous", help="Username (default: anonymous)")
+    parser.add_argument("-password", type=str, default="anonymous@example.com", help="Password")
+    parser.add_argument("-direction", choices=("download", "upload"), default="download",
+                        help="download: remote -> local, upload: local -> remote (default: download)")
+    parser.add_argument("-remote", type=str, default="/", help="Remote directory (default: /)")
+    parser.add_argument("-local", type=str, default=".", help="Local directory (default: .)")
+    parser.add_argument("-workers", type=int, default=4, help="Number of parallel sessions (default: 4)")
+    parser.add_argument("-delete", action="store_true", help="Delete target files that no longer exist at the source")
+    parser.add_argument("-no-resume", action="store_true", help="Retransfer grown files instead of resuming them")
+    parser.add_argument("-dry-run", action="store_true", help="Print the transfer plan without changing anything")
+    parser.add_argument("-quiet", action="store_true", help="Only print errors and the summary")
+    parser.add_argument("-buffer", type=int, default=1024, help="Transfer buffer size in KiB (default: 1024)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    try:
+        summary = run_mirror(args.ip, args.port, args.user, args.password, args.remote, args.local,
+                             args.direction, max(1, args.workers), args.delete, not args.no_resume,
+                             args.dry_run, not args.quiet, args.buffer * 1024)
+    except (OSError, ConnectionError) as e:
+        print(f"[ERROR] mirror failed: {e}", file=sys.stderr)
+        sys.exit(2)
+    print_summary(summary)
+    sys.exit(1 if summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
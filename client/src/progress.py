@@ -0,0 +1,164 @@
+import math
+import sys
+import threading
+import time
+from collections import namedtuple
+
+# 某一时刻的传输进度：transferred/total 为字节数（total 为 None 表示大小未知），rate 为平滑后的字节/秒，
+# eta 为预计剩余秒数（无法估计时为 None），elapsed 为开始以来的秒数，finished 表示这是传输结束时的最后一次
+ProgressSnapshot = namedtuple("ProgressSnapshot", "transferred total rate eta elapsed finished")
+
+
+class RateMeter:
+    """指数加权移动平均（EWMA）的吞吐量
+
+    每次 sample() 传入累计字节数，用与上次采样之间的平均速率更新估计值；权重按时间常数 tau 秒
+    随采样间隔换算，所以采样间隔不固定时平滑程度也一致。
+    """
+
+    def __init__(self, tau=2.0):
+        self.tau = tau
+        self.rate = None
+        self.last_time = None
+        self.last_bytes = 0
+
+    def reset(self, transferred=0, now=None):
+        self.rate = None
+        self.last_time = time.monotonic() if now is None else now
+        self.last_bytes = transferred
+
+    def sample(self, transferred, now=None):
+        """记录累计字节数，返回平滑后的字节/秒"""
+        now = time.monotonic() if now is None else now
+        if self.last_time is None:
+            self.reset(transferred, now)
+            return 0.0
+        elapsed = now - self.last_time
+        if elapsed <= 0:
+            return self.rate or 0.0
+        current = max(0, transferred - self.last_bytes) / elapsed
+        if self.rate is None:
+            self.rate = current
+        else:
+            weight = 1 - math.exp(-elapsed / self.tau)
+            self.rate += weight * (current - self.rate)
+        self.last_time = now
+        self.last_bytes = transferred
+        return self.rate
+
+
+class ProgressReporter:
+    """以固定频率采样传输的字节计数，计算平滑吞吐量和剩余时间，把合并后的进度交给 sink(ProgressSnapshot)
+
+    传输线程只调用 update()（一次属性赋值，不加锁也不做任何输出），独立的采样线程每 interval 秒读取一次计数并调用 sink，
+    所以无论数据块多小、多频繁，sink 每秒最多被调用 1 / interval 次，显示进度也不会拖慢传输本身。
+    多个连接并行传输同一个文件时，每个连接用 part() 取得自己的回调，进度为各部分之和。
+    """
+
+    def __init__(self, sink, total=None, initial=0, interval=0.1, tau=2.0):
+        self.sink = sink
+        self.total = total
+        self.initial = initial  # 续传时已经存在的部分，计入进度但不计入吞吐量
+        self.interval = interval
+        self.meter = RateMeter(tau)
+        self.parts = [0]
+        self.lock = threading.Lock()  # 只保护 part() 中的分配，update() 不加锁
+        self.started = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def update(self, transferred):
+        """传输线程调用：本次传输已经完成的字节数"""
+        self.parts[0] = transferred
+
+    def part(self):
+        """返回一个新的进度回调 callback(transferred)，用于并行传输中的一个连接"""
+        with self.lock:
+            self.parts.append(0)
+            index = len(self.parts) - 1
+
+        def callback(transferred):
+            self.parts[index] = transferred
+        return callback
+
+    def snapshot(self, finished=False):
+        now = time.monotonic()
+        moved = sum(self.parts)
+        rate = self.meter.sample(moved, now)
+        transferred = self.initial + moved
+        eta = None
+        if self.total is not None:
+            if transferred >= self.total:
+                eta = 0.0
+            elif rate > 0:
+                eta = (self.total - transferred) / rate
+        return ProgressSnapshot(transferred, self.total, rate, eta, now - self.started, finished)
+
+    def start(self):
+        self.started = time.monotonic()
+        self.meter.reset(0, self.started)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sink(self.snapshot())
+
+    def stop(self):
+        """停止采样并输出最后一次进度（finished 为 True）"""
+        if self.thread is None or self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.sink(self.snapshot(finished=True))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def format_bytes(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds + 0.5)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+def format_progress(snapshot):
+    """例如 "45.20% (474000000/1048576000 bytes) 112.3 MiB/s ETA 00:05"，大小未知时不显示百分比和剩余时间"""
+    rate = f"{format_bytes(snapshot.rate)}/s"
+    if not snapshot.total:
+        return f"{snapshot.transferred} bytes {rate}"
+    percent = snapshot.transferred * 100 / snapshot.total
+    return (f"{percent:.2f}% ({snapshot.transferred}/{snapshot.total} bytes) {rate} "
+            f"ETA {format_eta(snapshot.eta)}")
+
+
+def console_progress(label, stream=None):
+    """返回在终端的同一行刷新进度的 sink，传输结束时换行"""
+    width = 0
+
+    def sink(snapshot):
+        nonlocal width
+        out = stream or sys.stdout
+        line = f"[INFO] {label}: {format_progress(snapshot)}"
+        if snapshot.finished:
+            line += f" - {snapshot.elapsed:.2f}s"
+        # 新的一行比上一行短时用空格覆盖剩下的字符
+        out.write("\r" + line.ljust(width) + ("\n" if snapshot.finished else ""))
+        out.flush()
+        width = len(line)
+    return sink
@@ -0,0 +1,320 @@
+import os
+import threading
+import time
+
+from progress import RateMeter
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+DONE = "done"
+FAILED = "failed"
+
+# 优先级：数值大的先传，同一优先级内按队列中的顺序
+PRIORITY_LOW = -1
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 1
+
+
+class TransferPaused(Exception):
+    """进度回调中抛出，用来中止正在进行的传输（暂停或移除任务）"""
+
+
+class TransferJob:
+    """队列中的一个传输任务
+
+    remote_path 是远程的绝对路径，local_path 是本地路径；size 为 None 表示大小未知。
+    transferred 是文件中已经完成的字节数（续传时包括之前已有的部分）。
+    """
+
+    def __init__(self, job_id, direction, remote_path, local_path, size=None, priority=PRIORITY_NORMAL, order=0):
+        self.id = job_id
+        self.direction = direction  # "download" 或 "upload"
+        self.remote_path = remote_path
+        self.local_path = local_path
+        self.size = size
+        self.priority = priority
+        self.order = order  # 同一优先级内的先后顺序
+        self.state = QUEUED
+        self.transferred = 0
+        self.error = ""
+        self.resume = False  # 暂停或失败后重新开始时从已有的部分续传
+        self.stop_requested = False
+        self.removed = False
+        self.started = None
+        self.finished = None
+        self.sampled = 0  # 上次采样时的 transferred，之后增加的部分计入队列的总字节数
+        self.meter = RateMeter()
+        self.rate = 0.0  # 平滑后的速率（字节/秒），只在运行中更新
+
+    @property
+    def eta(self):
+        """预计剩余秒数，无法估计时为 None"""
+        if self.state != RUNNING or self.size is None or self.rate <= 0:
+            return None
+        return max(0, self.size - self.transferred) / self.rate
+
+    @property
+    def name(self):
+        return os.path.basename(self.local_path) if self.direction == "upload" else self.remote_path.rsplit("/", 1)[-1]
+
+    def sort_key(self):
+        return (-self.priority, self.order)
+
+
+class TransferQueue:
+    """带并发上限和优先级的传输队列
+
+    每个 worker 线程从连接池借用一条独立的已登录会话执行任务，同时运行的任务数不超过 concurrency，
+    所以任意多个任务也不会在同一条控制连接上交错发送命令。调度时总是取优先级最高、
+    在队列中最靠前的 QUEUED 任务；暂停正在运行的任务会中断数据连接并丢弃该会话，之后恢复时用 REST 续传。
+    所有方法都可以在任意线程中调用；on_finish(job) 在 worker 线程中、任务结束（完成、失败或暂停）时调用。
+    传输线程每个数据块只记录字节数，不加锁；速率和总吞吐量在界面定时调用 throughput() 时统一采样计算。
+    """
+
+    def __init__(self, pool, concurrency=None, on_finish=None, tau=2.0):
+        self.pool = pool
+        self.concurrency = concurrency or pool.size
+        self.on_finish = on_finish
+        self.jobs = {}  # id -> TransferJob
+        self.next_id = 1
+        self.next_order = 0
+        self.workers = 0
+        self.closed = False
+        self.total_bytes = 0  # 所有任务累计传输的字节数
+        self.tau = tau  # 速率 EWMA 的时间常数（秒）
+        self.meter = RateMeter(tau)
+        self.condition = threading.Condition()
+        self.pool.size = max(self.pool.size, self.concurrency)
+
+    # ---------- 添加和调整任务 ----------
+
+    def add(self, direction, remote_path, local_path, size=None, priority=PRIORITY_NORMAL):
+        """加入一个任务并返回它；worker 不足时自动启动"""
+        with self.condition:
+            job = TransferJob(self.next_id, direction, remote_path, local_path, size, priority, self.next_order)
+            self.jobs[job.id] = job
+            self.next_id += 1
+            self.next_order += 1
+            self.start_workers_locked()
+            self.condition.notify()
+        return job
+
+    def pause(self, job_id):
+        """暂停任务：排队中的不再被调度，正在运行的在下一块数据之后中止"""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            if job.state == QUEUED:
+                job.state = PAUSED
+            elif job.state == RUNNING:
+                job.stop_requested = True
+
+    def resume(self, job_id):
+        """把暂停或失败的任务重新放回队列，从已经完成的部分继续"""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job.state not in (PAUSED, FAILED):
+                return
+            job.state = QUEUED
+            job.error = ""
+            job.stop_requested = False
+            self.start_workers_locked()
+            self.condition.notify()
+
+    def remove(self, job_id):
+        """从队列中删除任务；正在运行的任务先被中止"""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            if job.state == RUNNING:
+                job.stop_requested = True
+                job.removed = True  # worker 结束后删除
+            else:
+                del self.jobs[job_id]
+
+    def clear_finished(self):
+        """删除所有已完成的任务"""
+        with self.condition:
+            for job_id in [job.id for job in self.jobs.values() if job.state == DONE]:
+                del self.jobs[job_id]
+
+    def set_priority(self, job_id, priority):
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job.priority = priority
+
+    def move(self, job_id, step):
+        """在等待中的任务（排队或暂停）之间移动任务，step 为 -1 表示前移一位，1 表示后移一位
+
+        移到相邻任务的位置时同时采用它的优先级，这样调度顺序与显示的顺序一致。
+        """
+        with self.condition:
+            pending = sorted((job for job in self.jobs.values() if job.state in (QUEUED, PAUSED)),
+                             key=TransferJob.sort_key)
+            job = self.jobs.get(job_id)
+            if job not in pending:
+                return
+            index = pending.index(job)
+            target = max(0, min(len(pending) - 1, index + step))
+            if target == index:
+                return
+            job.priority = pending[target].priority
+            pending.insert(target, pending.pop(index))
+            # 按新的顺序重新编号
+            for order, pending_job in enumerate(pending):
+                pending_job.order = order
+            self.next_order = max(self.next_order, len(pending))
+
+    def set_concurrency(self, concurrency):
+        """修改同时运行的任务数；减少时多余的 worker 在当前任务结束后退出"""
+        with self.condition:
+            self.concurrency = max(1, concurrency)
+            self.pool.size = max(self.pool.size, self.concurrency)
+            self.start_workers_locked()
+            self.condition.notify_all()
+
+    # ---------- 查询 ----------
+
+    def snapshot(self):
+        """返回所有任务按显示顺序排列的列表：运行中的在前，然后是等待中的（按调度顺序），最后是已结束的"""
+        rank = {RUNNING: 0, QUEUED: 1, PAUSED: 1, FAILED: 2, DONE: 3}
+        with self.condition:
+            return sorted(self.jobs.values(), key=lambda job: (rank[job.state],) + job.sort_key())
+
+    def throughput(self):
+        """采样所有任务的进度：更新运行中任务的 job.rate，返回平滑后的总吞吐量（字节/秒）
+
+        由界面定时调用，调用的间隔就是采样间隔。
+        """
+        now = time.monotonic()
+        with self.condition:
+            for job in self.jobs.values():
+                transferred = job.transferred
+                self.total_bytes += max(0, transferred - job.sampled)
+                job.sampled = transferred
+                if job.state == RUNNING:
+                    job.rate = job.meter.sample(transferred, now)
+            return self.meter.sample(self.total_bytes, now)
+
+    def counts(self):
+        """各状态的任务数"""
+        counts = {QUEUED: 0, RUNNING: 0, PAUSED: 0, DONE: 0, FAILED: 0}
+        with self.condition:
+            for job in self.jobs.values():
+                counts[job.state] += 1
+        return counts
+
+    def wait(self, timeout=None):
+        """等待直到没有排队或运行中的任务，返回 True；超时返回 False"""
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not any(job.state in (QUEUED, RUNNING) for job in self.jobs.values()), timeout)
+
+    def close(self):
+        """停止调度：正在运行的任务被中止（状态变为暂停），worker 随后退出"""
+        with self.condition:
+            self.closed = True
+            for job in self.jobs.values():
+                if job.state == RUNNING:
+                    job.stop_requested = True
+            self.condition.notify_all()
+
+    # ---------- 调度 ----------
+
+    def start_workers_locked(self):
+        pending = sum(1 for job in self.jobs.values() if job.state == QUEUED)
+        while not self.closed and self.workers < min(self.concurrency, pending):
+            self.workers += 1
+            pending -= 1
+            threading.Thread(target=self.worker, daemon=True).start()
+
+    def next_job_locked(self):
+        queued = [job for job in self.jobs.values() if job.state == QUEUED]
+        return min(queued, key=TransferJob.sort_key) if queued else None
+
+    def worker(self):
+        while True:
+            with self.condition:
+                job = None if self.closed or self.workers > self.concurrency else self.next_job_locked()
+                if job is None:
+                    # 没有可调度的任务（或 worker 过多）时退出，新任务加入时再启动
+                    self.workers -= 1
+                    self.condition.notify_all()
+                    return
+                job.state = RUNNING
+                job.started = time.monotonic()
+            self.run_job(job)
+
+    def run_job(self, job):
+        try:
+            with self.pool.session() as ftp:
+                if job.direction == "download":
+                    self.download(ftp, job)
+                else:
+                    self.upload(ftp, job)
+            state, error = DONE, ""
+        except TransferPaused:
+            # 会话在传输中途被中断，连接池已经丢弃它
+            state, error = PAUSED, ""
+        except Exception as e:
+            # 其他异常（例如服务器返回了无法解析的响应）也只让这个任务失败，
+            # 否则工作线程会直接退出，任务停留在 RUNNING，workers 计数也不会减少
+            state, error = FAILED, str(e) or type(e).__name__
+
+        with self.condition:
+            job.state = state
+            job.error = error
+            job.finished = time.monotonic()
+            job.resume = state != DONE and job.transferred > 0
+            job.stop_requested = False
+            job.rate = 0.0
+            if job.removed:
+                self.jobs.pop(job.id, None)
+            self.condition.notify_all()
+        if self.on_finish:
+            self.on_finish(job)
+
+    def start_at(self, job, offset):
+        """任务从 offset 开始传输（续传时为已有的部分），这部分不计入吞吐量"""
+        with self.condition:
+            job.transferred = offset
+            job.sampled = offset
+            job.meter = RateMeter(self.tau)
+            job.meter.reset(offset)
+
+    def progress(self, job, transferred):
+        """传输线程在每个数据块后调用：只记录进度，不加锁；任务被暂停或移除时抛出 TransferPaused 中止传输"""
+        job.transferred = transferred
+        if job.stop_requested:
+            raise TransferPaused()
+
+    def download(self, ftp, job):
+        offset = 0
+        if job.resume and os.path.exists(job.local_path):
+            offset = os.path.getsize(job.local_path)
+            if job.size is not None and offset > job.size:
+                offset = 0
+        self.start_at(job, offset)
+        if job.size is not None and offset == job.size and offset > 0:
+            return
+        ftp.download(job.remote_path, job.local_path, offset,
+                     progress_callback=lambda received: self.progress(job, offset + received))
+        if job.size is None:
+            job.size = job.transferred
+
+    def upload(self, ftp, job):
+        size = os.path.getsize(job.local_path)
+        job.size = size
+        offset = 0
+        if job.resume:
+            remote_size = ftp.size_many([job.remote_path])[job.remote_path]
+            if remote_size is not None and remote_size <= size:
+                offset = remote_size
+        self.start_at(job, offset)
+        ftp.send_range(job.local_path, job.remote_path, offset, size - offset,
+                       progress_callback=lambda sent: self.progress(job, offset + sent))
@@ -0,0 +1,448 @@
+#include "server.h"
+#include <errno.h>
+#include <fcntl.h>
+#include <strings.h>
+#include <openssl/evp.h>
+
+// 文件校验和（HASH、XCRC、XMD5、XSHA1、XSHA256 命令）和持久化的校验和缓存
+// 缓存以 "路径、大小、修改时间、算法、范围" 为键：文件被修改或替换后大小或 mtime 改变，旧记录自然不再命中，
+// 重复查询同一个大文件时不需要再读一遍。缓存文件每行一条记录
+//   路径\t大小\tmtime（纳秒）\t算法\t起点\t终点\t十六进制校验和
+// 记录只追加（O_APPEND 一次写完整行），多个 worker 进程共享同一个文件：
+// 每个进程在内存中保存一张散列表，查找未命中时先读取其他进程新追加的记录。启动时丢弃已经失效的记录。
+
+typedef struct ChecksumEntry
+{
+    char *key; // 记录中校验和之前的部分
+    char hex[HASH_HEX_SIZE];
+    struct ChecksumEntry *next;
+} ChecksumEntry;
+
+static const char *algorithm_names[HASH_ALGORITHMS] = {"SHA-256", "SHA-1", "MD5", "CRC32"};
+
+static ChecksumEntry **buckets = NULL;
+static size_t bucket_count = 0;
+static size_t entry_count = 0;
+
+static char checksum_db_path[MAXSIZE] = HASH_DB_FILE;
+static ino_t loaded_ino = 0;   // 已加载的缓存文件的 inode，文件被替换时重新加载
+static off_t loaded_size = 0;  // 已经读取到的文件偏移（只处理完整的行）
+
+// 算法名（不区分大小写）对应的 HASH_*，未知的算法返回 -1
+int hash_algorithm(const char *name)
+{
+    for (int i = 0; i < HASH_ALGORITHMS; i++)
+    {
+        if (strcasecmp(name, algorithm_names[i]) == 0)
+        {
+            return i;
+        }
+    }
+    return -1;
+}
+
+const char *hash_algorithm_name(int algorithm)
+{
+    return algorithm_names[algorithm];
+}
+
+// FNV-1a 散列
+static size_t hash_key(const char *key)
+{
+    size_t hash = 14695981039346656037ULL;
+    while (*key)
+    {
+        hash ^= (unsigned char)*key++;
+        hash *= 1099511628211ULL;
+    }
+    return hash;
+}
+
+static ChecksumEntry *find_entry(const char *key)
+{
+    if (bucket_count == 0)
+    {
+        return NULL;
+    }
+    ChecksumEntry *entry = buckets[hash_key(key) & (bucket_count - 1)];
+    while (entry != NULL && strcmp(entry->key, key) != 0)
+    {
+        entry = entry->next;
+    }
+    return entry;
+}
+
+static void free_entries(void)
+{
+    for (size_t i = 0; i < bucket_count; i++)
+    {
+        ChecksumEntry *entry = buckets[i];
+        while (entry != NULL)
+        {
+            ChecksumEntry *next = entry->next;
+            free(entry->key);
+            free(entry);
+            entry = next;
+        }
+    }
+    free(buckets);
+    buckets = NULL;
+    bucket_count = 0;
+    entry_count = 0;
+}
+
+// 负载因子超过 0.75 时把桶的数量翻倍
+static int grow_buckets(void)
+{
+    size_t new_count = bucket_count == 0 ? 1024 : bucket_count * 2;
+    ChecksumEntry **new_buckets = (ChecksumEntry **)calloc(new_count, sizeof(ChecksumEntry *));
+    if (new_buckets == NULL)
+    {
+        return -1;
+    }
+    for (size_t i = 0; i < bucket_count; i++)
+    {
+        ChecksumEntry *entry = buckets[i];
+        while (entry != NULL)
+        {
+            ChecksumEntry *next = entry->next;
+            size_t index = hash_key(entry->key) & (new_count - 1);
+            entry->next = new_buckets[index];
+            new_buckets[index] = entry;
+            entry = next;
+        }
+    }
+    free(buckets);
+    buckets = new_buckets;
+    bucket_count = new_count;
+    return 0;
+}
+
+static void insert_entry(const char *key, const char *hex)
+{
+    if (strlen(hex) >= HASH_HEX_SIZE || find_entry(key) != NULL)
+    {
+        return;
+    }
+    if ((entry_count + 1) * 4 > bucket_count * 3 && grow_buckets() < 0)
+    {
+        return;
+    }
+    ChecksumEntry *entry = (ChecksumEntry *)malloc(sizeof(ChecksumEntry));
+    if (entry == NULL || (entry->key = strdup(key)) == NULL)
+    {
+        free(entry);
+        return;
+    }
+    strcpy(entry->hex, hex);
+    size_t index = hash_key(key) & (bucket_count - 1);
+    entry->next = buckets[index];
+    buckets[index] = entry;
+    entry_count++;
+}
+
+// 解析一行记录：最后一个制表符之后是校验和，之前是键
+static void parse_checksum_line(char *line)
+{
+    char *sep = strrchr(line, '\t');
+    if (sep == NULL || sep == line)
+    {
+        return;
+    }
+    *sep = '\0';
+    insert_entry(line, sep + 1);
+}
+
+// 从 offset 开始读取文件中的完整行并加入缓存，返回读取到的位置（最后一个换行符之后）
+static off_t load_from(int fd, off_t offset)
+{
+    char buffer[65536];
+    char line[MAXSIZE + 256];
+    size_t line_len = 0;
+    off_t position = offset;
+    off_t consumed = offset;
+    ssize_t n;
+
+    while ((n = pread(fd, buffer, sizeof(buffer), position)) > 0)
+    {
+        for (ssize_t i = 0; i < n; i++)
+        {
+            if (buffer[i] == '\n')
+            {
+                line[line_len] = '\0';
+                parse_checksum_line(line);
+                line_len = 0;
+                consumed = position + i + 1;
+            }
+            else if (line_len < sizeof(line) - 1)
+            {
+                line[line_len++] = buffer[i];
+            }
+        }
+        position += n;
+    }
+    // 没有换行符结尾的最后一行可能是其他进程正在写入的记录，等下次写完后再读取
+    return consumed;
+}
+
+// 读取缓存文件中其他进程新追加的记录；文件被替换或变短时重新加载整个文件
+static void checksums_refresh(void)
+{
+    struct stat st;
+    if (stat(checksum_db_path, &st) < 0 || (st.st_ino == loaded_ino && st.st_size <= loaded_size))
+    {
+        return;
+    }
+    int fd = open(checksum_db_path, O_RDONLY);
+    if (fd < 0)
+    {
+        return;
+    }
+    if (st.st_ino != loaded_ino)
+    {
+        free_entries();
+        loaded_size = 0;
+    }
+    loaded_size = load_from(fd, loaded_size);
+    loaded_ino = st.st_ino;
+    close(fd);
+}
+
+// 记录对应的文件仍然存在并且大小和修改时间都没有变化时返回 1
+static int entry_is_current(const char *key)
+{
+    char path[MAXSIZE];
+    long long size = 0;
+    long long mtime = 0;
+    const char *sep = strchr(key, '\t');
+    if (sep == NULL || (size_t)(sep - key) >= sizeof(path) || sscanf(sep + 1, "%lld\t%lld", &size, &mtime) != 2)
+    {
+        return 0;
+    }
+    memcpy(path, key, sep - key);
+    path[sep - key] = '\0';
+    struct stat st;
+    return stat(path, &st) == 0 && (long long)st.st_size == size &&
+           (long long)st.st_mtim.tv_sec * 1000000000LL + st.st_mtim.tv_nsec == mtime;
+}
+
+// 把仍然有效的记录重新写入缓存文件（先写临时文件再 rename），返回丢弃的记录数
+static size_t compact_checksums(void)
+{
+    char tmp_path[MAXSIZE + 8];
+    size_t dropped = 0;
+    snprintf(tmp_path, sizeof(tmp_path), "%s.tmp", checksum_db_path);
+    FILE *out = fopen(tmp_path, "w");
+    if (out == NULL)
+    {
+        return 0;
+    }
+    for (size_t i = 0; i < bucket_count; i++)
+    {
+        for (ChecksumEntry **link = &buckets[i]; *link != NULL;)
+        {
+            ChecksumEntry *entry = *link;
+            if (entry_is_current(entry->key))
+            {
+                fprintf(out, "%s\t%s\n", entry->key, entry->hex);
+                link = &entry->next;
+                continue;
+            }
+            *link = entry->next;
+            free(entry->key);
+            free(entry);
+            entry_count--;
+            dropped++;
+        }
+    }
+    if (fclose(out) != 0 || rename(tmp_path, checksum_db_path) < 0)
+    {
+        perror("[ERROR] Failed to compact checksum cache");
+        unlink(tmp_path);
+        return dropped;
+    }
+    struct stat st;
+    if (stat(checksum_db_path, &st) == 0)
+    {
+        loaded_ino = st.st_ino;
+        loaded_size = st.st_size;
+    }
+    return dropped;
+}
+
+// 设置缓存文件的路径并加载，丢弃已经失效的记录；在 fork worker 之前调用，worker 直接共享加载的结果
+void checksums_init(const char *path)
+{
+    if (path != NULL)
+    {
+        strncpy(checksum_db_path, path, sizeof(checksum_db_path) - 1);
+        checksum_db_path[sizeof(checksum_db_path) - 1] = '\0';
+    }
+    free_entries();
+    loaded_ino = 0;
+    loaded_size = 0;
+    checksums_refresh();
+    if (entry_count > 0)
+    {
+        size_t dropped = compact_checksums();
+        printf("[DEBUG] Loaded %zu checksums from %s (%zu stale dropped)\n", entry_count, checksum_db_path, dropped);
+    }
+}
+
+// 追加一条记录；O_APPEND 加上一次 write 写完整行，多个进程同时追加时记录不会交错
+static void save_checksum(const char *key, const char *hex)
+{
+    char record[MAXSIZE + 256];
+    int len = snprintf(record, sizeof(record), "%s\t%s\n", key, hex);
+    if (len < 0 || len >= (int)sizeof(record))
+    {
+        return;
+    }
+    int fd = open(checksum_db_path, O_WRONLY | O_APPEND | O_CREAT, 0600);
+    if (fd < 0)
+    {
+        return; // 缓存文件不可写时只保存在内存中
+    }
+    if (write(fd, record, len) != len)
+    {
+        perror("[ERROR] Failed to write checksum cache");
+    }
+    close(fd);
+}
+
+// 读取 fd 中 [start, end) 的内容计算校验和，以十六进制小写字符串写入 hex；返回 0 或 -1
+static int compute_checksum(int fd, int algorithm, long long start, long long end, char *hex)
+{
+    const EVP_MD *md = algorithm == HASH_SHA256 ? EVP_sha256() : algorithm == HASH_SHA1 ? EVP_sha1() : EVP_md5();
+    EVP_MD_CTX *ctx = NULL;
+    uLong crc = crc32(0L, Z_NULL, 0);
+    char *buffer = (char *)malloc(TRANSFER_BUFSIZE);
+    int result = 0;
+
+    if (buffer == NULL)
+    {
+        return -1;
+    }
+    if (algorithm != HASH_CRC32 && ((ctx = EVP_MD_CTX_new()) == NULL || EVP_DigestInit_ex(ctx, md, NULL) != 1))
+    {
+        EVP_MD_CTX_free(ctx);
+        free(buffer);
+        return -1;
+    }
+    posix_fadvise(fd, start, end - start, POSIX_FADV_SEQUENTIAL);
+
+    while (start < end)
+    {
+        size_t want = end - start < TRANSFER_BUFSIZE ? (size_t)(end - start) : TRANSFER_BUFSIZE;
+        ssize_t n = pread(fd, buffer, want, start);
+        if (n < 0 && errno == EINTR)
+        {
+            continue;
+        }
+        if (n <= 0)
+        {
+            result = -1; // 读取出错，或者文件在计算过程中变短了
+            break;
+        }
+        if (algorithm == HASH_CRC32)
+        {
+            crc = crc32(crc, (const Bytef *)buffer, (uInt)n);
+        }
+        else
+        {
+            EVP_DigestUpdate(ctx, buffer, n);
+        }
+        start += n;
+    }
+
+    if (result == 0 && algorithm == HASH_CRC32)
+    {
+        snprintf(hex, HASH_HEX_SIZE, "%08lx", (unsigned long)crc);
+    }
+    else if (result == 0)
+    {
+        unsigned char digest[EVP_MAX_MD_SIZE];
+        unsigned int digest_len = 0;
+        EVP_DigestFinal_ex(ctx, digest, &digest_len);
+        for (unsigned int i = 0; i < digest_len; i++)
+        {
+            snprintf(hex + i * 2, HASH_HEX_SIZE - i * 2, "%02x", digest[i]);
+        }
+    }
+    EVP_MD_CTX_free(ctx);
+    free(buffer);
+    return result;
+}
+
+// 计算 path 中 [start, end) 的校验和（十六进制小写），end 为 -1 或超过文件大小时到文件末尾为止，
+// 实际使用的终点写入 *end_out。先在缓存中查找，未命中时读取文件并把结果加入缓存。
+// 返回 0 表示成功，-1 表示文件不存在或无法读取，-2 表示范围无效
+int file_checksum(const char *path, int algorithm, long long start, long long end, long long *end_out, char *hex)
+{
+    struct stat st;
+    char key[MAXSIZE + 128];
+    struct timespec begin;
+
+    int fd = open(path, O_RDONLY);
+    if (fd < 0)
+    {
+        return -1;
+    }
+    if (fstat(fd, &st) < 0 || !S_ISREG(st.st_mode))
+    {
+        close(fd);
+        return -1;
+    }
+    if (end < 0 || end > (long long)st.st_size)
+    {
+        end = st.st_size;
+    }
+    if (start < 0 || start > end)
+    {
+        close(fd);
+        return -2;
+    }
+    *end_out = end;
+
+    long long mtime = (long long)st.st_mtim.tv_sec * 1000000000LL + st.st_mtim.tv_nsec;
+    snprintf(key, sizeof(key), "%s\t%lld\t%lld\t%s\t%lld\t%lld", path, (long long)st.st_size, mtime,
+             algorithm_names[algorithm], start, end);
+    // 路径中的制表符和换行符会破坏记录的格式，这样的文件只计算不缓存
+    int cacheable = strpbrk(path, "\t\n") == NULL;
+
+    ChecksumEntry *entry = cacheable ? find_entry(key) : NULL;
+    if (entry == NULL && cacheable)
+    {
+        checksums_refresh(); // 可能是其他 worker 刚计算过的
+        entry = find_entry(key);
+    }
+    if (entry != NULL)
+    {
+        strcpy(hex, entry->hex);
+        close(fd);
+        printf("[DEBUG] %s of %s [%lld, %lld): cached\n", algorithm_names[algorithm], path, start, end);
+        return 0;
+    }
+
+    clock_gettime(CLOCK_MONOTONIC, &begin);
+    if (compute_checksum(fd, algorithm, start, end, hex) < 0)
+    {
+        close(fd);
+        return -1;
+    }
+    // 计算过程中文件被修改时结果照常返回，但不缓存
+    struct stat after;
+    if (cacheable && fstat(fd, &after) == 0 && after.st_size == st.st_size &&
+        after.st_mtim.tv_sec == st.st_mtim.tv_sec && after.st_mtim.tv_nsec == st.st_mtim.tv_nsec)
+    {
+        insert_entry(key, hex);
+        save_checksum(key, hex);
+    }
+    close(fd);
+
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    printf("[DEBUG] %s of %s [%lld, %lld): computed in %.3f s\n", algorithm_names[algorithm], path, start, end,
+           (now.tv_sec - begin.tv_sec) + (now.tv_nsec - begin.tv_nsec) / 1e9);
+    return 0;
+}
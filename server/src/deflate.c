@@ -0,0 +1,256 @@
+#include "server.h"
+#include <errno.h>
+#include <strings.h>
+
+// 已经压缩过的文件格式：MODE Z 下 RETR 这些文件时从一开始就用级别 0，也不再重新尝试压缩
+static const char *compressed_exts[] = {".gz",  ".tgz", ".zip", ".bz2", ".xz",  ".zst", ".7z",   ".rar", ".lz4",
+                                        ".jpg", ".jpeg", ".png", ".gif", ".webp", ".mp3", ".mp4", ".mkv", ".avi",
+                                        ".mov", ".ogg", ".flac", ".pdf", ".docx", ".xlsx", ".pptx", ".jar", ".apk",
+                                        NULL};
+
+// 发送 len 字节，返回 0 或 -1
+static int send_all(int sock, const char *buf, size_t len)
+{
+    while (len > 0)
+    {
+        ssize_t n = send(sock, buf, len, MSG_NOSIGNAL);
+        if (n < 0)
+        {
+            if (errno == EINTR)
+            {
+                continue;
+            }
+            return -1;
+        }
+        buf += n;
+        len -= n;
+    }
+    return 0;
+}
+
+// 按文件扩展名判断内容是否已经压缩过
+int is_compressed_name(const char *name)
+{
+    const char *dot = strrchr(name, '.');
+    if (dot == NULL)
+    {
+        return 0;
+    }
+    for (int i = 0; compressed_exts[i] != NULL; i++)
+    {
+        if (strcasecmp(dot, compressed_exts[i]) == 0)
+        {
+            return 1;
+        }
+    }
+    return 0;
+}
+
+// 压缩 zs 中剩余的全部输入，把产生的输出用 out 作缓冲区发送到 sock，返回 0 或 -1
+// flush 为 Z_NO_FLUSH 时 deflate 可以把一部分数据留在内部，Z_FINISH 时结束压缩流；wire 不为 NULL 时累加发送的字节数
+int deflate_send(z_stream *zs, int sock, int flush, char *out, size_t outsize, atomic_llong *wire)
+{
+    do
+    {
+        zs->next_out = (Bytef *)out;
+        zs->avail_out = (uInt)outsize;
+        if (deflate(zs, flush) == Z_STREAM_ERROR)
+        {
+            return -1;
+        }
+        size_t have = outsize - zs->avail_out;
+        if (send_all(sock, out, have) < 0)
+        {
+            return -1;
+        }
+        if (wire != NULL)
+        {
+            atomic_fetch_add(wire, (long long)have);
+        }
+    } while (zs->avail_out == 0); // 输出缓冲区被填满说明还有没取出的输出
+    return 0;
+}
+
+// 在压缩流中间改变压缩级别：先用 Z_BLOCK 把已有的输入压缩完，再调用 deflateParams，接收端不受影响
+static int set_deflate_level(z_stream *zs, int level, int sock, char *out, size_t outsize, atomic_llong *wire)
+{
+    if (deflate_send(zs, sock, Z_BLOCK, out, outsize, wire) < 0)
+    {
+        return -1;
+    }
+    zs->next_out = (Bytef *)out;
+    zs->avail_out = (uInt)outsize;
+    int ret = deflateParams(zs, level, Z_DEFAULT_STRATEGY);
+    size_t have = outsize - zs->avail_out;
+    if (send_all(sock, out, have) < 0)
+    {
+        return -1;
+    }
+    if (wire != NULL)
+    {
+        atomic_fetch_add(wire, (long long)have);
+    }
+    return ret == Z_OK ? 0 : -1;
+}
+
+// MODE Z 的 RETR：读取 fd 从 offset 开始直到文件末尾的内容，用 deflate 流式压缩后发送，返回读取（压缩前）的字节数，出错时返回 -1
+// progress 为压缩前的字节数，wire 为实际发送的字节数；compressed 为 1 表示文件已知是压缩格式，全程使用级别 0
+// 否则每 ZLIB_WINDOW 字节检查一次压缩率，压缩效果太差时改用级别 0，之后每 ZLIB_REPROBE 个窗口重新尝试 level
+long long send_file_deflate(int dataSocket, int fd, off_t offset, int level, int compressed, atomic_llong *progress,
+                            atomic_llong *wire)
+{
+    z_stream zs;
+    long long total = 0;
+    int current = compressed ? 0 : level; // 当前使用的压缩级别
+    long long window_in = 0;              // 当前窗口读取的字节数
+    long long window_start = 0;           // 当前窗口开始时 wire 的值
+    int idle_windows = 0;                 // 改用级别 0 以来经过的窗口数
+
+    char *in = (char *)malloc(TRANSFER_BUFSIZE);
+    char *out = (char *)malloc(TRANSFER_BUFSIZE);
+    memset(&zs, 0, sizeof(zs));
+    if (in == NULL || out == NULL || deflateInit(&zs, current) != Z_OK)
+    {
+        free(in);
+        free(out);
+        return -1;
+    }
+
+    if (offset > 0 && lseek(fd, offset, SEEK_SET) < 0)
+    {
+        total = -1;
+    }
+    while (total >= 0)
+    {
+        ssize_t n = read(fd, in, TRANSFER_BUFSIZE);
+        if (n < 0 && errno == EINTR)
+        {
+            continue;
+        }
+        if (n < 0)
+        {
+            total = -1;
+            break;
+        }
+        if (n == 0)
+        {
+            // 文件末尾：结束压缩流
+            if (deflate_send(&zs, dataSocket, Z_FINISH, out, TRANSFER_BUFSIZE, wire) < 0)
+            {
+                total = -1;
+            }
+            break;
+        }
+        zs.next_in = (Bytef *)in;
+        zs.avail_in = (uInt)n;
+        if (deflate_send(&zs, dataSocket, Z_NO_FLUSH, out, TRANSFER_BUFSIZE, wire) < 0)
+        {
+            total = -1;
+            break;
+        }
+        total += n;
+        atomic_store(progress, total);
+
+        window_in += n;
+        if (window_in < ZLIB_WINDOW || level == 0 || compressed)
+        {
+            continue;
+        }
+        int next = current;
+        if (current > 0 && atomic_load(wire) - window_start > window_in * ZLIB_MIN_RATIO)
+        {
+            next = 0; // 这一段几乎压缩不了
+            idle_windows = 0;
+        }
+        else if (current == 0 && ++idle_windows >= ZLIB_REPROBE)
+        {
+            next = level; // 内容可能变了（例如归档文件中的下一个成员），重新尝试压缩
+        }
+        if (next != current)
+        {
+            if (set_deflate_level(&zs, next, dataSocket, out, TRANSFER_BUFSIZE, wire) < 0)
+            {
+                total = -1;
+                break;
+            }
+            printf("[DEBUG] MODE Z level %d -> %d after %lld bytes\n", current, next, total);
+            current = next;
+        }
+        window_in = 0;
+        window_start = atomic_load(wire);
+    }
+    deflateEnd(&zs);
+    free(in);
+    free(out);
+    return total;
+}
+
+// MODE Z 的 STOR：从数据连接接收 deflate 压缩流直到对端关闭，解压后从 offset 处写入 fd，返回解压后的字节数
+// 出错时返回 TRANSFER_NET_ERROR（接收失败、压缩数据损坏或压缩流不完整）或 TRANSFER_DISK_ERROR
+long long recv_file_inflate(int dataSocket, int fd, off_t offset, size_t bufsize, atomic_llong *progress,
+                            atomic_llong *wire)
+{
+    z_stream zs;
+    long long total = 0;
+    int ret = Z_OK;
+
+    char *in = (char *)malloc(bufsize);
+    char *out = (char *)malloc(TRANSFER_BUFSIZE);
+    memset(&zs, 0, sizeof(zs));
+    if (in == NULL || out == NULL || inflateInit(&zs) != Z_OK)
+    {
+        free(in);
+        free(out);
+        return TRANSFER_DISK_ERROR;
+    }
+
+    while (ret != Z_STREAM_END && total >= 0)
+    {
+        ssize_t n = recv(dataSocket, in, bufsize, 0);
+        if (n == 0)
+        {
+            break;
+        }
+        if (n < 0)
+        {
+            if (errno == EINTR)
+            {
+                continue;
+            }
+            total = TRANSFER_NET_ERROR;
+            break;
+        }
+        atomic_fetch_add(wire, (long long)n);
+        zs.next_in = (Bytef *)in;
+        zs.avail_in = (uInt)n;
+        do
+        {
+            zs.next_out = (Bytef *)out;
+            zs.avail_out = TRANSFER_BUFSIZE;
+            ret = inflate(&zs, Z_NO_FLUSH);
+            if (ret == Z_NEED_DICT || ret == Z_DATA_ERROR || ret == Z_MEM_ERROR || ret == Z_STREAM_ERROR)
+            {
+                total = TRANSFER_NET_ERROR;
+                break;
+            }
+            size_t have = TRANSFER_BUFSIZE - zs.avail_out;
+            if (have > 0 && pwrite(fd, out, have, offset) != (ssize_t)have)
+            {
+                total = TRANSFER_DISK_ERROR;
+                break;
+            }
+            offset += have;
+            total += have;
+            atomic_store(progress, total);
+        } while (zs.avail_out == 0 && ret != Z_STREAM_END);
+    }
+    // 数据连接在压缩流结束之前就关闭了，文件不完整
+    if (total >= 0 && ret != Z_STREAM_END)
+    {
+        total = TRANSFER_NET_ERROR;
+    }
+    inflateEnd(&zs);
+    free(in);
+    free(out);
+    return total;
+}
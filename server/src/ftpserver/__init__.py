@@ -0,0 +1,6 @@
+from .checksums import ChecksumCache
+from .server import FTPServer
+from .session import FTPSession
+from .users import UserDatabase
+
+__all__ = ["ChecksumCache", "FTPServer", "FTPSession", "UserDatabase"]
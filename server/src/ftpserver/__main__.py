@@ -0,0 +1,42 @@
+import argparse
+import asyncio
+
+from .checksums import ChecksumCache
+from .deflate import ZLIB_DEFAULT_LEVEL
+from .server import FTPServer
+from .users import UserDatabase
+
+
+def parse_arguments():
+    # 参数与 C 服务器相同：-port 和 -root
+    parser = argparse.ArgumentParser(description="Asyncio FTP Server")
+    parser.add_argument('-port', type=int, default=21)
+    parser.add_argument('-root', type=str, default="/tmp")
+    # 用户数据库文件，格式与 C 服务器的 USER_DB_FILE 相同；不指定时只保存在内存中
+    parser.add_argument('-userdb', type=str, default=None)
+    # 校验和缓存文件，格式与 C 服务器的 HASH_DB_FILE 相同；不指定时只保存在内存中
+    parser.add_argument('-hashdb', type=str, default=None)
+    parser.add_argument('-backlog', type=int, default=1024)
+    parser.add_argument('-max-sessions', type=int, default=None)
+    parser.add_argument('-zlevel', type=int, default=ZLIB_DEFAULT_LEVEL, choices=range(10))
+    parser.add_argument('-verbose', action='store_true')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.port <= 0 or args.port > 65535:
+        print(f"Invalid port number: {args.port}")
+        return 1
+    server = FTPServer(args.port, args.root, users=UserDatabase(args.userdb),
+                       backlog=args.backlog, max_sessions=args.max_sessions, verbose=args.verbose,
+                       z_level=args.zlevel, checksums=ChecksumCache(args.hashdb))
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import stat
+import threading
+import zlib
+
+# 与 C 服务器的 HASH_* 宏顺序相同，第一个为默认算法
+HASH_ALGORITHMS = ("SHA-256", "SHA-1", "MD5", "CRC32")
+HASHLIB_NAMES = {"SHA-256": "sha256", "SHA-1": "sha1", "MD5": "md5"}
+READ_SIZE = 1 << 20
+
+
+def hash_algorithm(name):
+    """算法名（不区分大小写）对应的标准写法，未知的算法返回 None"""
+    for algorithm in HASH_ALGORITHMS:
+        if name.upper() == algorithm:
+            return algorithm
+    return None
+
+
+def compute_checksum(f, algorithm, start, end):
+    """读取 f 中 [start, end) 的内容，返回十六进制小写的校验和；文件在读取过程中变短时抛出 OSError"""
+    crc = 0
+    digest = None if algorithm == "CRC32" else hashlib.new(HASHLIB_NAMES[algorithm])
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        data = f.read(min(READ_SIZE, remaining))
+        if not data:
+            raise OSError("file shrank while hashing")
+        if digest is None:
+            crc = zlib.crc32(data, crc)
+        else:
+            digest.update(data)
+        remaining -= len(data)
+    return f"{crc:08x}" if digest is None else digest.hexdigest()
+
+
+class ChecksumCache:
+    """文件校验和缓存，格式与 C 服务器的 HASH_DB_FILE 相同，每行一条记录
+
+        路径\\t大小\\tmtime（纳秒）\\t算法\\t起点\\t终点\\t十六进制校验和
+
+    文件被修改后大小或 mtime 改变，旧记录不再命中；加载时丢弃已经失效的记录。
+    path 为 None 时只保存在内存中，不读写文件。
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()  # checksum() 在线程池中运行
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    key, sep, hex_digest = line.rstrip("\n").rpartition("\t")
+                    if sep:
+                        self.entries[key] = hex_digest
+            self.compact()
+
+    @staticmethod
+    def is_current(key):
+        fields = key.split("\t")
+        try:
+            st = os.stat(fields[0])
+            return st.st_size == int(fields[1]) and st.st_mtime_ns == int(fields[2])
+        except (OSError, IndexError, ValueError):
+            return False
+
+    def compact(self):
+        """把仍然有效的记录重新写入缓存文件（先写临时文件再替换）"""
+        self.entries = {key: value for key, value in self.entries.items() if self.is_current(key)}
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(f"{key}\t{value}\n" for key, value in self.entries.items())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"[ERROR] Failed to compact checksum cache: {e}")
+
+    def save(self, key, hex_digest):
+        if not self.path:
+            return
+        try:
+            # 与 C 服务器相同，一次写入完整的一行，多个进程同时追加时不会交错
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, f"{key}\t{hex_digest}\n".encode("utf-8"))
+            finally:
+                os.close(fd)
+        except OSError as e:
+            print(f"[ERROR] Failed to write checksum cache: {e}")
+
+    def checksum(self, path, algorithm, start=0, end=None):
+        """返回 (终点, 校验和, 是否命中缓存)，范围为 [start, end)，end 为 None 或超过文件大小时到文件末尾为止
+
+        文件不存在或不是普通文件时抛出 OSError，范围无效时抛出 ValueError。
+        """
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                raise IsADirectoryError(path)
+            if end is None or end > st.st_size:
+                end = st.st_size
+            if start < 0 or start > end:
+                raise ValueError("invalid range")
+            key = f"{path}\t{st.st_size}\t{st.st_mtime_ns}\t{algorithm}\t{start}\t{end}"
+            # 路径中的制表符和换行符会破坏记录的格式，这样的文件只计算不缓存
+            cacheable = "\t" not in path and "\n" not in path
+            with self.lock:
+                hex_digest = self.entries.get(key) if cacheable else None
+            if hex_digest is not None:
+                return end, hex_digest, True
+            hex_digest = compute_checksum(f, algorithm, start, end)
+            after = os.fstat(f.fileno())
+        # 计算过程中文件被修改时结果照常返回，但不缓存
+        if cacheable and (after.st_size, after.st_mtime_ns) == (st.st_size, st.st_mtime_ns):
+            with self.lock:
+                self.entries[key] = hex_digest
+            self.save(key, hex_digest)
+        return end, hex_digest, False
@@ -0,0 +1,91 @@
+import posixpath
+import struct
+import zlib
+
+# MODE Z 的参数与 C 服务器的 ZLIB_* 宏相同
+ZLIB_DEFAULT_LEVEL = 6
+ZLIB_WINDOW = 1 << 20  # 每压缩这么多字节检查一次压缩率
+ZLIB_MIN_RATIO = 0.9  # 压缩后仍超过原大小的 90% 时认为内容已经压缩过，改用级别 0
+ZLIB_REPROBE = 64  # 改用级别 0 之后每隔多少个窗口重新尝试压缩
+
+# 已经压缩过的文件格式，从一开始就用级别 0
+COMPRESSED_EXTS = frozenset((
+    ".gz", ".tgz", ".zip", ".bz2", ".xz", ".zst", ".7z", ".rar", ".lz4",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".mp3", ".mp4", ".mkv", ".avi",
+    ".mov", ".ogg", ".flac", ".pdf", ".docx", ".xlsx", ".pptx", ".jar", ".apk",
+))
+
+ZLIB_HEADER = b"\x78\x9c"
+HISTORY = 32 * 1024  # deflate 的窗口大小，换级别时把最近的数据作为新压缩器的字典
+
+
+def is_compressed_name(name):
+    return posixpath.splitext(name)[1].lower() in COMPRESSED_EXTS
+
+
+class AdaptiveDeflate:
+    """MODE Z 发送端（服务器的 RETR 和客户端的 STOR 共用）：输出一个完整的 zlib 流，压缩效果太差时自动改用级别 0
+
+    zlib.compressobj 不能在压缩过程中改变级别，所以这里自己写 zlib 头和 adler32 校验和，
+    中间是原始 deflate 数据：换级别时先用 Z_SYNC_FLUSH 结束当前的块，再换一个新的原始压缩器继续，
+    接收端看到的仍然是一个连续的 deflate 流，用普通的 zlib.decompressobj 就能解压。
+    """
+
+    def __init__(self, level=ZLIB_DEFAULT_LEVEL, compressed=False):
+        self.level = level
+        self.fixed = compressed or level == 0  # 不再检查压缩率
+        self.current = 0 if compressed else level
+        self.compressor = self.new_compressor(self.current)
+        self.adler = 1
+        self.started = False
+        self.total_in = 0
+        self.total_out = 0
+        self.window_in = 0
+        self.window_out = 0
+        self.idle_windows = 0
+
+    @staticmethod
+    def new_compressor(level, history=b""):
+        if history:
+            return zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=history)
+        return zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    def emit(self, parts):
+        if not self.started:
+            self.started = True
+            parts.insert(0, ZLIB_HEADER)
+        out = b"".join(parts)
+        self.total_out += len(out)
+        self.window_out += len(out)
+        return out
+
+    def compress(self, data):
+        """压缩一块数据，返回可以立即发送的字节（可能为空）"""
+        self.adler = zlib.adler32(data, self.adler)
+        parts = [self.compressor.compress(data)]
+        self.total_in += len(data)
+        self.window_in += len(data)
+        if self.window_in >= ZLIB_WINDOW and not self.fixed:
+            self.check_window(parts, data)
+        return self.emit(parts)
+
+    def check_window(self, parts, data):
+        window_out = self.window_out + sum(len(part) for part in parts)
+        level = self.current
+        if self.current > 0 and window_out > self.window_in * ZLIB_MIN_RATIO:
+            level = 0  # 这一段几乎压缩不了
+            self.idle_windows = 0
+        elif self.current == 0:
+            self.idle_windows += 1
+            if self.idle_windows >= ZLIB_REPROBE:
+                level = self.level  # 内容可能变了，重新尝试压缩
+        if level != self.current:
+            parts.append(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+            self.compressor = self.new_compressor(level, bytes(data[-HISTORY:]))
+            self.current = level
+        self.window_in = 0
+        self.window_out = -sum(len(part) for part in parts)  # emit 会加上本次的输出
+
+    def flush(self):
+        """结束压缩流：最后一个块和 adler32 校验和"""
+        return self.emit([self.compressor.flush(), struct.pack(">I", self.adler)])
@@ -0,0 +1,89 @@
+import grp
+import os
+import pwd
+import stat
+import time
+from functools import lru_cache
+
+# ls -l 对超过半年的文件显示年份而不是时间
+SIX_MONTHS = 182 * 24 * 3600
+
+
+@lru_cache(maxsize=256)
+def user_name(uid):
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+@lru_cache(maxsize=256)
+def group_name(gid):
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        return str(gid)
+
+
+def format_entry(name, st, now, link_target=None):
+    """按 ls -l 的格式生成一行"""
+    if abs(now - st.st_mtime) > SIX_MONTHS:
+        mtime = time.strftime("%b %e  %Y", time.localtime(st.st_mtime))
+    else:
+        mtime = time.strftime("%b %e %H:%M", time.localtime(st.st_mtime))
+    if link_target is not None:
+        name = f"{name} -> {link_target}"
+    return (f"{stat.filemode(st.st_mode)} {st.st_nlink} {user_name(st.st_uid)} {group_name(st.st_gid)} "
+            f"{st.st_size} {mtime} {name}")
+
+
+def list_directory(path):
+    """生成与 ls -l 相同格式的目录列表；path 是文件时只列出这个文件"""
+    now = time.time()
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        # 只显示文件名，不暴露服务器上的根目录路径
+        return format_entry(os.path.basename(path), st, now) + "\r\n"
+
+    lines = []
+    blocks = 0
+    with os.scandir(path) as it:
+        entries = sorted((entry for entry in it if not entry.name.startswith(".")), key=lambda e: e.name)
+    for entry in entries:
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        target = os.readlink(entry.path) if stat.S_ISLNK(st.st_mode) else None
+        blocks += st.st_blocks
+        lines.append(format_entry(entry.name, st, now, target))
+    # ls 以 1K 为单位统计 total，st_blocks 以 512 字节为单位
+    lines.insert(0, f"total {blocks // 2}")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def mlsx_entry(path, st, display):
+    """生成 MLSD/MLST 格式的一行 "type=file;size=N;modify=YYYYMMDDHHMMSS;perm=...; name"（不含行尾）"""
+    writable = os.access(path, os.W_OK)
+    if stat.S_ISDIR(st.st_mode):
+        kind = "dir"
+        perm = ("e" if os.access(path, os.X_OK) else "") + ("l" if os.access(path, os.R_OK) else "")
+        perm += "cmp" if writable else ""
+    else:
+        kind = "file" if stat.S_ISREG(st.st_mode) else "OS.unix=special"
+        perm = ("r" if os.access(path, os.R_OK) else "") + ("aw" if writable else "")
+    modify = time.strftime("%Y%m%d%H%M%S", time.gmtime(st.st_mtime))
+    return f"type={kind};size={st.st_size};modify={modify};perm={perm}; {display}"
+
+
+def list_mlsd(path):
+    """MLSD 格式的目录列表；符号链接按照目标列出，目标不存在时跳过"""
+    lines = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            lines.append(mlsx_entry(entry.path, st, entry.name))
+    return "".join(line + "\r\n" for line in lines)
@@ -0,0 +1,73 @@
+import asyncio
+import os
+
+from .checksums import ChecksumCache
+from .deflate import ZLIB_DEFAULT_LEVEL
+from .session import FTPSession
+from .users import UserDatabase
+
+
+class FTPServer:
+    """与 C 服务器命令集相同的 asyncio FTP 服务器
+
+    C 服务器为每个连接 fork 一个子进程；这里所有会话都在同一个事件循环中运行，
+    一个进程就可以同时保持大量空闲或正在传输的会话，也可以直接嵌入到其它 Python 程序中。
+    """
+
+    def __init__(self, port=21, root_dir="/tmp", host="0.0.0.0", users=None,
+                 backlog=1024, buffer_size=1 << 18, data_timeout=30, max_sessions=None, verbose=False,
+                 z_level=ZLIB_DEFAULT_LEVEL, checksums=None):
+        self.port = port
+        self.root_dir = os.path.abspath(root_dir)
+        self.host = host
+        self.users = users if users is not None else UserDatabase()
+        self.backlog = backlog
+        self.buffer_size = buffer_size  # 接收上传数据时每次读取的字节数
+        self.data_timeout = data_timeout  # 等待数据连接建立的秒数
+        self.max_sessions = max_sessions  # 同时进行的会话数上限，None 表示不限制
+        self.verbose = verbose
+        self.z_level = z_level  # MODE Z 的默认压缩级别，会话可以用 OPTS MODE Z LEVEL n 修改
+        self.checksums = checksums if checksums is not None else ChecksumCache()  # HASH 等命令的校验和缓存
+        self.server = None
+        self.sessions = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port,
+                                                 backlog=self.backlog, reuse_address=True)
+        # 端口为 0 时由内核分配，这里记录实际监听的端口
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def handle_client(self, reader, writer):
+        if self.max_sessions is not None and len(self.sessions) >= self.max_sessions:
+            # 与 C 服务器的 fork 模式相同，超过上限的连接收到 421 后被关闭
+            writer.write(b"421 Too many users, please try again later.\r\n")
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+            return
+        session = FTPSession(self, reader, writer)
+        self.sessions.add(session)
+        try:
+            await session.run()
+        finally:
+            self.sessions.discard(session)
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        print(f"Server started on port {self.port}")
+        print(f"Serving files from root directory: {self.root_dir}")
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        """停止接受新连接并关闭所有会话"""
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        for session in list(self.sessions):
+            session.closing = True
+            session.writer.close()
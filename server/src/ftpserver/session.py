@@ -0,0 +1,810 @@
+import asyncio
+import fcntl
+import os
+import posixpath
+import time
+import zlib
+from collections import deque
+
+from .checksums import HASH_ALGORITHMS, hash_algorithm
+from .deflate import AdaptiveDeflate, is_compressed_name
+from .listing import list_directory, list_mlsd, mlsx_entry
+
+# 状态与 C 服务器的 STATE_* 宏相同
+STATE_WAITING_USER = 0
+STATE_WAITING_PASS = 1
+STATE_CLIENT_LOGIN = 2
+
+WELCOME_MSG = "220 ftp.ssast.org FTP server ready.\r\n"
+PASS_MSG = ("230-Welcome to\r\n"
+            "230- School of Software\r\n"
+            "230- FTP Archives at ftp.ssast.org\r\n"
+            "230-\r\n"
+            "230-This site is provided as a public service by School of\r\n"
+            "230-Software. Use in violation of any applicable laws is strictly\r\n"
+            "230-prohibited. We make no guarantees, explicit or implicit, about the\r\n"
+            "230-contents of this site. Use at your own risk.\r\n"
+            "230-\r\n"
+            "230 Guest login ok, access restrictions apply.\r\n")
+# {hash} 为 HASH 支持的算法，当前选择的算法后面加 '*'
+FEAT_MSG = ("211-Features:\r\n"
+            " HASH {hash}\r\n"
+            " MLST type*;size*;modify*;perm*;\r\n"
+            " MODE Z\r\n"
+            " RANG STREAM\r\n"
+            " REST STREAM\r\n"
+            " SIZE\r\n"
+            " XCRC\r\n"
+            " XMD5\r\n"
+            " XSHA1\r\n"
+            " XSHA256\r\n"
+            "211 End\r\n")
+QUIT_MSG = ("221-Thank you for using the FTP service on ftp.ssast.org.\r\n"
+            "221 Goodbye.\r\n")
+SENDFILE_CHUNK = 1 << 24  # RETR 每次 sendfile 的字节数，每发送完一块更新一次 STAT 显示的进度
+MAX_DEFERRED = 64  # 传输期间最多推迟的命令数，超过时暂停读取控制连接，与 C 服务器缓冲区满时相同
+IMMEDIATE_COMMANDS = ("ABOR", "STAT")  # 传输进行中立即处理的命令
+
+
+class TransferProgress:
+    """STAT 显示的 RETR/STOR 进度，对应 C 服务器的 Transfer 结构"""
+
+    def __init__(self, command, name, offset, size, mode_z):
+        self.command = command
+        self.name = name
+        self.offset = offset
+        self.size = size  # RETR 时为文件大小
+        self.mode_z = mode_z
+        self.bytes = 0  # 本次传输的字节数（不含续传偏移，MODE Z 时为解压后的字节数）
+        self.wire_bytes = 0  # MODE Z 时数据连接上压缩后的字节数
+        self.started = time.monotonic()
+
+
+class FTPSession:
+    """一个控制连接的状态和命令处理，对应 C 服务器中每个子进程的 FtpState
+
+    所有会话共享同一个事件循环：控制连接和数据连接都是非阻塞的，
+    传输在单独的任务中进行。与 C 服务器相同，传输期间控制连接继续读取命令：ABOR 和 STAT 立即处理，
+    其他命令（包括 QUIT）按顺序推迟到传输结束后处理。
+    """
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.state = STATE_WAITING_USER
+        self.username = ""
+        self.current_dir = "/"  # 相对于根目录的当前目录
+        # 数据连接状态
+        self.port_address = None  # PORT 命令指定的 (ip, port)
+        self.pasv_server = None
+        self.pasv_connection = None  # 等待客户端连入 PASV 端口的 Future
+        self.data_connection_active = False
+        self.transfer_offset = 0
+        self.mode_z = False  # MODE Z：数据连接上的内容经 deflate 压缩
+        self.z_level = server.z_level
+        self.hash_algorithm = HASH_ALGORITHMS[0]  # HASH 命令使用的算法，用 OPTS HASH 修改
+        self.rang = None  # RANG 设置的 (起点, 终点)，包含两端，只对下一次 HASH 有效
+        self.transfer = None  # 正在进行的传输任务
+        # 最近一次传输的任务：传输协程在回复 226 等之前就清空 self.transfer，任务本身要到关闭数据连接、清理状态之后才结束
+        self.transfer_task = None
+        self.progress = None  # 正在进行的 RETR/STOR 的 TransferProgress
+        self.deferred = deque()  # 传输期间收到、推迟到传输结束后处理的命令行
+        self.closing = False
+
+    def debug(self, message):
+        if self.server.verbose:
+            print(f"[DEBUG] {message}")
+
+    def reply(self, message):
+        self.writer.write(message.encode("utf-8"))
+
+    async def run(self):
+        self.reply(WELCOME_MSG)
+        read = None  # 正在等待的 readline，等待传输结束时保留到下一轮
+        try:
+            while not self.closing:
+                if self.deferred and not self.transferring():
+                    # 传输已经结束，按顺序处理推迟的命令
+                    await self.handle(self.deferred.popleft())
+                    await self.writer.drain()
+                    continue
+                if self.deferred:
+                    # 还有推迟的命令时同时等待新的命令和传输结束；推迟的命令太多时只等待传输结束
+                    waiting = {self.transfer_task}
+                    if len(self.deferred) < MAX_DEFERRED:
+                        if read is None:
+                            read = asyncio.ensure_future(self.reader.readline())
+                        waiting.add(read)
+                    await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                    if read is None or not read.done():
+                        continue
+                elif read is None:
+                    read = asyncio.ensure_future(self.reader.readline())
+                try:
+                    line = await read
+                except (ValueError, asyncio.LimitOverrunError):
+                    # 命令行超过 StreamReader 的长度限制
+                    self.reply("500 Command line too long.\r\n")
+                    break
+                finally:
+                    read = None
+                if not line:
+                    break
+                await self.receive(line.decode("utf-8", errors="replace"))
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            if read is not None:
+                read.cancel()
+            await self.cleanup()
+
+    async def cleanup(self):
+        if self.transfer:
+            self.transfer.cancel()
+            try:
+                await self.transfer
+            except (asyncio.CancelledError, Exception):
+                pass
+        self.close_pasv()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    @staticmethod
+    def split_command(line):
+        """与 C 服务器相同：跳过行首的 Telnet IP/Synch 字节（解码后为 U+FFFD），按空白分割"""
+        return line.lstrip("\ufffd").split()
+
+    def transferring(self):
+        """传输任务还没有完全结束"""
+        return self.transfer_task is not None and not self.transfer_task.done()
+
+    async def receive(self, line):
+        """处理控制连接上收到的一行：传输进行中或者已经有推迟的命令时，ABOR 和 STAT 以外的命令推迟处理"""
+        tokens = self.split_command(line)
+        if tokens and (self.transferring() or self.deferred) and tokens[0].upper() not in IMMEDIATE_COMMANDS:
+            self.debug(f"Deferred during transfer: {tokens[0]}")
+            self.deferred.append(line)
+            return
+        await self.handle(line)
+
+    async def handle(self, line):
+        # 与 C 服务器的 sscanf("%s %s") 相同：只取命令和第一个参数
+        tokens = self.split_command(line)
+        if not tokens:
+            return
+        command = tokens[0].upper()
+        arg = tokens[1] if len(tokens) > 1 else ""
+        self.debug(f"Command received: {command}, Argument: {arg}")
+
+        # 正在传输文件时 receive 只会交来 ABOR 和 STAT
+        if self.transfer:
+            if command == "ABOR":
+                await self.ftp_abor()
+            elif command == "STAT":
+                await self.ftp_stat()
+            else:
+                self.reply("425 Unable to process command during transfer.\r\n")
+            return
+
+        if self.state == STATE_WAITING_USER:
+            if command == "USER":
+                self.ftp_user(arg)
+            else:
+                self.reply("530 Please login with USER and PASS.\r\n")
+        elif self.state == STATE_WAITING_PASS:
+            if command == "PASS":
+                self.ftp_pass(arg)
+            else:
+                self.reply("530 Please login with USER and PASS.\r\n")
+        else:
+            handler = self.commands.get(command)
+            if handler is None:
+                self.reply(f"502 Command not implemented: {command}\r\n")
+            else:
+                await handler(self, arg, tokens[2:])
+
+    # ---------- 登录 ----------
+
+    def ftp_user(self, username):
+        self.username = username
+        if username == "anonymous":
+            self.reply("331 Please specify the password.\r\n")
+        else:
+            self.reply("331 Username accepted, please specify the password.\r\n")
+        self.state = STATE_WAITING_PASS
+
+    def ftp_pass(self, password):
+        users = self.server.users
+        result = users.check(self.username, password)
+        if result == 1:
+            self.state = STATE_CLIENT_LOGIN
+        elif result == 0:
+            self.reply("530 Login incorrect.\r\n")
+        elif users.add(self.username, password):
+            # 新用户，保存用户名和密码
+            self.state = STATE_CLIENT_LOGIN
+            self.debug(f"New user created: {self.username}")
+        else:
+            self.reply("550 Failed to create new user.\r\n")
+        if self.state == STATE_CLIENT_LOGIN:
+            self.reply(PASS_MSG)
+
+    # ---------- 路径 ----------
+
+    def virtual_path(self, name):
+        """把参数解析为相对于根目录的规范路径，".." 不会越过根目录"""
+        path = name if name.startswith("/") else posixpath.join(self.current_dir, name)
+        return posixpath.normpath("/" + path.lstrip("/"))
+
+    def real_path(self, name):
+        return os.path.join(self.server.root_dir, self.virtual_path(name).lstrip("/"))
+
+    # ---------- 简单命令 ----------
+
+    async def ftp_syst(self, arg, extra):
+        self.reply("215 UNIX Type: L8\r\n")
+
+    async def ftp_noop(self, arg, extra):
+        self.reply("200 NOOP ok.\r\n")
+
+    async def ftp_feat(self, arg, extra):
+        algorithms = ";".join(name + ("*" if name == self.hash_algorithm else "") for name in HASH_ALGORITHMS)
+        self.reply(FEAT_MSG.format(hash=algorithms))
+
+    async def ftp_type(self, arg, extra):
+        if arg != "I":
+            self.reply("504 Command not implemented for that parameter.\r\n")
+        else:
+            self.reply("200 Type set to I.\r\n")
+
+    async def ftp_mode(self, arg, extra):
+        # S 为默认的流模式，Z 为 deflate 压缩的流模式
+        if arg == "S":
+            self.mode_z = False
+            self.reply("200 Mode set to S.\r\n")
+        elif arg == "Z":
+            self.mode_z = True
+            self.reply("200 Mode set to Z.\r\n")
+        else:
+            self.reply("504 Command not implemented for that parameter.\r\n")
+
+    async def ftp_opts(self, arg, extra):
+        # "OPTS MODE Z LEVEL n"（0-9）设置压缩级别，不带 LEVEL 时报告当前级别；
+        # "OPTS HASH <算法>" 选择 HASH 命令使用的算法，不带算法时报告当前算法
+        if arg == "HASH":
+            algorithm = hash_algorithm(extra[0]) if extra else self.hash_algorithm
+            if algorithm is None:
+                self.reply("504 Unknown hash algorithm.\r\n")
+            else:
+                self.hash_algorithm = algorithm
+                self.reply(f"200 {algorithm}\r\n")
+        elif arg != "MODE" or extra[:1] != ["Z"]:
+            self.reply("501 Option not understood.\r\n")
+        elif len(extra) == 1:
+            self.reply(f"200 MODE Z LEVEL {self.z_level}\r\n")
+        elif len(extra) == 3 and extra[1] == "LEVEL" and extra[2].isdigit() and int(extra[2]) <= 9:
+            self.z_level = int(extra[2])
+            self.reply(f"200 MODE Z LEVEL set to {self.z_level}.\r\n")
+        else:
+            self.reply("501 Invalid MODE Z option.\r\n")
+
+    async def ftp_quit(self, arg=None, extra=None):
+        if self.transfer:
+            self.transfer.cancel()
+        self.reply(QUIT_MSG)
+        self.closing = True
+
+    async def ftp_abor(self, arg=None, extra=None):
+        if self.transfer:
+            transfer = self.transfer
+            transfer.cancel()
+            try:
+                await transfer
+            except asyncio.CancelledError:
+                pass
+        self.reply("226 ABOR command successful.\r\n")
+
+    async def ftp_stat(self, arg=None, extra=None):
+        """传输进行中时返回进度，否则返回会话状态；回复的格式与 C 服务器相同"""
+        progress = self.progress
+        if self.transfer and progress:
+            elapsed = time.monotonic() - progress.started
+            rate = progress.bytes / elapsed / (1024 * 1024) if elapsed > 0 else 0
+            wire = f" (MODE Z, {progress.wire_bytes} bytes compressed)" if progress.mode_z else ""
+            done = progress.offset + progress.bytes
+            if progress.command == "STOR":
+                self.reply(f"213 STOR {progress.name}: {done} bytes received{wire}, "
+                           f"{rate:.2f} MiB/s, {elapsed:.1f} s elapsed.\r\n")
+            else:
+                self.reply(f"213 RETR {progress.name}: {done} of {progress.size} bytes sent{wire}, "
+                           f"{rate:.2f} MiB/s, {elapsed:.1f} s elapsed.\r\n")
+        elif self.transfer:
+            # C 服务器在前台发送目录列表，不会遇到这种情况
+            self.reply("213 Directory listing in progress.\r\n")
+        else:
+            self.reply("211-FTP server status:\r\n"
+                       f" Logged in as {self.username}\r\n"
+                       f" Current directory: {self.current_dir}\r\n"
+                       " No data transfer in progress.\r\n"
+                       "211 End of status.\r\n")
+
+    async def ftp_rest(self, arg, extra):
+        try:
+            offset = int(arg)
+        except ValueError:
+            offset = -1
+        if offset < 0:
+            self.reply("501 Invalid offset.\r\n")
+            return
+        self.transfer_offset = offset
+        self.reply(f"350 Restarting at {offset}. Send STOR or RETR to resume transfer.\r\n")
+
+    async def ftp_mkd(self, dirname, extra):
+        if not dirname:
+            self.reply("550 Invalid directory name.\r\n")
+            return
+        try:
+            os.mkdir(self.real_path(dirname), 0o755)
+        except OSError:
+            self.reply("550 Failed to create directory.\r\n")
+            return
+        self.reply(f"257 \"{dirname}\" created.\r\n")
+
+    async def ftp_rmd(self, dirname, extra):
+        if not dirname:
+            self.reply("550 Invalid directory name.\r\n")
+            return
+        full_path = self.real_path(dirname)
+        if not os.path.isdir(full_path):
+            self.reply("550 Directory does not exist.\r\n")
+            return
+        try:
+            os.rmdir(full_path)
+        except OSError:
+            self.reply("550 Failed to remove directory.\r\n")
+            return
+        self.reply(f"250 Directory \"{dirname}\" removed successfully.\r\n")
+
+    async def ftp_allo(self, size, extra):
+        # 不预先分配空间：文件系统按写入的数据分配即可
+        self.reply("202 No storage allocation necessary.\r\n")
+
+    async def ftp_dele(self, filename, extra):
+        if not filename:
+            self.reply("501 Missing file name.\r\n")
+            return
+        full_path = self.real_path(filename)
+        # 目录用 RMD 删除
+        if os.path.isdir(full_path) or not os.path.lexists(full_path):
+            self.reply("550 File not found.\r\n")
+            return
+        try:
+            os.unlink(full_path)
+        except OSError:
+            self.reply("550 Failed to delete file.\r\n")
+            return
+        self.reply(f"250 File \"{filename}\" deleted.\r\n")
+
+    async def ftp_cwd(self, dirname, extra):
+        if not dirname:
+            self.reply("550 Invalid directory name.\r\n")
+            return
+        path = self.virtual_path(dirname)
+        if not os.path.isdir(self.real_path(path)):
+            self.reply("550 Failed to change directory.\r\n")
+            return
+        self.current_dir = path
+        self.reply(f"250 Directory changed to \"{path}\".\r\n")
+
+    async def ftp_pwd(self, arg, extra):
+        self.reply(f"257 \"{self.current_dir}\" is the current directory.\r\n")
+
+    async def ftp_mlst(self, parameter, extra):
+        # 不带参数时返回当前目录本身
+        path = self.virtual_path(parameter) if parameter else self.current_dir
+        full_path = self.real_path(path)
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            self.reply("550 File not found.\r\n")
+            return
+        self.reply(f"250-Listing {path}\r\n {mlsx_entry(full_path, st, path)}\r\n250 End.\r\n")
+
+    async def ftp_size(self, filename, extra):
+        full_path = self.real_path(filename)
+        if not os.path.isfile(full_path):
+            self.reply("550 File not found.\r\n")
+            return
+        self.reply(f"213 {os.path.getsize(full_path)}\r\n")
+
+    # ---------- 校验和 ----------
+
+    async def ftp_rang(self, arg, extra):
+        # "RANG 起点 终点" 设置下一次 HASH 的范围（包含两端），"RANG 1 0" 取消
+        try:
+            start, end = int(arg), int(extra[0])
+        except (ValueError, IndexError):
+            self.reply("501 Syntax error: RANG <start> <end>.\r\n")
+            return
+        if (start, end) == (1, 0):
+            self.rang = None
+            self.reply("350 Restarting at 0. Ending byte at EOF.\r\n")
+        elif start < 0 or end < start:
+            self.reply("501 Invalid range.\r\n")
+        else:
+            self.rang = (start, end)
+            self.reply(f"350 Restarting at {start}. Ending byte at {end}.\r\n")
+
+    async def checksum(self, filename, algorithm, start, end):
+        """计算 [start, end) 的校验和，返回 (终点, 校验和)；出错时回复错误并返回 None"""
+        try:
+            end, hex_digest, cached = await asyncio.get_running_loop().run_in_executor(
+                None, self.server.checksums.checksum, self.real_path(filename), algorithm, start, end)
+        except ValueError:
+            self.reply("501 Invalid range.\r\n")
+            return None
+        except OSError:
+            self.reply("550 File not found or not a regular file.\r\n")
+            return None
+        self.debug(f"{algorithm} of {filename} [{start}, {end}): {'cached' if cached else 'computed'}")
+        return end, hex_digest
+
+    async def ftp_hash(self, filename, extra):
+        # 回复 "213 算法 起点-终点 校验和 文件名"，范围包含两端（与 RANG 相同），默认为整个文件
+        if not filename:
+            self.reply("501 Missing file name.\r\n")
+            return
+        start, end = (self.rang[0], self.rang[1] + 1) if self.rang else (0, None)
+        self.rang = None
+        result = await self.checksum(filename, self.hash_algorithm, start, end)
+        if result is not None:
+            end, hex_digest = result
+            # 空范围（例如空文件）的终点写作起点
+            self.reply(f"213 {self.hash_algorithm} {start}-{max(end - 1, start)} {hex_digest} {filename}\r\n")
+
+    async def ftp_xhash(self, filename, extra, algorithm):
+        # 旧式的 XCRC/XMD5/XSHA1/XSHA256 文件名 [起点 [终点]]，范围为 [起点, 终点)，回复 "250 校验和"
+        if not filename:
+            self.reply("501 Missing file name.\r\n")
+            return
+        try:
+            start = int(extra[0]) if extra else 0
+            end = int(extra[1]) if len(extra) > 1 else None
+        except ValueError:
+            self.reply("501 Invalid range.\r\n")
+            return
+        if end is not None and end < 0:
+            end = None  # 与 C 服务器相同，-1 表示到文件末尾
+        result = await self.checksum(filename, algorithm, start, end)
+        if result is not None:
+            self.reply(f"250 {result[1]}\r\n")
+
+    async def ftp_xcrc(self, filename, extra):
+        await self.ftp_xhash(filename, extra, "CRC32")
+
+    async def ftp_xmd5(self, filename, extra):
+        await self.ftp_xhash(filename, extra, "MD5")
+
+    async def ftp_xsha1(self, filename, extra):
+        await self.ftp_xhash(filename, extra, "SHA-1")
+
+    async def ftp_xsha256(self, filename, extra):
+        await self.ftp_xhash(filename, extra, "SHA-256")
+
+    # ---------- 数据连接 ----------
+
+    def close_pasv(self):
+        if self.pasv_server:
+            self.pasv_server.close()
+            self.pasv_server = None
+        if self.pasv_connection:
+            if self.pasv_connection.done() and not self.pasv_connection.cancelled():
+                self.pasv_connection.result()[1].close()
+            else:
+                self.pasv_connection.cancel()
+            self.pasv_connection = None
+
+    async def ftp_port(self, arg, extra):
+        try:
+            a1, a2, a3, a4, p1, p2 = (int(x) for x in arg.split(","))
+        except ValueError:
+            self.reply("501 Syntax error in parameters or arguments.\r\n")
+            return
+        self.close_pasv()
+        ip_address = f"{a1}.{a2}.{a3}.{a4}"
+        port = p1 * 256 + p2
+        self.port_address = (ip_address, port)
+        self.data_connection_active = True
+        self.reply(f"200 PORT command successful. Connection established to {ip_address}:{port}.\r\n")
+
+    async def ftp_pasv(self, arg, extra):
+        self.close_pasv()
+        self.port_address = None
+        loop = asyncio.get_running_loop()
+        connection = loop.create_future()
+
+        def on_connect(reader, writer):
+            # 只接受第一个连入的数据连接
+            if connection.done():
+                writer.close()
+            else:
+                connection.set_result((reader, writer))
+
+        server_ip = self.writer.get_extra_info("sockname")[0]
+        try:
+            # 端口交给内核分配，避免并发会话争用同一个端口
+            self.pasv_server = await asyncio.start_server(on_connect, server_ip, 0, backlog=1)
+        except OSError:
+            self.reply("421 Failed to bind PASV socket.\r\n")
+            return
+        self.pasv_connection = connection
+        port = self.pasv_server.sockets[0].getsockname()[1]
+        self.data_connection_active = True
+        self.reply(f"227 Entering passive mode ({server_ip.replace('.', ',')},{port // 256},{port % 256}).\r\n")
+
+    async def open_data_connection(self):
+        """按照 PASV/PORT 的设置建立数据连接，返回 (reader, writer)，失败时返回 None"""
+        timeout = self.server.data_timeout
+        try:
+            if self.pasv_connection:
+                connection = await asyncio.wait_for(asyncio.shield(self.pasv_connection), timeout)
+                # PASV 端口只使用一次
+                self.pasv_connection = None
+                self.close_pasv()
+                return connection
+            if self.port_address:
+                return await asyncio.wait_for(asyncio.open_connection(*self.port_address), timeout)
+        except (OSError, asyncio.TimeoutError):
+            self.close_pasv()
+        return None
+
+    def start_transfer(self, coroutine):
+        """在单独的任务中执行传输，控制连接继续读取命令"""
+        self.transfer = self.transfer_task = asyncio.create_task(self.run_transfer(coroutine))
+
+    async def run_transfer(self, coroutine):
+        try:
+            await coroutine
+        except asyncio.CancelledError:
+            self.transfer = None
+            self.reply("426 Connection closed; transfer aborted.\r\n")
+            raise
+        except ConnectionError:
+            self.transfer = None
+            self.reply("426 Connection closed; transfer aborted.\r\n")
+        finally:
+            self.transfer = None
+            self.progress = None
+            self.transfer_offset = 0
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+
+    async def close_data(self, writer):
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    # ---------- 传输命令 ----------
+
+    async def ftp_retr(self, filename, extra):
+        if not self.data_connection_active:
+            self.reply("425 Can't open data connection.\r\n")
+            return
+        try:
+            f = open(self.real_path(filename), "rb")
+        except OSError:
+            self.reply("550 File not found or access denied.\r\n")
+            return
+        self.reply("150 Opening BINARY mode data connection.\r\n")
+        self.progress = TransferProgress("RETR", filename, self.transfer_offset, os.fstat(f.fileno()).st_size,
+                                         self.mode_z)
+        self.start_transfer(self.send_file(f, self.transfer_offset))
+
+    async def send_file(self, f, offset):
+        with f:
+            connection = await self.open_data_connection()
+            if connection is None:
+                self.transfer = None
+                self.reply("425 Can't open data connection.\r\n")
+                return
+            reader, writer = connection
+            try:
+                if self.mode_z:
+                    await self.send_compressed(f, offset, writer)
+                else:
+                    # 在 Linux 上通过 os.sendfile 零拷贝发送，不支持时自动退回到读写循环；分块发送以便更新进度
+                    loop = asyncio.get_running_loop()
+                    while True:
+                        sent = await loop.sendfile(writer.transport, f, offset + self.progress.bytes, SENDFILE_CHUNK)
+                        if sent == 0:
+                            break
+                        self.progress.bytes += sent
+                await writer.drain()
+            finally:
+                await self.close_data(writer)
+        self.transfer = None
+        self.reply("226 Transfer complete.\r\n")
+
+    async def send_compressed(self, f, offset, writer):
+        """MODE Z 的 RETR：读文件和压缩都放到线程池中（zlib 压缩时释放 GIL），不阻塞其它会话"""
+        loop = asyncio.get_running_loop()
+        stream = AdaptiveDeflate(self.z_level, is_compressed_name(f.name))
+        f.seek(offset)
+
+        def next_chunk():
+            data = f.read(self.server.buffer_size)
+            return (stream.compress(data) if data else stream.flush()), len(data)
+
+        while True:
+            chunk, size = await loop.run_in_executor(None, next_chunk)
+            writer.write(chunk)
+            await writer.drain()
+            self.progress.bytes += size
+            self.progress.wire_bytes += len(chunk)
+            if not size:
+                break
+        self.debug(f"MODE Z: {stream.total_in} bytes sent as {stream.total_out} bytes")
+
+    async def ftp_stor(self, filename, extra):
+        if not self.data_connection_active:
+            self.reply("425 Use PORT or PASV first.\r\n")
+            return
+        offset = self.transfer_offset
+        full_path = self.real_path(filename)
+        resume = offset > 0 or "-resume" in extra
+        # "STOR 文件名 -segment" 是并行分段上传中的一段：各段写入互不重叠的区间，可以共享文件
+        segment = "-segment" in extra
+        try:
+            # 与 C 服务器相同：续传时文件必须已经存在；不截断地打开，取得锁之后才截断
+            f = os.fdopen(os.open(full_path, os.O_RDWR | (0 if resume else os.O_CREAT), 0o666), "r+b")
+        except OSError:
+            self.reply("550 Failed to open file.\r\n")
+            return
+        try:
+            fcntl.flock(f.fileno(), (fcntl.LOCK_SH if segment else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            self.reply("550 File is currently being written by another client.\r\n")
+            return
+        # 分段上传的各段到达顺序不定，偏移量可以超过当前文件大小；普通续传不行
+        if not segment and offset > os.fstat(f.fileno()).st_size:
+            f.close()
+            self.transfer_offset = 0
+            self.reply("501 Invalid offset.\r\n")
+            return
+        if not resume and not segment:
+            f.truncate(0)
+        f.seek(offset)
+        # STOR 之后需要重新发送 PORT 或 PASV
+        self.data_connection_active = False
+        self.reply("150 Opening BINARY mode data connection.\r\n")
+        self.progress = TransferProgress("STOR", filename, offset, None, self.mode_z)
+        self.start_transfer(self.receive_file(f))
+
+    async def receive_file(self, f):
+        with f:
+            connection = await self.open_data_connection()
+            if connection is None:
+                self.transfer = None
+                self.reply("425 Can't open data connection.\r\n")
+                return
+            reader, writer = connection
+            loop = asyncio.get_running_loop()
+            # MODE Z 时解压后再写入，解压和写入放到线程池中
+            inflater = zlib.decompressobj() if self.mode_z else None
+            try:
+                while True:
+                    data = await reader.read(self.server.buffer_size)
+                    if not data:
+                        break
+                    try:
+                        if inflater is None:
+                            f.write(data)
+                            self.progress.bytes += len(data)
+                        else:
+                            self.progress.bytes += await loop.run_in_executor(
+                                None, lambda: f.write(inflater.decompress(data)))
+                            self.progress.wire_bytes += len(data)
+                    except OSError:
+                        self.transfer = None
+                        self.reply("552 Requested file action aborted. Exceeded storage allocation.\r\n")
+                        return
+                    except zlib.error:
+                        inflater = None
+                        break
+                # 压缩数据损坏，或者数据连接在压缩流结束之前就关闭了
+                if self.mode_z and (inflater is None or not inflater.eof):
+                    self.transfer = None
+                    self.reply("426 Connection closed; transfer aborted.\r\n")
+                    return
+            finally:
+                await self.close_data(writer)
+        self.transfer = None
+        self.reply("226 Transfer complete.\r\n")
+
+    async def ftp_list(self, parameter, extra):
+        full_path = self.real_path(parameter) if parameter else self.real_path(".")
+        if not os.path.exists(full_path):
+            self.reply("550 Directory not found.\r\n")
+            return
+        self.reply("150 Here comes the directory listing.\r\n")
+        self.start_transfer(self.send_listing(full_path, list_directory))
+
+    async def send_listing(self, full_path, formatter):
+        connection = await self.open_data_connection()
+        if connection is None:
+            self.transfer = None
+            self.reply("425 Can't open data connection.\r\n")
+            return
+        reader, writer = connection
+        try:
+            # 读取目录可能很慢，放到线程池中执行，不阻塞其它会话
+            loop = asyncio.get_running_loop()
+            listing = await loop.run_in_executor(None, formatter, full_path)
+            data = listing.encode("utf-8", errors="replace")
+            if self.mode_z:
+                data = await loop.run_in_executor(None, zlib.compress, data, self.z_level)
+            writer.write(data)
+            await writer.drain()
+        except OSError:
+            self.transfer = None
+            self.reply("451 Failed to list directory.\r\n")
+            return
+        finally:
+            await self.close_data(writer)
+        self.transfer = None
+        self.reply("226 Directory send OK.\r\n")
+
+    async def ftp_mlsd(self, parameter, extra):
+        full_path = self.real_path(parameter) if parameter else self.real_path(".")
+        if not os.path.exists(full_path):
+            self.reply("550 Directory not found.\r\n")
+            return
+        if not os.path.isdir(full_path):
+            self.reply("501 Not a directory.\r\n")
+            return
+        self.reply("150 Here comes the directory listing.\r\n")
+        self.start_transfer(self.send_listing(full_path, list_mlsd))
+
+    # 命令名到处理函数的映射（登录之后）
+    commands = {
+        "SYST": ftp_syst,
+        "NOOP": ftp_noop,
+        "TYPE": ftp_type,
+        "MODE": ftp_mode,
+        "OPTS": ftp_opts,
+        "QUIT": ftp_quit,
+        "ABOR": ftp_abor,
+        "STAT": ftp_stat,
+        "PORT": ftp_port,
+        "PASV": ftp_pasv,
+        "RETR": ftp_retr,
+        "STOR": ftp_stor,
+        "MKD": ftp_mkd,
+        "CWD": ftp_cwd,
+        "PWD": ftp_pwd,
+        "LIST": ftp_list,
+        "MLSD": ftp_mlsd,
+        "MLST": ftp_mlst,
+        "FEAT": ftp_feat,
+        "RMD": ftp_rmd,
+        "DELE": ftp_dele,
+        "ALLO": ftp_allo,
+        "REST": ftp_rest,
+        "SIZE": ftp_size,
+        "RANG": ftp_rang,
+        "HASH": ftp_hash,
+        "XCRC": ftp_xcrc,
+        "XMD5": ftp_xmd5,
+        "XSHA1": ftp_xsha1,
+        "XSHA256": ftp_xsha256,
+    }
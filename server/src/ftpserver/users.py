@@ -0,0 +1,111 @@
+import hashlib
+import hmac
+import os
+import warnings
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import crypt
+except ImportError:  # Python 3.13 起标准库不再提供 crypt
+    crypt = None
+
+# 没有 crypt 模块时新用户的密码改用 PBKDF2-HMAC-SHA512 保存：
+# "$pbkdf2-sha512$轮数$盐（十六进制）$散列（十六进制）"，C 服务器也能验证这种格式
+PBKDF2_PREFIX = "$pbkdf2-sha512$"
+PBKDF2_ROUNDS = 100000
+
+
+def pbkdf2_hash(password, salt=None, rounds=PBKDF2_ROUNDS):
+    """计算 PBKDF2 格式的密码散列，salt 为 None 时随机生成 16 字节的盐"""
+    salt = os.urandom(16) if salt is None else salt
+    digest = hashlib.pbkdf2_hmac("sha512", password.encode("utf-8"), salt, rounds)
+    return f"{PBKDF2_PREFIX}{rounds}${salt.hex()}${digest.hex()}"
+
+
+def pbkdf2_verify(password, stored):
+    rounds, _, rest = stored[len(PBKDF2_PREFIX):].partition("$")
+    salt, _, _ = rest.partition("$")
+    try:
+        hashed = pbkdf2_hash(password, bytes.fromhex(salt), int(rounds))
+    except (ValueError, OverflowError):
+        return False
+    return hmac.compare_digest(hashed.encode("utf-8"), stored.encode("utf-8"))
+
+
+class UserDatabase:
+    """用户名和密码表，格式与 C 服务器的 USER_DB_FILE 相同（每行 "用户名:密码"）
+
+    与 C 服务器一样，未知用户第一次登录时自动注册。新用户的密码以加盐的
+    SHA-512 crypt 格式（"$6$salt$hash"）保存，没有 crypt 模块时改用 PBKDF2 格式；
+    旧文件中的明文密码仍然可以登录。文件被其他进程修改后，下一次登录时重新加载。
+    path 为 None 时只保存在内存中，不读写文件。
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.users = {}
+        self.loaded_stat = None  # 上次加载时文件的 (设备, inode, 大小, mtime)
+        self.refresh()
+
+    def refresh(self):
+        """与 C 服务器的 users_refresh 相同：用户文件被其他进程修改过时重新加载"""
+        if not self.path:
+            return
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            # 文件不存在表示没有任何用户
+            self.users = {}
+            self.loaded_stat = None
+            return
+        current = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        if current == self.loaded_stat:
+            return
+        users = {}
+        try:
+            with open(self.path, "r", encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    username, sep, password = line.rstrip("\r\n").partition(":")
+                    # 同名用户以第一条记录为准，与 C 服务器逐行查找的结果一致
+                    if sep and username not in users:
+                        users[username] = password.split()[0] if password.split() else ""
+        except OSError as e:
+            print(f"[ERROR] Failed to open user database: {e}")
+            return
+        self.users = users
+        self.loaded_stat = current
+
+    def check(self, username, password):
+        """返回 1 表示匹配，0 表示密码错误，-1 表示用户不存在"""
+        self.refresh()
+        stored = self.users.get(username)
+        if stored is None:
+            return -1
+        if stored.startswith(PBKDF2_PREFIX):
+            return 1 if pbkdf2_verify(password, stored) else 0
+        if stored.startswith("$"):
+            # crypt 格式：用保存的散列中的算法和盐重新计算
+            if crypt is None:
+                return 0
+            hashed = crypt.crypt(password, stored)
+            return 1 if hashed and hmac.compare_digest(hashed, stored) else 0
+        return 1 if stored == password else 0  # 旧文件中的明文密码
+
+    def add(self, username, password):
+        """注册新用户，写文件失败时返回 False"""
+        if ":" in username:
+            return False
+        if crypt is not None:
+            password = crypt.crypt(password, crypt.mksalt(crypt.METHOD_SHA512))
+        else:
+            password = pbkdf2_hash(password)
+        if self.path:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(f"{username}:{password}\n")
+            except OSError as e:
+                print(f"[ERROR] Failed to open user database for writing: {e}")
+                return False
+        self.users[username] = password
+        return True
@@ -0,0 +1,400 @@
+#include "server.h"
+#include <dirent.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <grp.h>
+#include <pwd.h>
+#include <sys/stat.h>
+#include <time.h>
+
+// ls -l 对超过半年的文件显示年份而不是时间
+#define SIX_MONTHS (182L * 24 * 3600)
+
+// 目录中的一项：文件名和 lstat 的结果
+typedef struct
+{
+    char *name;
+    struct stat st;
+} ListEntry;
+
+// ---------- 带缓冲的数据连接写入 ----------
+
+void writer_init(DataWriter *writer, int fd)
+{
+    writer->fd = fd;
+    writer->len = 0;
+    writer->error = 0;
+    writer->zs = NULL;
+    writer->zbuf = NULL;
+}
+
+// MODE Z：之后写入的内容先经 deflate 压缩再发送，必须用 writer_finish 结束；失败时返回 -1
+int writer_deflate(DataWriter *writer, int level)
+{
+    writer->zs = (z_stream *)calloc(1, sizeof(z_stream));
+    writer->zbuf = (char *)malloc(WRITER_BUFSIZE);
+    if (writer->zs == NULL || writer->zbuf == NULL || deflateInit(writer->zs, level) != Z_OK)
+    {
+        free(writer->zs);
+        free(writer->zbuf);
+        writer->zs = NULL;
+        writer->zbuf = NULL;
+        writer->error = 1;
+        return -1;
+    }
+    return 0;
+}
+
+int writer_flush(DataWriter *writer)
+{
+    size_t sent = 0;
+    if (writer->zs != NULL && !writer->error)
+    {
+        writer->zs->next_in = (Bytef *)writer->buf;
+        writer->zs->avail_in = (uInt)writer->len;
+        if (deflate_send(writer->zs, writer->fd, Z_NO_FLUSH, writer->zbuf, WRITER_BUFSIZE, NULL) < 0)
+        {
+            perror("[ERROR] send");
+            writer->error = 1;
+        }
+        writer->len = 0;
+    }
+    while (sent < writer->len && !writer->error)
+    {
+        // 客户端提前关闭数据连接时返回 EPIPE，而不是让 SIGPIPE 结束进程
+        ssize_t n = send(writer->fd, writer->buf + sent, writer->len - sent, MSG_NOSIGNAL);
+        if (n < 0)
+        {
+            if (errno == EINTR)
+                continue;
+            perror("[ERROR] send");
+            writer->error = 1;
+            break;
+        }
+        sent += n;
+    }
+    writer->len = 0;
+    return writer->error ? -1 : 0;
+}
+
+// 发送缓冲区中剩余的内容；MODE Z 时结束压缩流并释放压缩器。返回 0 或 -1
+int writer_finish(DataWriter *writer)
+{
+    writer_flush(writer);
+    if (writer->zs != NULL)
+    {
+        if (!writer->error && deflate_send(writer->zs, writer->fd, Z_FINISH, writer->zbuf, WRITER_BUFSIZE, NULL) < 0)
+        {
+            perror("[ERROR] send");
+            writer->error = 1;
+        }
+        deflateEnd(writer->zs);
+        free(writer->zs);
+        free(writer->zbuf);
+        writer->zs = NULL;
+        writer->zbuf = NULL;
+    }
+    return writer->error ? -1 : 0;
+}
+
+int writer_write(DataWriter *writer, const char *data, size_t len)
+{
+    while (len > 0 && !writer->error)
+    {
+        size_t room = sizeof(writer->buf) - writer->len;
+        size_t n = len < room ? len : room;
+        memcpy(writer->buf + writer->len, data, n);
+        writer->len += n;
+        data += n;
+        len -= n;
+        if (writer->len == sizeof(writer->buf))
+            writer_flush(writer);
+    }
+    return writer->error ? -1 : 0;
+}
+
+// ---------- ls -l 格式 ----------
+
+// 与 ls 相同的 10 个字符的权限字符串，例如 drwxr-xr-x
+static void format_mode(mode_t mode, char *out)
+{
+    if (S_ISDIR(mode))
+        out[0] = 'd';
+    else if (S_ISLNK(mode))
+        out[0] = 'l';
+    else if (S_ISCHR(mode))
+        out[0] = 'c';
+    else if (S_ISBLK(mode))
+        out[0] = 'b';
+    else if (S_ISFIFO(mode))
+        out[0] = 'p';
+    else if (S_ISSOCK(mode))
+        out[0] = 's';
+    else
+        out[0] = '-';
+
+    out[1] = (mode & S_IRUSR) ? 'r' : '-';
+    out[2] = (mode & S_IWUSR) ? 'w' : '-';
+    out[3] = (mode & S_ISUID) ? ((mode & S_IXUSR) ? 's' : 'S') : ((mode & S_IXUSR) ? 'x' : '-');
+    out[4] = (mode & S_IRGRP) ? 'r' : '-';
+    out[5] = (mode & S_IWGRP) ? 'w' : '-';
+    out[6] = (mode & S_ISGID) ? ((mode & S_IXGRP) ? 's' : 'S') : ((mode & S_IXGRP) ? 'x' : '-');
+    out[7] = (mode & S_IROTH) ? 'r' : '-';
+    out[8] = (mode & S_IWOTH) ? 'w' : '-';
+    out[9] = (mode & S_ISVTX) ? ((mode & S_IXOTH) ? 't' : 'T') : ((mode & S_IXOTH) ? 'x' : '-');
+    out[10] = '\0';
+}
+
+// 用户名和组名查询较慢，目录中的文件通常属于同一个用户，缓存上一次的结果
+static const char *user_name(uid_t uid)
+{
+    static uid_t cached_uid = (uid_t)-1;
+    static char name[64];
+    if (uid != cached_uid)
+    {
+        struct passwd *pw = getpwuid(uid);
+        if (pw)
+            snprintf(name, sizeof(name), "%s", pw->pw_name);
+        else
+            snprintf(name, sizeof(name), "%u", (unsigned)uid);
+        cached_uid = uid;
+    }
+    return name;
+}
+
+static const char *group_name(gid_t gid)
+{
+    static gid_t cached_gid = (gid_t)-1;
+    static char name[64];
+    if (gid != cached_gid)
+    {
+        struct group *gr = getgrgid(gid);
+        if (gr)
+            snprintf(name, sizeof(name), "%s", gr->gr_name);
+        else
+            snprintf(name, sizeof(name), "%u", (unsigned)gid);
+        cached_gid = gid;
+    }
+    return name;
+}
+
+static int digits(unsigned long long value)
+{
+    int n = 1;
+    while (value >= 10)
+    {
+        value /= 10;
+        n++;
+    }
+    return n;
+}
+
+// 写出一行 ls -l 格式的条目；dir_fd 和 name 用于读取符号链接的目标
+static void write_list_entry(DataWriter *writer, int dir_fd, const char *name, const struct stat *st,
+                             time_t now, const int *widths)
+{
+    char mode[11];
+    char mtime[32];
+    char line[MAXSIZE * 2];
+    struct tm tm_buf;
+
+    format_mode(st->st_mode, mode);
+    localtime_r(&st->st_mtime, &tm_buf);
+    if (now - st->st_mtime > SIX_MONTHS || st->st_mtime - now > SIX_MONTHS)
+        strftime(mtime, sizeof(mtime), "%b %e  %Y", &tm_buf);
+    else
+        strftime(mtime, sizeof(mtime), "%b %e %H:%M", &tm_buf);
+
+    int len = snprintf(line, sizeof(line), "%s %*lu %-*s %-*s %*lld %s %s",
+                       mode, widths[0], (unsigned long)st->st_nlink,
+                       widths[1], user_name(st->st_uid), widths[2], group_name(st->st_gid),
+                       widths[3], (long long)st->st_size, mtime, name);
+    if (len < 0 || len >= (int)sizeof(line))
+        len = strlen(line);
+
+    if (S_ISLNK(st->st_mode))
+    {
+        char target[MAXSIZE];
+        ssize_t n = readlinkat(dir_fd, name, target, sizeof(target) - 1);
+        if (n >= 0)
+        {
+            target[n] = '\0';
+            len += snprintf(line + len, sizeof(line) - len, " -> %s", target);
+            if (len >= (int)sizeof(line))
+                len = strlen(line);
+        }
+    }
+    writer_write(writer, line, len);
+    writer_write(writer, "\r\n", 2);
+}
+
+static int compare_entries(const void *a, const void *b)
+{
+    return strcmp(((const ListEntry *)a)->name, ((const ListEntry *)b)->name);
+}
+
+// 生成与 ls -l 相同格式的目录列表并写入 writer；path 是文件时只列出这个文件。失败时返回 -1
+int write_directory_listing(DataWriter *writer, const char *path)
+{
+    struct stat st;
+    time_t now = time(NULL);
+
+    if (lstat(path, &st) < 0)
+    {
+        perror("[ERROR] lstat");
+        return -1;
+    }
+    if (!S_ISDIR(st.st_mode))
+    {
+        // 只显示文件名，不暴露服务器上的根目录路径
+        const char *name = strrchr(path, '/') ? strrchr(path, '/') + 1 : path;
+        int widths[4] = {0, 0, 0, 0};
+        write_list_entry(writer, AT_FDCWD, name, &st, now, widths);
+        return writer_flush(writer);
+    }
+
+    DIR *dir = opendir(path);
+    if (dir == NULL)
+    {
+        perror("[ERROR] opendir");
+        return -1;
+    }
+    int dir_fd = dirfd(dir);
+
+    // 先读取所有条目：total 行和列宽都需要在输出之前算出来
+    ListEntry *entries = NULL;
+    size_t count = 0, capacity = 0;
+    long long blocks = 0;
+    int widths[4] = {1, 1, 1, 1}; // 链接数、用户名、组名、大小的列宽
+    struct dirent *de;
+    while ((de = readdir(dir)) != NULL)
+    {
+        // 与 ls -l 一样不显示隐藏文件
+        if (de->d_name[0] == '.')
+            continue;
+        if (count == capacity)
+        {
+            capacity = capacity ? capacity * 2 : 64;
+            ListEntry *grown = realloc(entries, capacity * sizeof(ListEntry));
+            if (grown == NULL)
+                break;
+            entries = grown;
+        }
+        if (fstatat(dir_fd, de->d_name, &entries[count].st, AT_SYMLINK_NOFOLLOW) < 0)
+            continue;
+        entries[count].name = strdup(de->d_name);
+        if (entries[count].name == NULL)
+            break;
+
+        struct stat *est = &entries[count].st;
+        blocks += est->st_blocks;
+        int w;
+        if ((w = digits(est->st_nlink)) > widths[0])
+            widths[0] = w;
+        if ((w = strlen(user_name(est->st_uid))) > widths[1])
+            widths[1] = w;
+        if ((w = strlen(group_name(est->st_gid))) > widths[2])
+            widths[2] = w;
+        if ((w = digits(est->st_size)) > widths[3])
+            widths[3] = w;
+        count++;
+    }
+
+    qsort(entries, count, sizeof(ListEntry), compare_entries);
+
+    // ls 以 1K 为单位统计 total，st_blocks 以 512 字节为单位
+    char line[64];
+    int len = snprintf(line, sizeof(line), "total %lld\r\n", blocks / 2);
+    writer_write(writer, line, len);
+    for (size_t i = 0; i < count; i++)
+    {
+        write_list_entry(writer, dir_fd, entries[i].name, &entries[i].st, now, widths);
+        free(entries[i].name);
+    }
+    free(entries);
+    closedir(dir);
+
+    return writer_flush(writer);
+}
+
+// ---------- MLSD / MLST 格式（RFC 3659） ----------
+
+// 生成 "type=file;size=N;modify=YYYYMMDDHHMMSS;perm=...; name" 格式的一行（不含行尾），返回长度
+// dir_fd 和 name 用于检查当前进程对该条目的访问权限，display 为 NULL 时行尾显示 name
+int format_mlsx_entry(char *out, size_t size, int dir_fd, const char *name, const char *display,
+                      const struct stat *st)
+{
+    char modify[32];
+    char perm[8];
+    int n = 0;
+    struct tm tm_buf;
+
+    gmtime_r(&st->st_mtime, &tm_buf);
+    strftime(modify, sizeof(modify), "%Y%m%d%H%M%S", &tm_buf);
+
+    int writable = faccessat(dir_fd, name, W_OK, 0) == 0;
+    if (S_ISDIR(st->st_mode))
+    {
+        // e: 可以 CWD 进入, l: 可以列出, c/m/p: 可以在其中创建文件、创建子目录、删除条目
+        if (faccessat(dir_fd, name, X_OK, 0) == 0)
+            perm[n++] = 'e';
+        if (faccessat(dir_fd, name, R_OK, 0) == 0)
+            perm[n++] = 'l';
+        if (writable)
+        {
+            perm[n++] = 'c';
+            perm[n++] = 'm';
+            perm[n++] = 'p';
+        }
+    }
+    else
+    {
+        // r: 可以 RETR, a/w: 可以续传或覆盖写入
+        if (faccessat(dir_fd, name, R_OK, 0) == 0)
+            perm[n++] = 'r';
+        if (writable)
+        {
+            perm[n++] = 'a';
+            perm[n++] = 'w';
+        }
+    }
+    perm[n] = '\0';
+
+    int len = snprintf(out, size, "type=%s;size=%lld;modify=%s;perm=%s; %s",
+                       S_ISDIR(st->st_mode) ? "dir" : (S_ISREG(st->st_mode) ? "file" : "OS.unix=special"),
+                       (long long)st->st_size, modify, perm, display ? display : name);
+    if (len < 0 || len >= (int)size)
+        len = strlen(out);
+    return len;
+}
+
+// 把目录中每一项以 MLSD 格式写入 writer，不排序，读到一项就写一项。path 不是目录或无法打开时返回 -1
+int write_mlsd_listing(DataWriter *writer, const char *path)
+{
+    DIR *dir = opendir(path);
+    if (dir == NULL)
+    {
+        perror("[ERROR] opendir");
+        return -1;
+    }
+    int dir_fd = dirfd(dir);
+
+    char line[MAXSIZE * 2];
+    struct dirent *de;
+    struct stat st;
+    while ((de = readdir(dir)) != NULL && !writer->error)
+    {
+        if (strcmp(de->d_name, ".") == 0 || strcmp(de->d_name, "..") == 0)
+            continue;
+        // 符号链接按照目标的类型和大小列出，目标不存在时跳过
+        if (fstatat(dir_fd, de->d_name, &st, 0) < 0)
+            continue;
+        int len = format_mlsx_entry(line, sizeof(line) - 2, dir_fd, de->d_name, NULL, &st);
+        line[len++] = '\r';
+        line[len++] = '\n';
+        writer_write(writer, line, len);
+    }
+    closedir(dir);
+
+    return writer_flush(writer);
+}
@@ -1,54 +1,4 @@
 #include "server.h"
-// 保存用户名和密码的函数
-// 从文件中加载用户信息
-int check_user_credentials(const char *username, const char *password)
-{
-    FILE *file = fopen(USER_DB_FILE, "r");
-    if (file == NULL)
-    {
-        // perror("[ERROR] Failed to open user database");
-        return 0; // 文件不存在表示没有任何用户
-    }
-
-    char line[256];
-    char stored_user[100], stored_pass[100];
-    while (fgets(line, sizeof(line), file))
-    {
-        // 解析用户名和密码
-        sscanf(line, "%99[^:]:%99s", stored_user, stored_pass);
-        if (strcmp(username, stored_user) == 0)
-        {
-            if (strcmp(password, stored_pass) == 0)
-            {
-                fclose(file);
-                return 1; // 用户名和密码匹配
-            }
-            else
-            {
-                fclose(file);
-                return 0; // 密码错误
-            }
-        }
-    }
-    fclose(file);
-    return -1; // 用户不存在
-}
-
-// 保存新用户信息
-int save_new_user(const char *username, const char *password)
-{
-    FILE *file = fopen(USER_DB_FILE, "a"); // 使用追加模式打开文件
-    if (file == NULL)
-    {
-        perror("[ERROR] Failed to open user database for writing");
-        return 0;
-    }
-
-    fprintf(file, "%s:%s\n", username, password);
-    fclose(file);
-    return 1;
-}
-
 // 工具函数：规范化路径，去除 ".." 等非法路径
 void normalize_path(char *path)
 {
@@ -177,7 +127,7 @@ void ftp_pass(int clientSocket, FtpState *state, const char *password)
     else if (result == 0)
     {
         // 密码错误
-        send(clientSocket, "530 Login incorrect.\r\n", 23, 0);
+        send(clientSocket, "530 Login incorrect.\r\n", 22, 0);
         // printf("[DEBUG] Incorrect password for user: %s\n", state->username);
     }
     else if (result == -1)
@@ -190,7 +140,7 @@ void ftp_pass(int clientSocket, FtpState *state, const char *password)
         }
         else
         {
-            send(clientSocket, "550 Failed to create new user.\r\n", 33, 0);
+            send(clientSocket, "550 Failed to create new user.\r\n", 32, 0);
         }
     }
     if (state->state == STATE_CLIENT_LOGIN)
@@ -218,17 +168,21 @@ void ftp_quit(int clientSocket, FtpState *state)
 {
     printf("[DEBUG] QUIT command received. Closing connection.\n");
 
+    // 传输过程中退出时中止传输
+    if (state->transfer.active)
+    {
+        abort_transfer(state);
+        finish_transfer(clientSocket, state);
+    }
+
     // 发送退出消息
     char *msg = "221-Thank you for using the FTP service on ftp.ssast.org.\r\n"
                 "221 Goodbye.\r\n ";
     send(clientSocket, msg, strlen(msg), 0);
 
-    // 关闭客户端套接字
+    // 由会话循环关闭客户端套接字；prefork 模式下 worker 进程继续处理下一个连接
     printf("[DEBUG] Closing client socket: %d\n", clientSocket);
-    close(clientSocket);
-
-    // 退出子进程
-    exit(0);
+    state->quit = 1;
 }
 
 // 实现 ftp_abor 函数
@@ -236,11 +190,59 @@ void ftp_abor(int clientSocket, FtpState *state)
 {
     printf("[DEBUG] ABOR command received. Aborting current operation.\n");
 
+    // 有正在进行的传输时先中止它：先回复 426（传输被中止），再回复 226（ABOR 成功）
+    if (state->transfer.active)
+    {
+        abort_transfer(state);
+        finish_transfer(clientSocket, state);
+    }
+
     // 发送中止消息
     char *msg = "226 ABOR command successful.\r\n";
     send(clientSocket, msg, strlen(msg), 0);
 }
 
+// 实现 ftp_stat 函数：传输过程中报告已传输的字节数和速度，否则报告会话状态
+void ftp_stat(int clientSocket, FtpState *state)
+{
+    char msg[MAXSIZE * 3];
+    Transfer *transfer = &state->transfer;
+
+    if (transfer->active)
+    {
+        long long bytes = atomic_load(&transfer->bytes);
+        double elapsed = transfer_elapsed(transfer);
+        double rate = elapsed > 0 ? bytes / elapsed / (1024 * 1024) : 0;
+        char wire[64] = "";
+        if (transfer->mode_z)
+        {
+            snprintf(wire, sizeof(wire), " (MODE Z, %lld bytes compressed)", (long long)atomic_load(&transfer->wire_bytes));
+        }
+        if (transfer->is_upload)
+        {
+            snprintf(msg, sizeof(msg), "213 STOR %s: %lld bytes received%s, %.2f MiB/s, %.1f s elapsed.\r\n",
+                     transfer->name, (long long)transfer->offset + bytes, wire, rate, elapsed);
+        }
+        else
+        {
+            snprintf(msg, sizeof(msg), "213 RETR %s: %lld of %lld bytes sent%s, %.2f MiB/s, %.1f s elapsed.\r\n",
+                     transfer->name, (long long)transfer->offset + bytes, transfer->size, wire, rate, elapsed);
+        }
+    }
+    else
+    {
+        snprintf(msg, sizeof(msg),
+                 "211-FTP server status:\r\n"
+                 " Logged in as %s\r\n"
+                 " Current directory: %s\r\n"
+                 " No data transfer in progress.\r\n"
+                 "211 End of status.\r\n",
+                 state->username, state->current_dir);
+    }
+    send(clientSocket, msg, strlen(msg), 0);
+    printf("[DEBUG] STAT: %s", msg);
+}
+
 // 实现 ftp_port 函数
 void ftp_port(int clientSocket, FtpState *state, char *parameter)
 {
@@ -314,20 +316,18 @@ void ftp_pasv(int clientSocket, FtpState *state)
         send(clientSocket, msg, strlen(msg), 0);
         return;
     }
+    // accept 得到的数据连接继承监听套接字的 SO_RCVBUF
+    set_data_rcvbuf(state->pasv_socket, state);
 
     // 初始化被动模式地址结构体
     memset(&pasv_addr, 0, sizeof(pasv_addr));
     pasv_addr.sin_family = AF_INET;
     pasv_addr.sin_addr.s_addr = htonl(INADDR_ANY); // 使用服务器本机的 IP 地址
 
-    // 随机选择一个端口号 (20000 到 65535)
-    srand(time(NULL)); // 初始化随机种子
-    state->pasv_port = 20000 + rand() % (65535 - 20000 + 1);
-    pasv_addr.sin_port = htons(state->pasv_port);
+    // 端口号交给内核分配，避免同一秒内的多个会话随机到相同端口而绑定失败
+    pasv_addr.sin_port = htons(0);
 
-    printf("[DEBUG] Attempting to bind PASV socket to port: %d\n", state->pasv_port);
-
-    // 绑定套接字到选择的端口号
+    // 绑定套接字
     if (bind(state->pasv_socket, (struct sockaddr *)&pasv_addr, sizeof(pasv_addr)) < 0)
     {
         perror("bind");
@@ -335,6 +335,16 @@ void ftp_pasv(int clientSocket, FtpState *state)
         send(clientSocket, msg, strlen(msg), 0);
         return;
     }
+    if (getsockname(state->pasv_socket, (struct sockaddr *)&pasv_addr, (socklen_t *)&addr_len) < 0)
+    {
+        perror("getsockname");
+        sprintf(msg, "421 Failed to bind PASV socket.\r\n");
+        send(clientSocket, msg, strlen(msg), 0);
+        return;
+    }
+    state->pasv_port = ntohs(pasv_addr.sin_port);
+
+    printf("[DEBUG] PASV socket bound to port: %d\n", state->pasv_port);
 
     // 开始监听
     if (listen(state->pasv_socket, 1) < 0)
@@ -383,28 +393,32 @@ void ftp_pasv(int clientSocket, FtpState *state)
 void ftp_retr(int clientSocket, FtpState *state, const char *filename)
 {
     printf("[DEBUG] RETR command received with filename: %s\n", filename);
-    FILE *file;
-    char buffer[MAXSIZE];
+    int fd;
+    struct stat st;
     char full_path[MAXSIZE];
     int dataSocket;
-    int bytes_read;
+    off_t offset = 0;
 
     snprintf(full_path, sizeof(full_path), "%s%s/%s", state->root_dir, strcmp(state->current_dir, "/") == 0 ? "" : state->current_dir, filename);
 
     printf("[DEBUG] RETR command received. Full path to retrieve: %s\n", full_path);
 
-    file = fopen(full_path, "rb");
-    if (file == NULL)
+    fd = open(full_path, O_RDONLY);
+    if (fd < 0 || fstat(fd, &st) < 0 || S_ISDIR(st.st_mode))
     {
-        perror("fopen");
-        send(clientSocket, "550 File not found or access denied.\r\n", 37, 0);
+        perror("open");
+        if (fd >= 0)
+        {
+            close(fd);
+        }
+        send(clientSocket, "550 File not found or access denied.\r\n", 38, 0);
         return;
     }
 
     if (state->data_connection_active == 0)
     {
         send(clientSocket, "425 Can't open data connection.\r\n", 33, 0);
-        fclose(file);
+        close(fd);
         return;
     }
 
@@ -422,7 +436,7 @@ void ftp_retr(int clientSocket, FtpState *state, const char *filename)
         {
             perror("accept");
             send(clientSocket, "425 Can't open data connection.\r\n", 33, 0);
-            fclose(file);
+            close(fd);
             return;
         }
         close(state->pasv_socket);
@@ -444,7 +458,7 @@ void ftp_retr(int clientSocket, FtpState *state, const char *filename)
             perror("socket");
             printf("[DEBUG] Error creating socket for active mode data connection.\n");
             send(clientSocket, "425 Can't open data connection.\r\n", 33, 0);
-            fclose(file);
+            close(fd);
             return;
         }
 
@@ -454,104 +468,86 @@ void ftp_retr(int clientSocket, FtpState *state, const char *filename)
             perror("connect");
             send(clientSocket, "425 Can't open data connection.\r\n", 33, 0);
             close(dataSocket);
-            fclose(file);
+            close(fd);
             return;
         }
     }
 
     if (state->transfer_offset > 0)
     {
-        fseek(file, state->transfer_offset, SEEK_SET);
+        offset = state->transfer_offset;
+        printf("[DEBUG] Resuming transfer from offset: %lld\n", (long long)offset);
         state->transfer_offset = 0;
     }
 
-    state->is_transferring = 1;
+    // 数据在后台线程中发送，控制连接继续处理 ABOR 和 STAT；传输结束后由会话循环回复 226
     printf("[DEBUG] Starting file transfer...\n");
-
-    while ((bytes_read = fread(buffer, 1, MAXSIZE, file)) > 0)
-    {
-        int total_sent = 0;
-        while (total_sent < bytes_read)
-        {
-            int sent = send(dataSocket, buffer + total_sent, bytes_read - total_sent, 0);
-            if (sent < 0)
-            {
-                perror("send");
-                send(clientSocket, "426 Connection closed; transfer aborted.\r\n", 43, 0);
-                fclose(file);
-                close(dataSocket);
-                state->is_transferring = 0;
-                return;
-            }
-            total_sent += sent;
-        }
-    }
-    printf("[DEBUG] File transfer complete.\n");
-    // Reset transferring flag
-    state->is_transferring = 0;
-    fclose(file);
-
-    shutdown(dataSocket, SHUT_WR);
-
-    close(dataSocket);
-
-    char response[256];
-    memset(response, 0, sizeof(response)); // 初始化整个缓冲区为0
-    snprintf(response, sizeof(response), "226 Transfer complete.\r\n");
-
-    send(clientSocket, response, strlen(response), 0);
-    printf("[DEBUG] Data connection closed.\n");
+    start_transfer(clientSocket, state, dataSocket, fd, NULL, offset, filename);
 }
 
-void ftp_stor(int clientSocket, FtpState *state, char *filename)
+// segment 为 1 表示客户端声明这是并行分段上传中的一段（"STOR 文件名 -segment"）：各段写入互不重叠的区间，
+// 使用共享锁并允许偏移量超过当前文件大小；普通的上传和续传独占文件
+void ftp_stor(int clientSocket, FtpState *state, char *filename, int segment)
 {
     char full_path[MAXSIZE];
     FILE *file;
-    char buffer[MAXSIZE];
-    int bytes_read;
     int dataSocket;
 
     snprintf(full_path, sizeof(full_path), "%s%s/%s", state->root_dir, strcmp(state->current_dir, "/") == 0 ? "" : state->current_dir, filename);
 
     printf("[DEBUG] STOR command received. Full path to save file: %s\n", full_path);
 
-    if (state->transfer_offset > 0)
+    // 不用 O_TRUNC 打开：先取得锁，确认没有其他客户端正在写这个文件之后才截断；续传时文件必须已经存在
+    int file_fd = open(full_path, O_RDWR | (state->transfer_offset > 0 ? 0 : O_CREAT), 0666);
+    file = file_fd < 0 ? NULL : fdopen(file_fd, "rb+");
+    if (file == NULL)
     {
-        file = fopen(full_path, "rb+");
-        if (file == NULL)
+        perror("[ERROR] open");
+        send(clientSocket, "550 Failed to open file.\r\n", 26, 0);
+        if (file_fd >= 0)
         {
-            perror("[ERROR] fopen");
-            send(clientSocket, "550 Failed to open file.\r\n", 27, 0);
-            return;
+            close(file_fd);
         }
-        fseek(file, 0, SEEK_END);
-        long file_size = ftell(file);
+        return;
+    }
 
-        if (state->transfer_offset > file_size)
+    if (flock(file_fd, (segment ? LOCK_SH : LOCK_EX) | LOCK_NB) != 0)
+    {
+        perror("[ERROR] flock");
+        send(clientSocket, "550 File is currently being written by another client.\r\n", 56, 0);
+        fclose(file);
+        return;
+    }
+
+    if (state->transfer_offset > 0)
+    {
+        struct stat st;
+        // 分段上传的各段到达顺序不定，偏移量可以超过当前文件大小，中间的空洞由其他分段填满
+        if (!segment && (fstat(file_fd, &st) < 0 || state->transfer_offset > (long long)st.st_size))
         {
-            send(clientSocket, "501 Invalid offset.\r\n", 22, 0);
+            send(clientSocket, "501 Invalid offset.\r\n", 21, 0);
+            state->transfer_offset = 0;
+            flock(file_fd, LOCK_UN);
             fclose(file);
             return;
         }
         fseek(file, state->transfer_offset, SEEK_SET);
-        printf("[DEBUG] Resuming upload at offset: %ld\n", state->transfer_offset);
+        printf("[DEBUG] Resuming upload at offset: %lld\n", state->transfer_offset);
     }
-    else
+    else if (!segment && ftruncate(file_fd, 0) < 0)
     {
-        file = fopen(full_path, "wb");
-        if (file == NULL)
-        {
-            perror("[ERROR] fopen");
-            send(clientSocket, "550 Failed to open file.\r\n", 27, 0);
-            return;
-        }
+        perror("[ERROR] ftruncate");
+        send(clientSocket, "550 Failed to open file.\r\n", 26, 0);
+        flock(file_fd, LOCK_UN);
+        fclose(file);
+        return;
     }
 
-    int file_fd = fileno(file);
-    if (flock(file_fd, LOCK_EX | LOCK_NB) != 0)
+    // 客户端用 ALLO 给出了文件大小时预先分配磁盘空间，空间不足时在传输开始前就拒绝
+    if (preallocate_file(file_fd, state) < 0)
     {
-        perror("[ERROR] flock");
-        send(clientSocket, "550 File is currently being written by another client.\r\n", 55, 0);
+        send(clientSocket, "552 Insufficient storage space.\r\n", 33, 0);
+        flock(file_fd, LOCK_UN);
         fclose(file);
         return;
     }
@@ -593,6 +589,7 @@ void ftp_stor(int clientSocket, FtpState *state, char *filename)
         data_addr.sin_port = htons(state->port_port);
         inet_pton(AF_INET, state->port_ip, &data_addr.sin_addr);
 
+        set_data_rcvbuf(dataSocket, state);
         if (connect(dataSocket, (struct sockaddr *)&data_addr, sizeof(data_addr)) < 0)
         {
             perror("[ERROR] connect");
@@ -609,36 +606,9 @@ void ftp_stor(int clientSocket, FtpState *state, char *filename)
         return;
     }
 
-    state->is_transferring = 1;
-    while ((bytes_read = recv(dataSocket, buffer, sizeof(buffer), 0)) > 0)
-    {
-        if (fwrite(buffer, 1, bytes_read, file) < bytes_read)
-        {
-            perror("[ERROR] fwrite");
-            send(clientSocket, "552 Requested file action aborted. Exceeded storage allocation.\r\n", 67, 0);
-            break;
-        }
-    }
-
-    if (bytes_read < 0)
-    {
-        perror("[ERROR] recv");
-        send(clientSocket, "426 Connection closed; transfer aborted.\r\n", 49, 0);
-    }
-
-    flock(file_fd, LOCK_UN);
-    state->is_transferring = 0;
+    // 数据在后台线程中接收，文件的解锁和关闭以及 226 的回复由 finish_transfer 完成
+    start_transfer(clientSocket, state, dataSocket, file_fd, file, (off_t)state->transfer_offset, filename);
     state->transfer_offset = 0;
-
-    fclose(file);
-    close(dataSocket);
-
-    char response[256];
-    memset(response, 0, sizeof(response)); // 初始化整个缓冲区为0
-    snprintf(response, sizeof(response), "226 Transfer complete.\r\n");
-
-    send(clientSocket, response, strlen(response), 0);
-    printf("[DEBUG] File transfer complete: %s\n", full_path);
 }
 // 实现 ftp_mkd 函数
 void ftp_mkd(int clientSocket, FtpState *state, char *dirname)
@@ -708,6 +678,11 @@ void ftp_cwd(int clientSocket, FtpState *state, const char *dirname)
         // 如果是当前目录，不做任何改变
         strcpy(temp_dir, state->current_dir);
     }
+    else if (dirname[0] == '/')
+    {
+        // 绝对路径：相对于服务器根目录，而不是当前目录
+        snprintf(temp_dir, sizeof(temp_dir), "%s", dirname);
+    }
     else
     {
         // 普通目录：拼接路径（确保格式正确）
@@ -797,7 +772,7 @@ void ftp_rmd(int clientSocket, FtpState *state, const char *dirname)
     {
         perror("[ERROR] flock");
         close(dir_fd);
-        send(clientSocket, "550 Failed to lock directory.\r\n", 32, 0);
+        send(clientSocket, "550 Failed to lock directory.\r\n", 31, 0);
         return;
     }
 
@@ -821,15 +796,64 @@ void ftp_rmd(int clientSocket, FtpState *state, const char *dirname)
     printf("[DEBUG] Directory removed successfully: %s\n", full_path);
 }
 
+// 实现 ftp_dele 函数：删除文件
+void ftp_dele(int clientSocket, FtpState *state, const char *filename)
+{
+    char full_path[MAXSIZE];
+    char msg[MAXSIZE];
+    struct stat st;
+
+    if (filename == NULL || strlen(filename) == 0)
+    {
+        send(clientSocket, "501 Missing file name.\r\n", 24, 0);
+        return;
+    }
+
+    snprintf(full_path, sizeof(full_path), "%s%s/%s", state->root_dir, filename[0] == '/' ? "" : state->current_dir, filename);
+    normalize_path(full_path);
+
+    printf("[DEBUG] DELE command received. Full path to file: %s\n", full_path);
+
+    // 只删除普通文件和符号链接，目录用 RMD
+    if (lstat(full_path, &st) < 0 || S_ISDIR(st.st_mode))
+    {
+        send(clientSocket, "550 File not found.\r\n", 21, 0);
+        return;
+    }
+
+    // 与 STOR 相同，用独占锁等待正在进行的上传结束
+    int fd = open(full_path, O_RDONLY | O_NOFOLLOW);
+    if (fd >= 0)
+    {
+        flock(fd, LOCK_EX);
+    }
+    if (unlink(full_path) < 0)
+    {
+        perror("[ERROR] unlink");
+        if (fd >= 0)
+        {
+            close(fd);
+        }
+        send(clientSocket, "550 Failed to delete file.\r\n", 28, 0);
+        return;
+    }
+    if (fd >= 0)
+    {
+        close(fd);
+    }
+
+    sprintf(msg, "250 File \"%s\" deleted.\r\n", filename);
+    send(clientSocket, msg, strlen(msg), 0);
+
+    printf("[DEBUG] File deleted successfully: %s\n", full_path);
+}
+
 // 实现list函数
 // 实现 ftp_list 函数
 void ftp_list(int clientSocket, FtpState *state, const char *parameter)
 {
     char full_path[MAXSIZE];
-    char msg[MAXSIZE];
-    char data_buffer[MAXSIZE];
     int dataSocket;
-    FILE *ls_fp;
 
     // 设置默认目录为当前目录
     if (parameter == NULL || strlen(parameter) == 0)
@@ -839,7 +863,8 @@ void ftp_list(int clientSocket, FtpState *state, const char *parameter)
     else
     {
         // 处理带参数的 LIST 命令，例如：LIST subdir
-        snprintf(full_path, sizeof(full_path), "%s%s/%s", state->root_dir, state->current_dir, parameter);
+        // 以 '/' 开头的参数相对于服务器根目录，否则相对于当前目录
+        snprintf(full_path, sizeof(full_path), "%s%s/%s", state->root_dir, parameter[0] == '/' ? "" : state->current_dir, parameter);
     }
 
     // 规范化路径（去除多余的斜杠）
@@ -865,33 +890,363 @@ void ftp_list(int clientSocket, FtpState *state, const char *parameter)
         return;
     }
 
-    // 执行 ls -l 命令获取目录列表
-    char cmd[MAXSIZE];
-    snprintf(cmd, sizeof(cmd), "ls -l %s", full_path);
-    ls_fp = popen(cmd, "r");
-    if (ls_fp == NULL)
+    // 在进程内读取目录并生成 ls -l 格式的列表，通过缓冲区成块发送
+    DataWriter *writer = malloc(sizeof(DataWriter));
+    if (writer != NULL)
+    {
+        writer_init(writer, dataSocket);
+        if (state->mode_z)
+        {
+            writer_deflate(writer, state->z_level);
+        }
+    }
+    int result = writer == NULL ? -1 : write_directory_listing(writer, full_path);
+    // writer_finish 在 MODE Z 时结束压缩流；列表生成失败时也要调用，以释放压缩器
+    if (writer != NULL && writer_finish(writer) < 0)
     {
-        perror("[ERROR] popen");
+        result = -1;
+    }
+    if (result < 0)
+    {
+        free(writer);
         send(clientSocket, "451 Failed to list directory.\r\n", 31, 0);
         close(dataSocket);
         return;
     }
+    free(writer);
+
+    // 关闭数据连接
+    close(dataSocket);
 
-    // 通过数据连接发送目录列表
-    while (fgets(data_buffer, sizeof(data_buffer), ls_fp) != NULL)
+    // 发送 226 响应，表示传输完成
+    send(clientSocket, "226 Directory send OK.\r\n", 24, 0);
+    printf("[DEBUG] Directory listing sent successfully for path: %s\n", full_path);
+}
+
+// 实现 ftp_mlsd 函数：机器可读的目录列表，每行 "facts; name"
+void ftp_mlsd(int clientSocket, FtpState *state, const char *parameter)
+{
+    char full_path[MAXSIZE];
+    struct stat st;
+    int dataSocket;
+
+    if (parameter == NULL || strlen(parameter) == 0)
+    {
+        snprintf(full_path, sizeof(full_path), "%s%s", state->root_dir, state->current_dir);
+    }
+    else
+    {
+        // 以 '/' 开头的参数相对于服务器根目录，否则相对于当前目录
+        snprintf(full_path, sizeof(full_path), "%s%s/%s", state->root_dir, parameter[0] == '/' ? "" : state->current_dir, parameter);
+    }
+    normalize_path(full_path);
+    printf("[DEBUG] MLSD command received. Full path to list: %s\n", full_path);
+
+    if (stat(full_path, &st) < 0)
     {
-        send(dataSocket, data_buffer, strlen(data_buffer), 0);
+        send(clientSocket, "550 Directory not found.\r\n", 26, 0);
+        return;
+    }
+    if (!S_ISDIR(st.st_mode))
+    {
+        send(clientSocket, "501 Not a directory.\r\n", 22, 0);
+        return;
     }
 
-    // 关闭目录列表文件指针
-    pclose(ls_fp);
+    send(clientSocket, "150 Here comes the directory listing.\r\n", 39, 0);
 
-    // 关闭数据连接
+    dataSocket = setup_data_connection(clientSocket, state);
+    if (dataSocket < 0)
+    {
+        send(clientSocket, "425 Can't open data connection.\r\n", 33, 0);
+        return;
+    }
+
+    DataWriter *writer = malloc(sizeof(DataWriter));
+    if (writer != NULL)
+    {
+        writer_init(writer, dataSocket);
+        if (state->mode_z)
+        {
+            writer_deflate(writer, state->z_level);
+        }
+    }
+    int result = writer == NULL ? -1 : write_mlsd_listing(writer, full_path);
+    // writer_finish 在 MODE Z 时结束压缩流；列表生成失败时也要调用，以释放压缩器
+    if (writer != NULL && writer_finish(writer) < 0)
+    {
+        result = -1;
+    }
+    if (result < 0)
+    {
+        free(writer);
+        send(clientSocket, "451 Failed to list directory.\r\n", 31, 0);
+        close(dataSocket);
+        return;
+    }
+    free(writer);
     close(dataSocket);
 
-    // 发送 226 响应，表示传输完成
     send(clientSocket, "226 Directory send OK.\r\n", 24, 0);
-    printf("[DEBUG] Directory listing sent successfully for path: %s\n", full_path);
+    printf("[DEBUG] MLSD listing sent successfully for path: %s\n", full_path);
+}
+
+// 实现 ftp_mlst 函数：在控制连接上返回单个文件或目录的信息
+void ftp_mlst(int clientSocket, FtpState *state, const char *parameter)
+{
+    char full_path[MAXSIZE];
+    char display[MAXSIZE];
+    char line[MAXSIZE * 2];
+    char msg[MAXSIZE * 3];
+    struct stat st;
+
+    // 不带参数时返回当前目录本身
+    if (parameter == NULL || strlen(parameter) == 0)
+    {
+        snprintf(display, sizeof(display), "%s", state->current_dir);
+    }
+    else if (parameter[0] == '/')
+    {
+        snprintf(display, sizeof(display), "%s", parameter);
+    }
+    else
+    {
+        snprintf(display, sizeof(display), "%s/%s", strcmp(state->current_dir, "/") == 0 ? "" : state->current_dir, parameter);
+    }
+    normalize_path(display);
+    snprintf(full_path, sizeof(full_path), "%s%s", state->root_dir, display);
+    normalize_path(full_path);
+    printf("[DEBUG] MLST command received. Full path: %s\n", full_path);
+
+    if (stat(full_path, &st) < 0)
+    {
+        send(clientSocket, "550 File not found.\r\n", 21, 0);
+        return;
+    }
+
+    format_mlsx_entry(line, sizeof(line), AT_FDCWD, full_path, display, &st);
+    snprintf(msg, sizeof(msg), "250-Listing %s\r\n %s\r\n250 End.\r\n", display, line);
+    send(clientSocket, msg, strlen(msg), 0);
+}
+
+// 实现 ftp_feat 函数：列出服务器支持的扩展命令
+void ftp_feat(int clientSocket, FtpState *state)
+{
+    char algorithms[128] = "";
+    char msg[MAXSIZE];
+
+    // HASH 后列出支持的算法，当前选择的算法后面加 '*'
+    for (int i = 0; i < HASH_ALGORITHMS; i++)
+    {
+        size_t len = strlen(algorithms);
+        snprintf(algorithms + len, sizeof(algorithms) - len, "%s%s%s", i > 0 ? ";" : "", hash_algorithm_name(i),
+                 i == state->hash_algorithm ? "*" : "");
+    }
+    snprintf(msg, sizeof(msg),
+             "211-Features:\r\n"
+             " HASH %s\r\n"
+             " MLST type*;size*;modify*;perm*;\r\n"
+             " MODE Z\r\n"
+             " RANG STREAM\r\n"
+             " REST STREAM\r\n"
+             " SIZE\r\n"
+             " XCRC\r\n"
+             " XMD5\r\n"
+             " XSHA1\r\n"
+             " XSHA256\r\n"
+             "211 End\r\n",
+             algorithms);
+    send(clientSocket, msg, strlen(msg), 0);
+}
+
+// 实现 ftp_mode 函数：S 为默认的流模式，Z 为 deflate 压缩的流模式
+void ftp_mode(int clientSocket, FtpState *state, const char *mode)
+{
+    if (strcmp(mode, "S") == 0)
+    {
+        state->mode_z = 0;
+        send(clientSocket, "200 Mode set to S.\r\n", 20, 0);
+    }
+    else if (strcmp(mode, "Z") == 0)
+    {
+        state->mode_z = 1;
+        send(clientSocket, "200 Mode set to Z.\r\n", 20, 0);
+    }
+    else
+    {
+        char *msg = "504 Command not implemented for that parameter.\r\n";
+        send(clientSocket, msg, strlen(msg), 0);
+    }
+    printf("[DEBUG] MODE %s, compression %s (level %d)\n", mode, state->mode_z ? "on" : "off", state->z_level);
+}
+
+// 实现 ftp_opts 函数："OPTS MODE Z LEVEL n"（0-9）设置压缩级别，不带 LEVEL 时报告当前级别；
+// "OPTS HASH <算法>" 选择 HASH 命令使用的算法，不带算法时报告当前算法
+void ftp_opts(int clientSocket, FtpState *state, const char *input_msg)
+{
+    char option[16] = {0};
+    char mode[16] = {0};
+    char key[16] = {0};
+    int level = -1;
+    char msg[MAXSIZE];
+    int n = sscanf(input_msg, "%*s %15s %15s %15s %d", option, mode, key, &level);
+
+    if (n >= 1 && strcmp(option, "HASH") == 0)
+    {
+        int algorithm = n >= 2 ? hash_algorithm(mode) : state->hash_algorithm;
+        if (algorithm < 0)
+        {
+            snprintf(msg, sizeof(msg), "504 Unknown hash algorithm.\r\n");
+        }
+        else
+        {
+            state->hash_algorithm = algorithm;
+            snprintf(msg, sizeof(msg), "200 %s\r\n", hash_algorithm_name(algorithm));
+        }
+        send(clientSocket, msg, strlen(msg), 0);
+        printf("[DEBUG] OPTS: %s", msg);
+        return;
+    }
+    if (n < 2 || strcmp(option, "MODE") != 0 || strcmp(mode, "Z") != 0)
+    {
+        send(clientSocket, "501 Option not understood.\r\n", 28, 0);
+        return;
+    }
+    if (n == 2)
+    {
+        snprintf(msg, sizeof(msg), "200 MODE Z LEVEL %d\r\n", state->z_level);
+    }
+    else if (n == 4 && strcmp(key, "LEVEL") == 0 && level >= 0 && level <= 9)
+    {
+        state->z_level = level;
+        snprintf(msg, sizeof(msg), "200 MODE Z LEVEL set to %d.\r\n", level);
+    }
+    else
+    {
+        snprintf(msg, sizeof(msg), "501 Invalid MODE Z option.\r\n");
+    }
+    send(clientSocket, msg, strlen(msg), 0);
+    printf("[DEBUG] OPTS: %s", msg);
+}
+
+// 实现 ftp_rang 函数："RANG 起点 终点" 设置下一次 HASH 的范围（包含两端的字节偏移），"RANG 1 0" 取消
+void ftp_rang(int clientSocket, FtpState *state, const char *input_msg)
+{
+    long long start = 0;
+    long long end = 0;
+    char msg[MAXSIZE];
+
+    if (sscanf(input_msg, "%*s %lld %lld", &start, &end) != 2)
+    {
+        send(clientSocket, "501 Syntax error: RANG <start> <end>.\r\n", 39, 0);
+        return;
+    }
+    if (start == 1 && end == 0)
+    {
+        state->rang_start = 0;
+        state->rang_end = -1;
+        send(clientSocket, "350 Restarting at 0. Ending byte at EOF.\r\n", 42, 0);
+        return;
+    }
+    if (start < 0 || end < start)
+    {
+        send(clientSocket, "501 Invalid range.\r\n", 20, 0);
+        return;
+    }
+    state->rang_start = start;
+    state->rang_end = end;
+    snprintf(msg, sizeof(msg), "350 Restarting at %lld. Ending byte at %lld.\r\n", start, end);
+    send(clientSocket, msg, strlen(msg), 0);
+    printf("[DEBUG] RANG %lld-%lld\n", start, end);
+}
+
+// 计算校验和并回复错误；成功时返回 0，hex 和 *end_out 为结果
+static int checksum_reply(int clientSocket, FtpState *state, const char *filename, int algorithm, long long start,
+                          long long end, long long *end_out, char *hex)
+{
+    char full_path[MAXSIZE];
+
+    // 以 '/' 开头的文件名相对于服务器根目录，否则相对于当前目录
+    snprintf(full_path, sizeof(full_path), "%s%s/%s", state->root_dir, filename[0] == '/' ? "" : state->current_dir, filename);
+    normalize_path(full_path);
+
+    // ".." 越过根目录时 normalize_path 会得到根目录之外的路径
+    size_t root_len = strlen(state->root_dir);
+    while (root_len > 0 && state->root_dir[root_len - 1] == '/')
+    {
+        root_len--;
+    }
+    int result = -1;
+    if (strncmp(full_path, state->root_dir, root_len) == 0 && (full_path[root_len] == '/' || full_path[root_len] == '\0'))
+    {
+        result = file_checksum(full_path, algorithm, start, end, end_out, hex);
+    }
+    if (result == -1)
+    {
+        send(clientSocket, "550 File not found or not a regular file.\r\n", 43, 0);
+    }
+    else if (result == -2)
+    {
+        send(clientSocket, "501 Invalid range.\r\n", 20, 0);
+    }
+    return result;
+}
+
+// 实现 ftp_hash 函数：回复 "213 算法 起点-终点 校验和 文件名"，范围包含两端（与 RANG 相同），默认为整个文件
+// 结果来自校验和缓存，文件没有变化时不需要重新读取
+void ftp_hash(int clientSocket, FtpState *state, const char *filename)
+{
+    char hex[HASH_HEX_SIZE];
+    char msg[MAXSIZE * 2];
+    long long start = 0;
+    long long end = -1;
+    long long end_used = 0;
+
+    if (filename == NULL || strlen(filename) == 0)
+    {
+        send(clientSocket, "501 Missing file name.\r\n", 24, 0);
+        return;
+    }
+    if (state->rang_end >= 0)
+    {
+        start = state->rang_start;
+        end = state->rang_end + 1;
+    }
+    // RANG 只对下一次 HASH 有效
+    state->rang_start = 0;
+    state->rang_end = -1;
+
+    if (checksum_reply(clientSocket, state, filename, state->hash_algorithm, start, end, &end_used, hex) < 0)
+    {
+        return;
+    }
+    // 空范围（例如空文件）的终点写作起点
+    snprintf(msg, sizeof(msg), "213 %s %lld-%lld %s %s\r\n", hash_algorithm_name(state->hash_algorithm), start,
+             end_used > start ? end_used - 1 : start, hex, filename);
+    send(clientSocket, msg, strlen(msg), 0);
+}
+
+// 实现 ftp_xhash 函数：旧式的 XCRC/XMD5/XSHA1/XSHA256 文件名 [起点 [终点]]，范围为 [起点, 终点)，回复 "250 校验和"
+void ftp_xhash(int clientSocket, FtpState *state, int algorithm, const char *input_msg)
+{
+    char filename[MAXSIZE] = {0};
+    char hex[HASH_HEX_SIZE];
+    char msg[MAXSIZE];
+    long long start = 0;
+    long long end = -1;
+    long long end_used = 0;
+
+    if (sscanf(input_msg, "%*s %1023s %lld %lld", filename, &start, &end) < 1)
+    {
+        send(clientSocket, "501 Missing file name.\r\n", 24, 0);
+        return;
+    }
+    if (checksum_reply(clientSocket, state, filename, algorithm, start, end, &end_used, hex) < 0)
+    {
+        return;
+    }
+    snprintf(msg, sizeof(msg), "250 %s\r\n", hex);
+    send(clientSocket, msg, strlen(msg), 0);
 }
 
 // 处理 REST 命令
@@ -905,7 +1260,7 @@ void ftp_rest(int clientSocket, FtpState *state, const char *offset)
     // 验证偏移量是否合理
     if (file_offset < 0)
     {
-        send(clientSocket, "501 Invalid offset.\r\n", 22, 0);
+        send(clientSocket, "501 Invalid offset.\r\n", 21, 0);
         return;
     }
 
@@ -914,7 +1269,7 @@ void ftp_rest(int clientSocket, FtpState *state, const char *offset)
     printf("[DEBUG] File transfer offset set to: %ld\n", file_offset);
 
     // 响应客户端，通知 REST 命令成功
-    send(clientSocket, "350 Restart position accepted.\r\n", 33, 0);
+    send(clientSocket, "350 Restart position accepted.\r\n", 32, 0);
 }
 
 // 实现 ftp_size 函数
@@ -958,11 +1313,11 @@ void ftp_size(int clientSocket, FtpState *state, const char *filename)
 void ftp_retr_resume(int clientSocket, FtpState *state, char *filename)
 {
     printf("[DEBUG] RETR resume command received with filename: %s\n", filename);
-    FILE *file;
-    char buffer[MAXSIZE];
+    int fd;
+    struct stat st;
     char full_path[MAXSIZE];
     int dataSocket;
-    int bytes_read;
+    off_t offset = 0;
 
     // Construct the full file path based on root_dir and current_dir
     snprintf(full_path, sizeof(full_path), "%s%s/%s", state->root_dir, strcmp(state->current_dir, "/") == 0 ? "" : state->current_dir, filename);
@@ -970,11 +1325,15 @@ void ftp_retr_resume(int clientSocket, FtpState *state, char *filename)
     printf("[DEBUG] RETR resume command. Full path to retrieve: %s\n", full_path);
 
     // Check if file exists and is readable
-    file = fopen(full_path, "rb"); // Open file in binary mode
-    if (file == NULL)
+    fd = open(full_path, O_RDONLY);
+    if (fd < 0 || fstat(fd, &st) < 0 || S_ISDIR(st.st_mode))
     {
-        perror("fopen");
-        send(clientSocket, "550 File not found or access denied.\r\n", 37, 0);
+        perror("open");
+        if (fd >= 0)
+        {
+            close(fd);
+        }
+        send(clientSocket, "550 File not found or access denied.\r\n", 38, 0);
         return;
     }
 
@@ -982,7 +1341,7 @@ void ftp_retr_resume(int clientSocket, FtpState *state, char *filename)
     if (state->data_connection_active == 0)
     {
         send(clientSocket, "425 Can't open data connection.\r\n", 33, 0);
-        fclose(file);
+        close(fd);
         return;
     }
 
@@ -998,7 +1357,7 @@ void ftp_retr_resume(int clientSocket, FtpState *state, char *filename)
         {
             perror("accept");
             send(clientSocket, "425 Can't open data connection.\r\n", 33, 0);
-            fclose(file);
+            close(fd);
             return;
         }
         close(state->pasv_socket);
@@ -1018,7 +1377,7 @@ void ftp_retr_resume(int clientSocket, FtpState *state, char *filename)
         {
             perror("socket");
             send(clientSocket, "425 Can't open data connection.\r\n", 33, 0);
-            fclose(file);
+            close(fd);
             return;
         }
 
@@ -1027,54 +1386,26 @@ void ftp_retr_resume(int clientSocket, FtpState *state, char *filename)
             perror("connect");
             send(clientSocket, "425 Can't open data connection.\r\n", 33, 0);
             close(dataSocket);
-            fclose(file);
+            close(fd);
             return;
         }
     }
 
     if (state->transfer_offset > 0)
     {
-        fseek(file, state->transfer_offset, SEEK_SET);
-        printf("[DEBUG] Resuming transfer from offset: %lld\n", (long long)state->transfer_offset);
+        offset = state->transfer_offset;
+        printf("[DEBUG] Resuming transfer from offset: %lld\n", (long long)offset);
+        state->transfer_offset = 0;
     }
 
-    state->is_transferring = 1;
+    // 数据在后台线程中发送，控制连接继续处理 ABOR 和 STAT；传输结束后由会话循环回复 226
     printf("[DEBUG] Starting file transfer...\n");
-
-    while ((bytes_read = fread(buffer, 1, MAXSIZE, file)) > 0)
-    {
-        int total_sent = 0;
-        while (total_sent < bytes_read)
-        {
-            int sent = send(dataSocket, buffer + total_sent, bytes_read - total_sent, 0);
-            if (sent < 0)
-            {
-                perror("send");
-                send(clientSocket, "426 Connection closed; transfer aborted.\r\n", 43, 0);
-                fclose(file);
-                close(dataSocket);
-                state->is_transferring = 0;
-                return;
-            }
-            total_sent += sent;
-        }
-    }
-    printf("[DEBUG] File transfer complete.\n");
-
-    state->is_transferring = 0;
-    fclose(file);
-    shutdown(dataSocket, SHUT_WR);
-    close(dataSocket);
-
-    send(clientSocket, "226 Transfer complete.\r\n", 24, 0);
-    printf("[DEBUG] Data connection closed.\n");
+    start_transfer(clientSocket, state, dataSocket, fd, NULL, offset, filename);
 }
 void ftp_stor_resume(int clientSocket, FtpState *state, char *filename)
 {
     char full_path[MAXSIZE];
     FILE *file;
-    char buffer[MAXSIZE];
-    int bytes_read;
     int dataSocket;
 
     snprintf(full_path, sizeof(full_path), "%s%s/%s", state->root_dir, strcmp(state->current_dir, "/") == 0 ? "" : state->current_dir, filename);
@@ -1085,18 +1416,36 @@ void ftp_stor_resume(int clientSocket, FtpState *state, char *filename)
     if (file == NULL)
     {
         perror("[ERROR] fopen");
-        send(clientSocket, "550 Failed to open file.\r\n", 27, 0);
+        send(clientSocket, "550 Failed to open file.\r\n", 26, 0);
         return;
     }
 
-    fseek(file, state->transfer_offset, SEEK_SET);
-    printf("[DEBUG] Resuming upload at offset: %lld\n", (long long)state->transfer_offset);
-
     int file_fd = fileno(file);
     if (flock(file_fd, LOCK_EX | LOCK_NB) != 0)
     {
         perror("[ERROR] flock");
-        send(clientSocket, "550 File is currently being written by another client.\r\n", 55, 0);
+        send(clientSocket, "550 File is currently being written by another client.\r\n", 56, 0);
+        fclose(file);
+        return;
+    }
+
+    struct stat st;
+    if (fstat(file_fd, &st) < 0 || state->transfer_offset > (long long)st.st_size)
+    {
+        send(clientSocket, "501 Invalid offset.\r\n", 21, 0);
+        state->transfer_offset = 0;
+        flock(file_fd, LOCK_UN);
+        fclose(file);
+        return;
+    }
+    fseek(file, state->transfer_offset, SEEK_SET);
+    printf("[DEBUG] Resuming upload at offset: %lld\n", (long long)state->transfer_offset);
+
+    // 客户端用 ALLO 给出了文件大小时预先分配磁盘空间，空间不足时在传输开始前就拒绝
+    if (preallocate_file(file_fd, state) < 0)
+    {
+        send(clientSocket, "552 Insufficient storage space.\r\n", 33, 0);
+        flock(file_fd, LOCK_UN);
         fclose(file);
         return;
     }
@@ -1137,6 +1486,7 @@ void ftp_stor_resume(int clientSocket, FtpState *state, char *filename)
         data_addr.sin_port = htons(state->port_port);
         inet_pton(AF_INET, state->port_ip, &data_addr.sin_addr);
 
+        set_data_rcvbuf(dataSocket, state);
         if (connect(dataSocket, (struct sockaddr *)&data_addr, sizeof(data_addr)) < 0)
         {
             perror("[ERROR] connect");
@@ -1153,29 +1503,7 @@ void ftp_stor_resume(int clientSocket, FtpState *state, char *filename)
         return;
     }
 
-    state->is_transferring = 1;
-    while ((bytes_read = recv(dataSocket, buffer, sizeof(buffer), 0)) > 0)
-    {
-        if (fwrite(buffer, 1, bytes_read, file) < bytes_read)
-        {
-            perror("[ERROR] fwrite");
-            send(clientSocket, "552 Requested file action aborted. Exceeded storage allocation.\r\n", 67, 0);
-            break;
-        }
-    }
-
-    if (bytes_read < 0)
-    {
-        perror("[ERROR] recv");
-        send(clientSocket, "426 Connection closed; transfer aborted.\r\n", 49, 0);
-    }
-
-    flock(file_fd, LOCK_UN);
-    state->is_transferring = 0;
+    // 数据在后台线程中接收，文件的解锁和关闭以及 226 的回复由 finish_transfer 完成
+    start_transfer(clientSocket, state, dataSocket, file_fd, file, (off_t)state->transfer_offset, filename);
     state->transfer_offset = 0;
-
-    fclose(file);
-    close(dataSocket);
-    send(clientSocket, "226 Transfer complete.\r\n", 24, 0);
-    printf("[DEBUG] File transfer complete: %s\n", full_path);
 }
@@ -3,19 +3,24 @@
 void respond_to_client(char *input_msg, int clientSocket, char *root_dir, FtpState *current_State)
 {
     // 接受客户端命令，分离命令和参数
-    char command[MAXSIZE];
+    char command[MAXSIZE] = {0};
     char arg[MAXSIZE] = {0}; // 初始化参数为空字符串，防止未传递参数时访问非法内存
-    sscanf(input_msg, "%s %s", command, arg);
+    char flag[MAXSIZE] = {0}; // 参数之后的选项，例如 "STOR 文件名 -segment"
+    sscanf(input_msg, "%s %s %s", command, arg, flag);
 
     printf("[DEBUG] Command received: %s, Argument: %s\n", command, arg);
 
-    // 如果正在传输文件，只允许处理 ABOR 和 QUIT 命令
+    // 如果正在传输文件（数据在后台线程中收发），只允许处理 ABOR、STAT 和 QUIT 命令
     if (current_State->is_transferring)
     {
         if (strcmp(command, "ABOR") == 0)
         {
             ftp_abor(clientSocket, current_State);
         }
+        else if (strcmp(command, "STAT") == 0)
+        {
+            ftp_stat(clientSocket, current_State);
+        }
         else if (strcmp(command, "QUIT") == 0)
         {
             ftp_quit(clientSocket, current_State);
@@ -61,6 +66,12 @@ void respond_to_client(char *input_msg, int clientSocket, char *root_dir, FtpSta
         {
             send(clientSocket, "215 UNIX Type: L8\r\n", 19, 0);
         }
+        else if (strcmp(command, "NOOP") == 0)
+        {
+            // 空操作，客户端用来检查控制连接是否仍然可用
+            char *msg = "200 NOOP ok.\r\n";
+            send(clientSocket, msg, strlen(msg), 0);
+        }
         else if (strcmp(command, "TYPE") == 0)
         {
             if (strcmp(arg, "I") != 0)
@@ -74,6 +85,33 @@ void respond_to_client(char *input_msg, int clientSocket, char *root_dir, FtpSta
                 send(clientSocket, msg, strlen(msg), 0);
             }
         }
+        else if (strcmp(command, "MODE") == 0)
+        {
+            ftp_mode(clientSocket, current_State, arg);
+        }
+        else if (strcmp(command, "OPTS") == 0)
+        {
+            // OPTS 的参数有多个单词，交给 ftp_opts 解析整条命令
+            ftp_opts(clientSocket, current_State, input_msg);
+        }
+        else if (strcmp(command, "RANG") == 0)
+        {
+            ftp_rang(clientSocket, current_State, input_msg);
+        }
+        else if (strcmp(command, "HASH") == 0)
+        {
+            ftp_hash(clientSocket, current_State, arg);
+        }
+        else if (strcmp(command, "XCRC") == 0 || strcmp(command, "XMD5") == 0 || strcmp(command, "XSHA1") == 0 ||
+                 strcmp(command, "XSHA256") == 0)
+        {
+            // 旧式的校验和命令：XCRC 文件名 [起点 [终点]]
+            int algorithm = strcmp(command, "XCRC") == 0   ? HASH_CRC32
+                            : strcmp(command, "XMD5") == 0 ? HASH_MD5
+                            : strcmp(command, "XSHA1") == 0 ? HASH_SHA1
+                                                            : HASH_SHA256;
+            ftp_xhash(clientSocket, current_State, algorithm, input_msg);
+        }
         else if (strcmp(command, "QUIT") == 0)
         {
             ftp_quit(clientSocket, current_State);
@@ -82,6 +120,10 @@ void respond_to_client(char *input_msg, int clientSocket, char *root_dir, FtpSta
         {
             ftp_abor(clientSocket, current_State);
         }
+        else if (strcmp(command, "STAT") == 0)
+        {
+            ftp_stat(clientSocket, current_State);
+        }
         else if (strcmp(command, "PORT") == 0)
         {
             ftp_port(clientSocket, current_State, arg);
@@ -126,8 +168,8 @@ void respond_to_client(char *input_msg, int clientSocket, char *root_dir, FtpSta
                 }
                 else
                 {
-                    // 处理 STOR 命令
-                    ftp_stor(clientSocket, current_State, arg);
+                    // 处理 STOR 命令；"-segment" 表示并行分段上传中的一段
+                    ftp_stor(clientSocket, current_State, arg, strcmp(flag, "-segment") == 0);
                 }
                 current_State->data_connection_active = 0; // 重置数据连接状态
             }
@@ -153,10 +195,26 @@ void respond_to_client(char *input_msg, int clientSocket, char *root_dir, FtpSta
         {
             ftp_list(clientSocket, current_State, arg);
         }
+        else if (strcmp(command, "MLSD") == 0)
+        {
+            ftp_mlsd(clientSocket, current_State, arg);
+        }
+        else if (strcmp(command, "MLST") == 0)
+        {
+            ftp_mlst(clientSocket, current_State, arg);
+        }
+        else if (strcmp(command, "FEAT") == 0)
+        {
+            ftp_feat(clientSocket, current_State);
+        }
         else if (strcmp(command, "RMD") == 0)
         {
             ftp_rmd(clientSocket, current_State, arg);
         }
+        else if (strcmp(command, "DELE") == 0)
+        {
+            ftp_dele(clientSocket, current_State, arg);
+        }
         else if (strcmp(command, "REST") == 0)
         {
             // 将偏移量保存到服务器状态中
@@ -168,6 +226,21 @@ void respond_to_client(char *input_msg, int clientSocket, char *root_dir, FtpSta
             send(clientSocket, msg, strlen(msg), 0);
             printf("[DEBUG] REST command received. Set transfer offset to %lld\n", (long long)offset);
         }
+        else if (strcmp(command, "ALLO") == 0)
+        {
+            // 记录客户端声明的文件大小，下一次 STOR 时预先分配磁盘空间
+            long long size = atoll(arg);
+            if (size < 0)
+            {
+                send(clientSocket, "501 Invalid size.\r\n", 19, 0);
+            }
+            else
+            {
+                current_State->alloc_size = size;
+                send(clientSocket, "200 ALLO command successful.\r\n", 30, 0);
+                printf("[DEBUG] ALLO command received. Will preallocate %lld bytes\n", size);
+            }
+        }
         else if (strcmp(command, "SIZE") == 0)
         {
             ftp_size(clientSocket, current_State, arg);
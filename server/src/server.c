@@ -25,83 +25,343 @@
 子进程轮询接收客户端命令，调用处理函数进行相应处理。
 关闭连接：
 
-在完成数据交换后，关闭所有相关的套接字，释放资源，优雅地结束连接。*/
+在完成数据交换后，关闭所有相关的套接字，释放资源，优雅地结束连接。
+
+并发模型（-mode）：
+prefork（默认）：主进程预先创建 -workers 个 worker 进程，共享同一个监听套接字，各自 accept 并依次处理会话，
+会话结束后 worker 继续等待下一个连接而不退出；空闲 worker 不足时主进程追加创建，总数不超过 -max-sessions，
+超出的连接在监听队列（-backlog）中排队，直到有 worker 空闲。
+fork：每个连接 fork 一个子进程（原来的模型），同时进行的会话超过 -max-sessions 时回复 421 并关闭连接。*/
 #include "server.h"
 #include <signal.h>
-
-#define BACKLOG 3
+#include <errno.h>
+#include <fcntl.h>
+#include <netinet/tcp.h>
+#include <poll.h>
+#include <sys/mman.h>
+#include <sys/wait.h>
+
+#define BACKLOG 128
 #define WELCOME_MSG "220 ftp.ssast.org FTP server ready.\r\n"
+#define TOO_MANY_MSG "421 Too many users, please try again later.\r\n"
 #define ROOT_DIRECTORY "/mnt/d/ftp_data"
 
+#define DEFAULT_WORKERS 8
+#define DEFAULT_MAX_SESSIONS 256
+#define MIN_SPARE_WORKERS 4  // 空闲 worker 少于这个数时主进程追加创建
+#define MAX_SPARE_WORKERS 16 // 空闲 worker 多于这个数时，超出 -workers 的 worker 处理完会话后退出
+
+// prefork 模式下主进程和 worker 共享的计数器（匿名共享内存）
+typedef struct
+{
+    volatile int idle;  // 正在等待连接的 worker 数，worker 用原子操作更新
+    volatile int total; // worker 总数，只由主进程更新
+} Scoreboard;
+
+static Scoreboard *board = NULL;
+static int notify_pipe[2] = {-1, -1};          // worker 开始处理会话和子进程退出时写入一个字节，唤醒主进程
+static volatile sig_atomic_t active_sessions = 0; // fork 模式下正在进行的会话数
+static volatile sig_atomic_t stop_server = 0;
+
 void sigchld_handler(int s)
 {
     // 等待所有子进程结束，避免僵尸进程
     while (waitpid(-1, NULL, WNOHANG) > 0)
-        ;
+        active_sessions--;
 }
 
-void create_server(int port, const char *root_dir)
+// prefork 模式：子进程由主进程的循环回收，信号处理函数只负责唤醒主进程
+void prefork_sigchld_handler(int s)
 {
-    // 创建服务器套接字和地址结构
-    int serverSocket;
-    struct sockaddr_in server_addr;
+    int saved_errno = errno;
+    if (write(notify_pipe[1], "c", 1) < 0)
+    {
+        // 管道已满时主进程必然会被唤醒，忽略即可
+    }
+    errno = saved_errno;
+}
 
-    // 创建客户端套接字和地址结构
-    int clientSocket;
-    struct sockaddr_in client_addr;
-    socklen_t addr_len = sizeof(client_addr);
+// SIGHUP：下一次登录前重新加载用户文件；prefork 主进程还要转发给所有 worker
+void reload_handler(int s)
+{
+    int saved_errno = errno;
+    users_request_reload();
+    if (notify_pipe[1] >= 0 && write(notify_pipe[1], "h", 1) < 0)
+    {
+    }
+    errno = saved_errno;
+}
 
-    // 初始化服务器地址结构
-    memset(&server_addr, 0, sizeof(server_addr));
-    server_addr.sin_family = AF_INET;
-    server_addr.sin_port = htons(port);
-    server_addr.sin_addr.s_addr = htonl(INADDR_ANY);
+void worker_reload_handler(int s)
+{
+    users_request_reload();
+}
 
-    // 创建服务器套接字
-    if ((serverSocket = socket(AF_INET, SOCK_STREAM, IPPROTO_TCP)) < 0)
+void stop_handler(int s)
+{
+    int saved_errno = errno;
+    stop_server = 1;
+    if (notify_pipe[1] >= 0 && write(notify_pipe[1], "s", 1) < 0)
     {
-        perror("socket");
-        return;
     }
+    errno = saved_errno;
+}
 
-    // 绑定服务器套接字
-    if (bind(serverSocket, (struct sockaddr *)&server_addr, sizeof(server_addr)) < 0)
+// 处理一个客户端会话，直到客户端 QUIT 或断开连接；返回前关闭 clientSocket
+// 依次处理缓冲区 buf 前 len 个字节中完整的命令行，把推迟处理的命令和剩下的半条命令移到缓冲区开头，返回剩下的字节数
+// 一次 recv 可能包含多条命令，也可能只有半条；同时接受 CRLF 和单独的 LF 结尾
+// 传输进行中只立即处理 ABOR 和 STAT（不论它们前面是否还有其他命令），其他命令（包括 QUIT）原样保留在缓冲区中，
+// 等传输结束后再按顺序处理；已经有推迟的命令时，后面的命令也一起推迟，保证它们的顺序不变
+static size_t process_commands(char *buf, size_t len, size_t size, int clientSocket, const char *root_dir,
+                               FtpState *state, int *discarding)
+{
+    char *line = buf;
+    char *end = buf + len;
+    char *keep = buf; // 推迟处理的命令行依次移到这里
+    char *newline;
+
+    while (!state->quit && (newline = memchr(line, '\n', end - line)) != NULL)
     {
-        perror("bind");
-        close(serverSocket);
-        return;
+        char *next = newline + 1;
+        if (*discarding)
+        {
+            *discarding = 0; // 过长命令行的剩余部分
+            line = next;
+            continue;
+        }
+
+        // 跳过 Telnet 的 IP/Synch 字节（有的客户端在 ABOR 之前发送 IAC IP IAC DM）
+        char *command = line;
+        while (command < newline && (unsigned char)*command >= 0x80)
+        {
+            command++;
+        }
+        if ((state->transfer.active || keep != buf) && command < newline && *command != '\r' &&
+            strncmp(command, "ABOR", 4) != 0 && strncmp(command, "STAT", 4) != 0)
+        {
+            // 连同换行符一起保留整行
+            if (keep != line)
+            {
+                memmove(keep, line, next - line);
+            }
+            keep += next - line;
+            line = next;
+            continue;
+        }
+
+        *newline = '\0';
+        if (newline > command && newline[-1] == '\r')
+        {
+            newline[-1] = '\0';
+        }
+        if (*command != '\0')
+        {
+            respond_to_client(command, clientSocket, (char *)root_dir, state); // 处理客户端请求
+        }
+        line = next;
     }
 
-    // 监听服务器套接字
-    if (listen(serverSocket, BACKLOG) < 0)
+    len = end - line;
+    if (keep == buf && len == size - 1 && memchr(line, '\n', len) == NULL)
     {
-        perror("listen");
-        close(serverSocket);
+        // 缓冲区已满仍然没有换行符，命令过长，丢弃到下一个换行符为止
+        if (!*discarding)
+        {
+            send(clientSocket, "500 Command line too long.\r\n", 28, 0);
+            printf("[DEBUG] Command line too long, discarded\n");
+        }
+        *discarding = 1;
+        return 0;
+    }
+    if (len > 0 && line != keep)
+    {
+        memmove(keep, line, len);
+    }
+    return (keep - buf) + len;
+}
+
+void handle_client(int clientSocket, const char *root_dir, const ServerConfig *config)
+{
+    // 客户端中途关闭数据连接时让 send/sendfile 返回 EPIPE 并回复 426，而不是被 SIGPIPE 终止进程
+    signal(SIGPIPE, SIG_IGN);
+
+    // 创建服务端状态结构体，并分配内存
+    FtpState *state = (FtpState *)malloc(sizeof(FtpState));
+    if (state == NULL)
+    {
+        perror("Failed to allocate memory for FtpState");
+        send(clientSocket, TOO_MANY_MSG, strlen(TOO_MANY_MSG), 0);
+        close(clientSocket);
         return;
     }
 
+    // 初始化 FtpState 的各个字段（worker 会复用进程处理多个会话，不能留下上一个会话的状态）
+    memset(state, 0, sizeof(FtpState));
+    state->state = STATE_WAITING_USER; // 状态设置为等待用户登录
+    state->port_ip[0] = '\0';          // PORT 命令指定的 IP 地址初始化为空
+    state->port_port = 0;              // PORT 命令指定的端口初始化为 0
+    state->pasv_socket = -1;           // 被动模式的监听套接字初始化为 -1
+    state->pasv_port = 0;              // 被动模式的监听端口初始化为 0
+    state->data_connection_active = 0; // 数据连接状态初始化为未激活
+    state->transfer.done_pipe[0] = -1; // 第一次传输时再创建通知管道
+    state->transfer.done_pipe[1] = -1;
+
+    // 文件系统相关字段初始化
+    strcpy(state->root_dir, root_dir); // 使用命令行传入的根目录
+    strcpy(state->current_dir, "/");   // 初始时将当前目录设为根目录 "/"
+
+    // 上传相关设置
+    state->rcvbuf = config->rcvbuf;
+    state->io_bufsize = config->io_bufsize;
+    state->use_splice = config->use_splice;
+
+    // MODE Z 默认关闭，由客户端用 MODE Z 打开
+    state->mode_z = 0;
+    state->z_level = config->z_level;
+
+    // HASH 默认使用 SHA-256，没有 RANG 范围
+    state->hash_algorithm = HASH_SHA256;
+    state->rang_start = 0;
+    state->rang_end = -1;
+
+    // 调试信息输出
+    printf("[DEBUG] Initialized FtpState for new connection. Root directory: %s, Current directory: %s\n",
+           state->root_dir, state->current_dir);
+
+    char input_msg[MAXSIZE]; // 控制连接的行缓冲区，保存还没有收到 CRLF 的半条命令和推迟处理的命令
+    size_t buffered = 0;
+    int discarding = 0; // 当前命令行超过缓冲区长度，丢弃到下一个换行符为止
+    ssize_t bytes_received;
+
+    // 关闭 Nagle 算法：客户端连续发送多条命令时，每条回复都立即发出，不等待上一条回复的 ACK
+    int nodelay = 1;
+    setsockopt(clientSocket, IPPROTO_TCP, TCP_NODELAY, &nodelay, sizeof(nodelay));
+
+    // 向客户端发送欢迎消息
+    send(clientSocket, WELCOME_MSG, strlen(WELCOME_MSG), 0);
+
+    // 轮询接收客户端命令，直到客户端断开或发送 QUIT
+    // RETR/STOR 的数据在后台线程中收发，传输期间同时等待控制连接（ABOR、STAT）和传输结束的通知
+    while (!state->quit)
+    {
+        // 缓冲区中还有因为传输而推迟的命令：传输已经结束就立即处理，否则继续读取控制连接（ABOR、STAT）并等待传输结束
+        int deferred = memchr(input_msg, '\n', buffered) != NULL;
+        if (deferred && !state->transfer.active)
+        {
+            buffered = process_commands(input_msg, buffered, sizeof(input_msg), clientSocket, root_dir, state, &discarding);
+            continue;
+        }
+
+        struct pollfd fds[2];
+        int nfds = 0;
+        int control = -1;
+        int done = -1;
+        // 推迟的命令占满缓冲区时暂停读取，等传输结束后处理掉它们再继续
+        if (buffered < sizeof(input_msg) - 1)
+        {
+            fds[nfds].fd = clientSocket;
+            fds[nfds].events = POLLIN;
+            control = nfds++;
+        }
+        if (state->transfer.active)
+        {
+            fds[nfds].fd = state->transfer.done_pipe[0];
+            fds[nfds].events = POLLIN;
+            done = nfds++;
+        }
+        if (poll(fds, nfds, -1) < 0)
+        {
+            if (errno == EINTR)
+            {
+                continue;
+            }
+            perror("poll");
+            break;
+        }
+        if (done >= 0 && (fds[done].revents & POLLIN))
+        {
+            finish_transfer(clientSocket, state); // 回复 226/426/552
+        }
+        if (control < 0 || fds[control].revents == 0)
+        {
+            continue;
+        }
+
+        bytes_received = recv(clientSocket, input_msg + buffered, sizeof(input_msg) - 1 - buffered, 0);
+        if (bytes_received < 0 && errno == EINTR)
+        {
+            continue;
+        }
+        if (bytes_received <= 0)
+        {
+            break;
+        }
+        buffered = process_commands(input_msg, buffered + bytes_received, sizeof(input_msg), clientSocket, root_dir, state, &discarding);
+    }
+
+    // 客户端断开时中止仍在进行的传输并回收线程
+    if (state->transfer.active)
+    {
+        abort_transfer(state);
+        finish_transfer(clientSocket, state);
+    }
+    if (state->transfer.done_pipe[0] >= 0)
+    {
+        close(state->transfer.done_pipe[0]);
+        close(state->transfer.done_pipe[1]);
+    }
+
+    // 处理完毕，关闭会话中仍然打开的套接字
+    if (state->pasv_socket > 0)
+    {
+        close(state->pasv_socket);
+    }
+    close(clientSocket);
+    free(state);
+    fflush(stdout);
+}
+
+// fork 模式：每个连接 fork 一个子进程
+void run_fork_server(int serverSocket, const char *root_dir, const ServerConfig *config)
+{
+    int clientSocket;
+    struct sockaddr_in client_addr;
+    socklen_t addr_len;
+
     // 处理 SIGCHLD 信号，清理子进程
     struct sigaction sa;
     sa.sa_handler = sigchld_handler; // 注册处理函数
     sigemptyset(&sa.sa_mask);
     sa.sa_flags = SA_RESTART | SA_NOCLDSTOP; // 重新启动被信号中断的系统调用
     sigaction(SIGCHLD, &sa, NULL);
-
-    // 输出服务器的启动信息
-    printf("Server started on port %d\n", port);
-    printf("Serving files from root directory: %s\n", root_dir);
+    sa.sa_handler = reload_handler;
+    sigaction(SIGHUP, &sa, NULL);
 
     // 循环等待链接
     while (1)
     {
         // 接受客户端链接
+        addr_len = sizeof(client_addr);
         if ((clientSocket = accept(serverSocket, (struct sockaddr *)&client_addr, &addr_len)) < 0)
         {
             perror("accept");
             continue;
         }
 
-        // 创建子进程
+        // 会话数已达上限，拒绝这个连接
+        if (active_sessions >= config->max_sessions)
+        {
+            printf("[DEBUG] Session limit (%d) reached, rejecting connection.\n", config->max_sessions);
+            send(clientSocket, TOO_MANY_MSG, strlen(TOO_MANY_MSG), 0);
+            close(clientSocket);
+            continue;
+        }
+
+        // 子进程继承主进程的用户表，fork 之前先确认它是最新的
+        users_refresh();
+
+        // 创建子进程（先刷新输出缓冲区，避免子进程重复输出）
+        fflush(stdout);
         int pid = fork();
         if (pid < 0)
         {
@@ -115,56 +375,236 @@ void create_server(int port, const char *root_dir)
         {
             // 关闭父进程的 serverSocket
             close(serverSocket);
+            handle_client(clientSocket, root_dir, config);
+            exit(0); // 子进程结束
+        }
+
+        // 父进程，关闭 client 套接字
+        active_sessions++;
+        close(clientSocket);
+    }
+}
+
+// prefork 模式下 worker 的主循环：反复 accept 并处理会话
+void worker_loop(int serverSocket, const char *root_dir, const ServerConfig *config)
+{
+    int clientSocket;
+
+    // worker 不创建子进程，也不处理主进程的退出信号
+    signal(SIGCHLD, SIG_DFL);
+    signal(SIGTERM, SIG_DFL);
+    signal(SIGINT, SIG_DFL);
+    close(notify_pipe[0]);
 
-            // 创建服务端状态结构体，并分配内存
-            FtpState *state = (FtpState *)malloc(sizeof(FtpState));
-            if (state == NULL)
+    // 主进程转发的 SIGHUP 只设置重新加载的标志，不需要唤醒主进程
+    struct sigaction sa;
+    sa.sa_handler = worker_reload_handler;
+    sigemptyset(&sa.sa_mask);
+    sa.sa_flags = SA_RESTART;
+    sigaction(SIGHUP, &sa, NULL);
+
+    while (1)
+    {
+        // 多个 worker 阻塞在同一个监听套接字上，内核每次只唤醒其中一个
+        if ((clientSocket = accept(serverSocket, NULL, NULL)) < 0)
+        {
+            if (errno != EINTR)
             {
-                perror("Failed to allocate memory for FtpState");
-                exit(1); // 内存分配失败，退出子进程
+                perror("accept");
             }
+            continue;
+        }
 
-            // 初始化 FtpState 的各个字段
-            state->state = STATE_WAITING_USER; // 状态设置为等待用户登录
-            strcpy(state->username, "");       // 初始化用户名为空字符串
-            strcpy(state->password, "");       // 初始化密码为空字符串
-            state->port_ip[0] = '\0';          // PORT 命令指定的 IP 地址初始化为空
-            state->port_port = 0;              // PORT 命令指定的端口初始化为 0
-            state->pasv_socket = -1;           // 被动模式的监听套接字初始化为 -1
-            state->pasv_port = 0;              // 被动模式的监听端口初始化为 0
-            state->data_connection_active = 0; // 数据连接状态初始化为未激活
+        // 通知主进程空闲 worker 少了一个，必要时追加创建
+        __sync_fetch_and_sub(&board->idle, 1);
+        if (write(notify_pipe[1], "b", 1) < 0)
+        {
+        }
 
-            // 文件系统相关字段初始化
-            strcpy(state->root_dir, root_dir); // 使用命令行传入的根目录
-            strcpy(state->current_dir, "/");   // 初始时将当前目录设为根目录 "/"
+        handle_client(clientSocket, root_dir, config);
 
-            // 调试信息输出
-            printf("[DEBUG] Initialized FtpState for new connection. Root directory: %s, Current directory: %s\n",
-                   state->root_dir, state->current_dir);
+        // 高峰过后，超出常驻数量的 worker 在空闲过多时退出
+        if (__sync_add_and_fetch(&board->idle, 1) > MAX_SPARE_WORKERS && board->total > config->workers)
+        {
+            __sync_fetch_and_sub(&board->idle, 1);
+            exit(0);
+        }
+    }
+}
 
-            char input_msg[MAXSIZE];
-            int bytes_received;
+// prefork 模式：主进程只负责维持 worker 的数量，不处理连接
+void run_prefork_server(int serverSocket, const char *root_dir, const ServerConfig *config)
+{
+    pid_t *pids = (pid_t *)calloc(config->max_sessions, sizeof(pid_t));
+    board = (Scoreboard *)mmap(NULL, sizeof(Scoreboard), PROT_READ | PROT_WRITE, MAP_SHARED | MAP_ANONYMOUS, -1, 0);
+    if (pids == NULL || board == MAP_FAILED || pipe(notify_pipe) < 0)
+    {
+        perror("prefork setup");
+        return;
+    }
+    board->idle = 0;
+    board->total = 0;
+    // 写端非阻塞：管道满时 worker 不会被卡住
+    fcntl(notify_pipe[1], F_SETFL, O_NONBLOCK);
 
-            // 向客户端发送欢迎消息
-            send(clientSocket, WELCOME_MSG, strlen(WELCOME_MSG), 0);
+    struct sigaction sa;
+    sa.sa_handler = prefork_sigchld_handler;
+    sigemptyset(&sa.sa_mask);
+    sa.sa_flags = SA_RESTART | SA_NOCLDSTOP;
+    sigaction(SIGCHLD, &sa, NULL);
+    sa.sa_handler = stop_handler;
+    sa.sa_flags = 0;
+    sigaction(SIGTERM, &sa, NULL);
+    sigaction(SIGINT, &sa, NULL);
+    sa.sa_handler = reload_handler;
+    sa.sa_flags = SA_RESTART;
+    sigaction(SIGHUP, &sa, NULL);
+
+    while (!stop_server)
+    {
+        // 收到 SIGHUP 或用户文件有变化时重新加载，之后创建的 worker 直接继承新的用户表
+        users_refresh();
 
-            // 轮询接收客户端命令
-            while ((bytes_received = recv(clientSocket, input_msg, sizeof(input_msg) - 1, 0)) > 0)
+        // 回收退出的 worker
+        pid_t pid;
+        while ((pid = waitpid(-1, NULL, WNOHANG)) > 0)
+        {
+            for (int i = 0; i < config->max_sessions; i++)
             {
-                input_msg[bytes_received] = '\0';                            // 添加终止符
-                respond_to_client(input_msg, clientSocket, root_dir, state); // 处理客户端请求
+                if (pids[i] == pid)
+                {
+                    pids[i] = 0;
+                    board->total--;
+                    break;
+                }
             }
+        }
 
-            // 处理完毕，关闭客户端套接字
-            close(clientSocket);
-            exit(0); // 子进程结束
+        // 保持至少 workers 个 worker；空闲的不足时追加，总数不超过 max_sessions
+        while (board->total < config->workers ||
+               (board->idle < MIN_SPARE_WORKERS && board->total < config->max_sessions))
+        {
+            int slot = 0;
+            while (slot < config->max_sessions && pids[slot] != 0)
+                slot++;
+            if (slot == config->max_sessions)
+                break;
+
+            // 先计入空闲数，worker 开始 accept 之前主进程就能看到它
+            __sync_fetch_and_add(&board->idle, 1);
+            fflush(stdout);
+            pid = fork();
+            if (pid < 0)
+            {
+                perror("fork");
+                __sync_fetch_and_sub(&board->idle, 1);
+                sleep(1);
+                break;
+            }
+            if (pid == 0)
+            {
+                free(pids);
+                worker_loop(serverSocket, root_dir, config);
+                exit(0);
+            }
+            pids[slot] = pid;
+            board->total++;
         }
-        else
+        if (board->idle == 0 && board->total >= config->max_sessions)
         {
-            // 父进程，关闭 client 套接字
-            close(clientSocket);
+            printf("[DEBUG] All %d workers busy, new connections wait in the listen queue.\n", board->total);
+            fflush(stdout);
+        }
+
+        // 等待 worker 开始处理会话或退出
+        char buf[64];
+        ssize_t n = read(notify_pipe[0], buf, sizeof(buf));
+        if (n < 0 && errno != EINTR)
+        {
+            perror("read");
+        }
+        if (n > 0 && memchr(buf, 'h', n) != NULL)
+        {
+            // 把 SIGHUP 转发给所有 worker
+            for (int i = 0; i < config->max_sessions; i++)
+            {
+                if (pids[i] != 0)
+                {
+                    kill(pids[i], SIGHUP);
+                }
+            }
+        }
+    }
+
+    // 收到 SIGTERM/SIGINT：结束所有 worker
+    printf("Shutting down %d workers\n", board->total);
+    for (int i = 0; i < config->max_sessions; i++)
+    {
+        if (pids[i] != 0)
+        {
+            kill(pids[i], SIGTERM);
         }
     }
+    while (wait(NULL) > 0)
+        ;
+    free(pids);
+}
+
+void create_server(int port, const char *root_dir, const ServerConfig *config)
+{
+    // 创建服务器套接字和地址结构
+    int serverSocket;
+    struct sockaddr_in server_addr;
+
+    // 初始化服务器地址结构
+    memset(&server_addr, 0, sizeof(server_addr));
+    server_addr.sin_family = AF_INET;
+    server_addr.sin_port = htons(port);
+    server_addr.sin_addr.s_addr = htonl(INADDR_ANY);
+
+    // 创建服务器套接字
+    if ((serverSocket = socket(AF_INET, SOCK_STREAM, IPPROTO_TCP)) < 0)
+    {
+        perror("socket");
+        return;
+    }
+
+    // 允许重启后立即重新绑定仍有 TIME_WAIT 连接的端口
+    int reuse = 1;
+    setsockopt(serverSocket, SOL_SOCKET, SO_REUSEADDR, &reuse, sizeof(reuse));
+
+    // 绑定服务器套接字
+    if (bind(serverSocket, (struct sockaddr *)&server_addr, sizeof(server_addr)) < 0)
+    {
+        perror("bind");
+        close(serverSocket);
+        return;
+    }
+
+    // 监听服务器套接字
+    if (listen(serverSocket, config->backlog) < 0)
+    {
+        perror("listen");
+        close(serverSocket);
+        return;
+    }
+
+    // 输出服务器的启动信息
+    printf("Server started on port %d\n", port);
+    printf("Serving files from root directory: %s\n", root_dir);
+    printf("Mode: %s, backlog: %d, workers: %d, max sessions: %d, recvbuf: %d, iobuf: %zu, zlevel: %d%s\n",
+           config->mode == MODE_FORK ? "fork" : "prefork", config->backlog, config->workers, config->max_sessions,
+           config->rcvbuf, config->io_bufsize, config->z_level, config->use_splice ? ", splice" : "");
+    fflush(stdout);
+
+    if (config->mode == MODE_FORK)
+    {
+        run_fork_server(serverSocket, root_dir, config);
+    }
+    else
+    {
+        run_prefork_server(serverSocket, root_dir, config);
+    }
 
     // 关闭服务器套接字
     close(serverSocket);
@@ -174,6 +614,10 @@ int main(int argc, char *argv[])
 {
     int port = 21;               // 默认端口号
     char root_dir[256] = "/tmp"; // 默认根目录
+    const char *userdb = NULL;     // 用户文件，NULL 表示使用 USER_DB_FILE
+    const char *hashdb = NULL;     // 校验和缓存文件，NULL 表示使用 HASH_DB_FILE
+    ServerConfig config = {MODE_PREFORK, BACKLOG, DEFAULT_WORKERS, DEFAULT_MAX_SESSIONS, 0, TRANSFER_BUFSIZE, 0,
+                           ZLIB_DEFAULT_LEVEL};
 
     // 如果传入了命令行参数
     if (argc > 1)
@@ -192,6 +636,60 @@ int main(int argc, char *argv[])
                 strncpy(root_dir, argv[i + 1], sizeof(root_dir) - 1);
                 root_dir[sizeof(root_dir) - 1] = '\0'; // 确保字符串以 null 结尾
             }
+
+            // 解析 -mode prefork|fork
+            if (strcmp(argv[i], "-mode") == 0 && i + 1 < argc)
+            {
+                config.mode = strcmp(argv[i + 1], "fork") == 0 ? MODE_FORK : MODE_PREFORK;
+            }
+
+            // 解析 -backlog、-workers、-max-sessions 参数
+            if (strcmp(argv[i], "-backlog") == 0 && i + 1 < argc)
+            {
+                config.backlog = atoi(argv[i + 1]);
+            }
+            if (strcmp(argv[i], "-workers") == 0 && i + 1 < argc)
+            {
+                config.workers = atoi(argv[i + 1]);
+            }
+            if (strcmp(argv[i], "-max-sessions") == 0 && i + 1 < argc)
+            {
+                config.max_sessions = atoi(argv[i + 1]);
+            }
+
+            // 解析 -recvbuf（数据连接的 SO_RCVBUF）和 -iobuf（STOR 接收缓冲区）参数，单位为字节
+            if (strcmp(argv[i], "-recvbuf") == 0 && i + 1 < argc)
+            {
+                config.rcvbuf = atoi(argv[i + 1]);
+            }
+            if (strcmp(argv[i], "-iobuf") == 0 && i + 1 < argc)
+            {
+                config.io_bufsize = (size_t)atol(argv[i + 1]);
+            }
+
+            // 解析 -userdb 参数：用户文件的路径，默认为 USER_DB_FILE
+            if (strcmp(argv[i], "-userdb") == 0 && i + 1 < argc)
+            {
+                userdb = argv[i + 1];
+            }
+
+            // 解析 -hashdb 参数：校验和缓存文件的路径，默认为 HASH_DB_FILE
+            if (strcmp(argv[i], "-hashdb") == 0 && i + 1 < argc)
+            {
+                hashdb = argv[i + 1];
+            }
+
+            // 解析 -zlevel 参数：MODE Z 的默认压缩级别（0-9）
+            if (strcmp(argv[i], "-zlevel") == 0 && i + 1 < argc)
+            {
+                config.z_level = atoi(argv[i + 1]);
+            }
+
+            // 解析 -splice 参数：STOR 用 splice(2) 接收
+            if (strcmp(argv[i], "-splice") == 0)
+            {
+                config.use_splice = 1;
+            }
         }
     }
 
@@ -202,12 +700,37 @@ int main(int argc, char *argv[])
         return 1;
     }
 
+    // 检查并发参数是否合法
+    if (config.backlog <= 0 || config.workers <= 0 || config.max_sessions <= 0)
+    {
+        fprintf(stderr, "Invalid -backlog, -workers or -max-sessions value\n");
+        return 1;
+    }
+    if (config.rcvbuf < 0 || config.io_bufsize < 4096)
+    {
+        fprintf(stderr, "Invalid -recvbuf or -iobuf value\n");
+        return 1;
+    }
+    if (config.z_level < 0 || config.z_level > 9)
+    {
+        fprintf(stderr, "Invalid -zlevel value: %d\n", config.z_level);
+        return 1;
+    }
+    if (config.workers > config.max_sessions)
+    {
+        config.workers = config.max_sessions;
+    }
+
     // 输出调试信息
     printf("Starting server on port: %d\n", port);
     printf("Serving files from root directory: %s\n", root_dir);
 
-    // 调用 create_server 函数，并将解析得到的端口号和根目录传递进去
-    create_server(port, root_dir);
+    // 启动时把用户文件加载到内存中，worker/子进程 fork 后直接共享
+    users_init(userdb);
+    checksums_init(hashdb);
+
+    // 调用 create_server 函数，并将解析得到的端口号、根目录和并发配置传递进去
+    create_server(port, root_dir, &config);
 
     return 0;
 }
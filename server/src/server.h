@@ -10,12 +10,67 @@
 #include <unistd.h>
 // 加锁的头文件
 #include <sys/file.h> // flock 头文件
+#include <sys/stat.h>
+#include <pthread.h>
+#include <stdatomic.h>
+#include <time.h>
+#include <zlib.h>
 #define MAXSIZE 1024
 // 定义宏 表示当前服务器的状态
 #define STATE_WAITING_USER 0
 #define STATE_WAITING_PASS 1
 #define STATE_CLIENT_LOGIN 2
 #define USER_DB_FILE "/mnt/d/USER_PASS.txt"
+// 校验和缓存文件（HASH、XCRC 等命令的结果），可以用 -hashdb 指定
+#define HASH_DB_FILE "/mnt/d/FTP_HASHES.txt"
+// HASH 支持的算法，也是 OPTS HASH 和 FEAT 中的顺序
+#define HASH_SHA256 0
+#define HASH_SHA1 1
+#define HASH_MD5 2
+#define HASH_CRC32 3
+#define HASH_ALGORITHMS 4
+#define HASH_HEX_SIZE 65 // 最长的十六进制校验和（SHA-256）加结尾的 '\0'
+// 数据连接写缓冲区的大小，目录列表等小块输出先写入缓冲区再一次发送
+#define WRITER_BUFSIZE 65536
+// RETR 每次 sendfile 的最大字节数，以及不能使用 sendfile 时读写循环的缓冲区大小
+#define SENDFILE_CHUNK (1 << 20)
+#define TRANSFER_BUFSIZE (256 * 1024)
+// recv_file_data 的错误返回值
+#define TRANSFER_NET_ERROR -1
+#define TRANSFER_DISK_ERROR -2
+#define TRANSFER_ABORTED -3 // 被 ABOR 或 QUIT 中止
+// MODE Z（deflate 压缩的数据连接）的默认压缩级别
+// 发送时每压缩 ZLIB_WINDOW 字节检查一次压缩率，压缩后仍超过原大小的 ZLIB_MIN_RATIO 时认为内容已经压缩过，
+// 改用级别 0（只加分块头，不再消耗 CPU），之后每 ZLIB_REPROBE 个窗口重新尝试一次
+#define ZLIB_DEFAULT_LEVEL 6
+#define ZLIB_WINDOW (1 << 20)
+#define ZLIB_MIN_RATIO 0.9
+#define ZLIB_REPROBE 64
+
+// 后台传输：RETR/STOR 的数据在单独的线程中收发，控制连接在传输期间仍然可以处理 ABOR 和 STAT
+typedef struct
+{
+    int active;            // 1 表示有传输正在进行（或已经结束但还没有回复 226）
+    int threaded;          // 1 表示在线程中运行，结束时需要 pthread_join
+    pthread_t thread;
+    int is_upload;         // 1 为 STOR，0 为 RETR
+    int data_socket;       // 数据连接
+    int file_fd;           // 读取或写入的文件
+    FILE *file;            // STOR 用 fopen 打开的文件，结束时解锁并关闭；RETR 为 NULL
+    off_t offset;          // 起始偏移量（REST）
+    long long size;        // RETR 时为文件大小，STOR 时为 -1
+    size_t bufsize;        // STOR 的接收缓冲区大小
+    int use_splice;        // STOR 是否使用 splice(2)
+    int mode_z;            // 1 表示数据经 deflate 压缩（MODE Z）
+    int z_level;           // MODE Z 的压缩级别
+    char name[MAXSIZE];    // 文件名，用于 STAT 和调试信息
+    struct timespec start; // 开始时间（CLOCK_MONOTONIC）
+    atomic_llong bytes;    // 已传输的字节数（MODE Z 时为压缩前的字节数），由传输线程更新
+    atomic_llong wire_bytes; // MODE Z 时数据连接上实际收发的（压缩后的）字节数
+    atomic_int aborted;    // ABOR/QUIT 请求中止
+    long long result;      // send_file_data/recv_file_data 的返回值
+    int done_pipe[2];      // 传输线程结束时向 done_pipe[1] 写入一个字节，唤醒会话循环
+} Transfer;
 // 定义一个结构体，用于保存当前服务器的状态
 typedef struct
 {
@@ -37,21 +92,129 @@ typedef struct
     int is_transferring; // 标志：是否正在进行文件传输
     // 记录文件传输的偏移量 支持断点重传
     long long int transfer_offset;
+
+    int quit; // 客户端已发送 QUIT，会话循环在处理完当前命令后结束
+
+    // 上传相关设置
+    long long alloc_size; // ALLO 命令给出的文件大小，下一次 STOR 时预先分配磁盘空间，0 表示没有
+    int rcvbuf;           // 数据连接的 SO_RCVBUF，0 表示使用内核的自动调整
+    size_t io_bufsize;    // STOR 每次 splice/recv 的字节数
+    int use_splice;       // STOR 是否使用 splice(2)
+
+    int mode_z;  // MODE Z：数据连接上的内容经 deflate 压缩
+    int z_level; // MODE Z 的压缩级别（OPTS MODE Z LEVEL n）
+
+    int hash_algorithm;   // HASH 命令使用的算法（OPTS HASH），HASH_*
+    long long rang_start; // RANG 设置的范围（包含两端），只对下一次 HASH 有效；rang_end 为 -1 表示没有设置
+    long long rang_end;
+
+    Transfer transfer; // 正在进行的 RETR/STOR
 } FtpState;
 
+// 服务器的并发模型（-mode）
+#define MODE_PREFORK 0
+#define MODE_FORK 1
+
+// 服务器的并发和传输配置，由命令行参数设置
+typedef struct
+{
+    int mode;          // MODE_PREFORK 或 MODE_FORK
+    int backlog;       // listen() 的监听队列长度
+    int workers;       // prefork 模式下常驻的 worker 数
+    int max_sessions;  // 同时进行的会话数上限
+    int rcvbuf;        // 数据连接的 SO_RCVBUF（-recvbuf），0 表示不设置
+    size_t io_bufsize; // STOR 的接收缓冲区大小（-iobuf）
+    int use_splice;    // STOR 使用 splice(2) 而不是 recv/pwrite（-splice）
+    int z_level;       // MODE Z 的默认压缩级别（-zlevel）
+} ServerConfig;
+
+// 带缓冲的数据连接写入器
+typedef struct
+{
+    int fd;                     // 数据连接套接字
+    size_t len;                 // 缓冲区中尚未发送的字节数
+    int error;                  // 发送失败后置 1，之后的写入直接忽略
+    z_stream *zs;               // MODE Z 时先压缩再发送，NULL 表示直接发送
+    char *zbuf;                 // 压缩输出的缓冲区
+    char buf[WRITER_BUFSIZE];
+} DataWriter;
+
+void writer_init(DataWriter *writer, int fd);
+
+int writer_write(DataWriter *writer, const char *data, size_t len);
+
+int writer_flush(DataWriter *writer);
+
+int writer_deflate(DataWriter *writer, int level);
+
+int writer_finish(DataWriter *writer);
+
+int write_directory_listing(DataWriter *writer, const char *path);
+
+int format_mlsx_entry(char *out, size_t size, int dir_fd, const char *name, const char *display,
+                      const struct stat *st);
+
+int write_mlsd_listing(DataWriter *writer, const char *path);
+
+long long send_file_data(int dataSocket, int fd, off_t offset, atomic_llong *progress);
+
+long long recv_file_data(int dataSocket, int fd, off_t offset, size_t bufsize, int use_splice, atomic_llong *progress);
+
+int is_compressed_name(const char *name);
+
+int deflate_send(z_stream *zs, int sock, int flush, char *out, size_t outsize, atomic_llong *wire);
+
+long long send_file_deflate(int dataSocket, int fd, off_t offset, int level, int compressed, atomic_llong *progress,
+                            atomic_llong *wire);
+
+long long recv_file_inflate(int dataSocket, int fd, off_t offset, size_t bufsize, atomic_llong *progress,
+                            atomic_llong *wire);
+
+void start_transfer(int clientSocket, FtpState *state, int dataSocket, int fd, FILE *file, off_t offset, const char *name);
+
+void finish_transfer(int clientSocket, FtpState *state);
+
+void abort_transfer(FtpState *state);
+
+double transfer_elapsed(const Transfer *transfer);
+
+void set_data_rcvbuf(int sock, FtpState *state);
+
+int preallocate_file(int fd, FtpState *state);
+
+int hash_algorithm(const char *name);
+
+const char *hash_algorithm_name(int algorithm);
+
+void checksums_init(const char *path);
+
+int file_checksum(const char *path, int algorithm, long long start, long long end, long long *end_out, char *hex);
+
+void users_init(const char *path);
+
+size_t users_refresh(void);
+
+void users_request_reload(void);
+
+int check_user_credentials(const char *username, const char *password);
+
+int save_new_user(const char *username, const char *password);
+
 void respond_to_client(char *input_msg, int clientSocket, char *root_dir, FtpState *current_state);
 
 void ftp_quit(int clientSocket, FtpState *state);
 
 void ftp_abor(int clientSocket, FtpState *state);
 
+void ftp_stat(int clientSocket, FtpState *state);
+
 void ftp_port(int clientSocket, FtpState *state, char *arg);
 
 void ftp_pasv(int clientSocket, FtpState *state);
 
 void ftp_retr(int clientSocket, FtpState *state, const char *filename);
 
-void ftp_stor(int clientSocket, FtpState *state, char *filename);
+void ftp_stor(int clientSocket, FtpState *state, char *filename, int segment);
 
 void ftp_mkd(int clientSocket, FtpState *state, char *dirname);
 
@@ -62,11 +225,28 @@ void ftp_pwd(int clientSocket, FtpState *state);
 void ftp_list(int clientSocket, FtpState *state, const char *parameter);
 
 void ftp_rmd(int clientSocket, FtpState *state, const char *dirname);
+void ftp_dele(int clientSocket, FtpState *state, const char *filename);
 
 void ftp_rest(int clientSocket, FtpState *state, const char *offset);
 
 void ftp_size(int clientSocket, FtpState *state, const char *filename);
 
+void ftp_mlsd(int clientSocket, FtpState *state, const char *parameter);
+
+void ftp_mlst(int clientSocket, FtpState *state, const char *parameter);
+
+void ftp_feat(int clientSocket, FtpState *state);
+
+void ftp_mode(int clientSocket, FtpState *state, const char *mode);
+
+void ftp_opts(int clientSocket, FtpState *state, const char *input_msg);
+
+void ftp_rang(int clientSocket, FtpState *state, const char *input_msg);
+
+void ftp_hash(int clientSocket, FtpState *state, const char *filename);
+
+void ftp_xhash(int clientSocket, FtpState *state, int algorithm, const char *input_msg);
+
 void ftp_retr_resume(int clientSocket, FtpState *state, char *filename);
 
 void ftp_stor_resume(int clientSocket, FtpState *state, char *filename);
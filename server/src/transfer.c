@@ -0,0 +1,423 @@
+#define _GNU_SOURCE // splice、F_SETPIPE_SZ、fallocate
+#include "server.h"
+#include <errno.h>
+#include <fcntl.h>
+#include <sys/sendfile.h>
+
+// 把 fd 从 offset 开始直到文件末尾的内容发送到数据连接，返回发送的字节数，出错时返回 -1
+// 每发送一块就把已发送的字节数写入 progress，供控制连接的 STAT 读取
+// 普通文件用 sendfile(2) 由内核直接从页缓存发送到套接字，不经过用户态缓冲区；
+// 其它文件（管道、字符设备等）或内核不支持 sendfile 时退回到大缓冲区的 read/send 循环
+long long send_file_data(int dataSocket, int fd, off_t offset, atomic_llong *progress)
+{
+    struct stat st;
+    long long total = 0;
+
+    if (fstat(fd, &st) == 0 && S_ISREG(st.st_mode))
+    {
+        while (1)
+        {
+            // 读到文件末尾时返回 0；传输过程中文件变长，后追加的内容也会被发送
+            ssize_t sent = sendfile(dataSocket, fd, &offset, SENDFILE_CHUNK);
+            if (sent > 0)
+            {
+                total += sent;
+                atomic_store(progress, total);
+                continue;
+            }
+            if (sent == 0)
+            {
+                return total;
+            }
+            if (errno == EINTR)
+            {
+                continue;
+            }
+            // 一个字节都没发送时才能安全地换用缓冲区方式
+            if (total == 0 && (errno == EINVAL || errno == ENOSYS))
+            {
+                break;
+            }
+            return -1;
+        }
+    }
+
+    if (offset > 0 && lseek(fd, offset, SEEK_SET) < 0)
+    {
+        return -1;
+    }
+
+    char *buffer = (char *)malloc(TRANSFER_BUFSIZE);
+    if (buffer == NULL)
+    {
+        return -1;
+    }
+    ssize_t bytes_read;
+    while ((bytes_read = read(fd, buffer, TRANSFER_BUFSIZE)) != 0)
+    {
+        if (bytes_read < 0)
+        {
+            if (errno == EINTR)
+            {
+                continue;
+            }
+            total = -1;
+            break;
+        }
+        ssize_t total_sent = 0;
+        while (total_sent < bytes_read)
+        {
+            ssize_t sent = send(dataSocket, buffer + total_sent, bytes_read - total_sent, MSG_NOSIGNAL);
+            if (sent < 0)
+            {
+                if (errno == EINTR)
+                {
+                    continue;
+                }
+                free(buffer);
+                return -1;
+            }
+            total_sent += sent;
+        }
+        total += bytes_read;
+        atomic_store(progress, total);
+    }
+    free(buffer);
+    return total;
+}
+
+// 把 pipe 中剩余的 count 字节读出并写入文件（splice 写文件失败时使用），返回 0 或 TRANSFER_DISK_ERROR
+static int drain_pipe(int pipe_fd, int fd, off_t *offset, size_t count, char *buffer, size_t bufsize)
+{
+    while (count > 0)
+    {
+        ssize_t n = read(pipe_fd, buffer, count < bufsize ? count : bufsize);
+        if (n <= 0)
+        {
+            return TRANSFER_DISK_ERROR;
+        }
+        if (pwrite(fd, buffer, n, *offset) != n)
+        {
+            return TRANSFER_DISK_ERROR;
+        }
+        *offset += n;
+        count -= n;
+    }
+    return 0;
+}
+
+// 从数据连接接收数据直到对端关闭，从 offset 处写入 fd，返回接收的字节数，接收过程中更新 progress
+// 出错时返回 TRANSFER_NET_ERROR（接收失败）或 TRANSFER_DISK_ERROR（写入失败，例如磁盘已满）
+// 默认使用 bufsize 字节的 recv/pwrite 循环；use_splice 为 1 时在 Linux 上改用 splice(2) 经 pipe
+// 把数据从套接字移到文件，不复制到用户态，文件系统或套接字不支持 splice 时自动退回到循环方式
+long long recv_file_data(int dataSocket, int fd, off_t offset, size_t bufsize, int use_splice, atomic_llong *progress)
+{
+    long long total = 0;
+    char *buffer = (char *)malloc(bufsize);
+    if (buffer == NULL)
+    {
+        return TRANSFER_DISK_ERROR;
+    }
+
+#ifdef SPLICE_F_MOVE
+    int pipefd[2];
+    if (use_splice && pipe(pipefd) == 0)
+    {
+        int result = 0;
+        int fallback = 0;
+        // pipe 默认只有 64 KiB，放大到与缓冲区相同，减少 splice 的次数
+        fcntl(pipefd[1], F_SETPIPE_SZ, (int)bufsize);
+        while (result == 0 && !fallback)
+        {
+            ssize_t n = splice(dataSocket, NULL, pipefd[1], NULL, bufsize, SPLICE_F_MOVE | SPLICE_F_MORE);
+            if (n == 0)
+            {
+                break;
+            }
+            if (n < 0)
+            {
+                if (errno == EINTR)
+                {
+                    continue;
+                }
+                if (total == 0 && errno == EINVAL)
+                {
+                    fallback = 1; // 套接字不支持 splice
+                    break;
+                }
+                result = TRANSFER_NET_ERROR;
+                break;
+            }
+            while (n > 0)
+            {
+                ssize_t written = splice(pipefd[0], NULL, fd, &offset, n, SPLICE_F_MOVE);
+                if (written < 0 && errno == EINTR)
+                {
+                    continue;
+                }
+                if (written < 0 && errno == EINVAL)
+                {
+                    // 文件系统不支持 splice 写入：把 pipe 中的数据手动写完，之后改用缓冲区方式
+                    result = drain_pipe(pipefd[0], fd, &offset, n, buffer, bufsize);
+                    total += n;
+                    fallback = 1;
+                    break;
+                }
+                if (written <= 0)
+                {
+                    result = TRANSFER_DISK_ERROR;
+                    break;
+                }
+                n -= written;
+                total += written;
+                atomic_store(progress, total);
+            }
+        }
+        close(pipefd[0]);
+        close(pipefd[1]);
+        if (!fallback)
+        {
+            free(buffer);
+            return result < 0 ? result : total;
+        }
+        if (result < 0)
+        {
+            free(buffer);
+            return result;
+        }
+    }
+#endif
+
+    while (1)
+    {
+        ssize_t n = recv(dataSocket, buffer, bufsize, 0);
+        if (n == 0)
+        {
+            break;
+        }
+        if (n < 0)
+        {
+            if (errno == EINTR)
+            {
+                continue;
+            }
+            total = TRANSFER_NET_ERROR;
+            break;
+        }
+        if (pwrite(fd, buffer, n, offset) != n)
+        {
+            total = TRANSFER_DISK_ERROR;
+            break;
+        }
+        offset += n;
+        total += n;
+        atomic_store(progress, total);
+    }
+    free(buffer);
+    return total;
+}
+
+// 按配置设置数据连接的 SO_RCVBUF；PASV 时设置在监听套接字上（accept 得到的连接继承它），PORT 时在 connect 之前设置
+void set_data_rcvbuf(int sock, FtpState *state)
+{
+    if (state->rcvbuf > 0 && setsockopt(sock, SOL_SOCKET, SO_RCVBUF, &state->rcvbuf, sizeof(state->rcvbuf)) < 0)
+    {
+        perror("[ERROR] setsockopt SO_RCVBUF");
+    }
+}
+
+// 按 ALLO 给出的大小为即将上传的文件预先分配磁盘空间，减少碎片并提前发现空间不足
+// 使用 FALLOC_FL_KEEP_SIZE，不改变文件长度，上传提前结束时文件不会留下多余的零字节
+// 返回 0 表示成功或不需要/不支持预分配，-1 表示磁盘空间不足
+int preallocate_file(int fd, FtpState *state)
+{
+    long long size = state->alloc_size;
+    state->alloc_size = 0; // ALLO 只对下一次 STOR 有效
+    if (size <= 0)
+    {
+        return 0;
+    }
+    if (fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, (off_t)size) < 0)
+    {
+        if (errno == ENOSPC || errno == EFBIG)
+        {
+            return -1;
+        }
+        // 文件系统不支持预分配时忽略，照常上传
+        perror("[DEBUG] fallocate");
+    }
+    return 0;
+}
+
+// 传输所用的时间（秒）
+double transfer_elapsed(const Transfer *transfer)
+{
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (now.tv_sec - transfer->start.tv_sec) + (now.tv_nsec - transfer->start.tv_nsec) / 1e9;
+}
+
+// 收发数据；被 ABOR 中止时结果一律记为 TRANSFER_ABORTED（shutdown 之后 recv 会像正常结束一样返回 0）
+static void run_transfer(Transfer *transfer)
+{
+    if (transfer->mode_z && transfer->is_upload)
+    {
+        transfer->result = recv_file_inflate(transfer->data_socket, transfer->file_fd, transfer->offset,
+                                             transfer->bufsize, &transfer->bytes, &transfer->wire_bytes);
+    }
+    else if (transfer->mode_z)
+    {
+        transfer->result = send_file_deflate(transfer->data_socket, transfer->file_fd, transfer->offset,
+                                             transfer->z_level, is_compressed_name(transfer->name), &transfer->bytes,
+                                             &transfer->wire_bytes);
+    }
+    else if (transfer->is_upload)
+    {
+        transfer->result = recv_file_data(transfer->data_socket, transfer->file_fd, transfer->offset,
+                                          transfer->bufsize, transfer->use_splice, &transfer->bytes);
+    }
+    else
+    {
+        transfer->result = send_file_data(transfer->data_socket, transfer->file_fd, transfer->offset, &transfer->bytes);
+    }
+
+    if (atomic_load(&transfer->aborted))
+    {
+        transfer->result = TRANSFER_ABORTED;
+    }
+    else if (transfer->result == TRANSFER_DISK_ERROR)
+    {
+        perror("[ERROR] write");
+    }
+    else if (transfer->result < 0)
+    {
+        perror(transfer->is_upload ? "[ERROR] recv" : "[ERROR] send");
+    }
+    else if (!transfer->is_upload)
+    {
+        shutdown(transfer->data_socket, SHUT_WR);
+    }
+}
+
+static void *transfer_thread(void *arg)
+{
+    Transfer *transfer = (Transfer *)arg;
+    char done = 1;
+    run_transfer(transfer);
+    // 通知会话循环：传输已经结束，可以回复并回收线程
+    while (write(transfer->done_pipe[1], &done, 1) < 0 && errno == EINTR)
+    {
+    }
+    return NULL;
+}
+
+// 在后台线程中开始 RETR（file 为 NULL，fd 为打开的文件）或 STOR（file 为 fopen 打开并已加锁的文件）
+// 数据连接已经建立并且已经回复了 150；传输结束后由 finish_transfer 回复 226/426/552 并释放资源
+void start_transfer(int clientSocket, FtpState *state, int dataSocket, int fd, FILE *file, off_t offset, const char *name)
+{
+    Transfer *transfer = &state->transfer;
+    struct stat st;
+
+    transfer->active = 1;
+    transfer->threaded = 0;
+    transfer->is_upload = file != NULL;
+    transfer->data_socket = dataSocket;
+    transfer->file_fd = fd;
+    transfer->file = file;
+    transfer->offset = offset;
+    transfer->size = (file == NULL && fstat(fd, &st) == 0) ? (long long)st.st_size : -1;
+    transfer->bufsize = state->io_bufsize;
+    transfer->use_splice = state->use_splice;
+    transfer->mode_z = state->mode_z;
+    transfer->z_level = state->z_level;
+    snprintf(transfer->name, sizeof(transfer->name), "%s", name);
+    atomic_store(&transfer->bytes, 0);
+    atomic_store(&transfer->wire_bytes, 0);
+    atomic_store(&transfer->aborted, 0);
+    transfer->result = 0;
+    clock_gettime(CLOCK_MONOTONIC, &transfer->start);
+    state->is_transferring = 1;
+
+    if ((transfer->done_pipe[0] >= 0 || pipe(transfer->done_pipe) == 0) &&
+        pthread_create(&transfer->thread, NULL, transfer_thread, transfer) == 0)
+    {
+        transfer->threaded = 1;
+        printf("[DEBUG] Started %s of %s in background\n", transfer->is_upload ? "STOR" : "RETR", transfer->name);
+        return;
+    }
+
+    // 无法创建线程时在当前线程中完成传输，与原来的同步传输相同（期间不能处理 ABOR）
+    perror("[ERROR] pthread_create");
+    run_transfer(transfer);
+    finish_transfer(clientSocket, state);
+}
+
+// 等待传输结束，回复传输结果并关闭文件和数据连接；没有进行中的传输时什么也不做
+void finish_transfer(int clientSocket, FtpState *state)
+{
+    Transfer *transfer = &state->transfer;
+    if (!transfer->active)
+    {
+        return;
+    }
+
+    if (transfer->threaded)
+    {
+        char done;
+        // 正常结束时会话循环在 done_pipe 可读后才调用这里，不会阻塞；ABOR 时线程在 shutdown 后很快返回
+        while (read(transfer->done_pipe[0], &done, 1) < 0 && errno == EINTR)
+        {
+        }
+        pthread_join(transfer->thread, NULL);
+        transfer->threaded = 0;
+    }
+
+    if (transfer->result == TRANSFER_DISK_ERROR)
+    {
+        send(clientSocket, "552 Requested file action aborted. Exceeded storage allocation.\r\n", 65, 0);
+    }
+    else if (transfer->result < 0)
+    {
+        send(clientSocket, "426 Connection closed; transfer aborted.\r\n", 42, 0);
+    }
+    else
+    {
+        send(clientSocket, "226 Transfer complete.\r\n", 24, 0);
+    }
+    printf("[DEBUG] %s of %s finished: %lld bytes in %.3f s, result %lld\n", transfer->is_upload ? "STOR" : "RETR",
+           transfer->name, (long long)atomic_load(&transfer->bytes), transfer_elapsed(transfer), transfer->result);
+    if (transfer->mode_z)
+    {
+        long long bytes = atomic_load(&transfer->bytes);
+        long long wire = atomic_load(&transfer->wire_bytes);
+        printf("[DEBUG] MODE Z: %lld bytes on the data connection (%.1f%% of the original)\n", wire,
+               bytes > 0 ? wire * 100.0 / bytes : 0.0);
+    }
+
+    if (transfer->file != NULL)
+    {
+        flock(transfer->file_fd, LOCK_UN);
+        fclose(transfer->file);
+    }
+    else
+    {
+        close(transfer->file_fd);
+    }
+    close(transfer->data_socket);
+    transfer->file = NULL;
+    transfer->active = 0;
+    state->is_transferring = 0;
+}
+
+// 请求中止正在进行的传输：关闭数据连接，阻塞在 sendfile/recv/splice 中的传输线程立即返回
+// 之后由调用者调用 finish_transfer 回收线程并回复 426
+void abort_transfer(FtpState *state)
+{
+    Transfer *transfer = &state->transfer;
+    if (!transfer->active)
+    {
+        return;
+    }
+    atomic_store(&transfer->aborted, 1);
+    shutdown(transfer->data_socket, SHUT_RDWR);
+}
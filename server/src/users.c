@@ -0,0 +1,380 @@
+#include "server.h"
+#include <crypt.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <limits.h>
+#include <openssl/crypto.h>
+#include <openssl/evp.h>
+
+// 内存中的用户表：用户名 -> 密码（散列表，链地址法）
+// 启动时从用户文件加载，之后每次登录只在内存中查找：
+// - 同一个文件变长时视为在末尾追加了新用户，只读取新增的部分；
+// - 文件被替换（inode 变化）、变短、大小不变但修改时间变化，或收到 SIGHUP 时重新加载整个文件。
+// 新用户的密码以加盐的 SHA-512 crypt 格式（"$6$salt$hash"）保存，旧文件中的明文密码仍然可以登录。
+// Python 服务器在没有 crypt 模块时写入的 PBKDF2 格式（"$pbkdf2-sha512$轮数$盐$散列"）也可以登录。
+
+#define PBKDF2_PREFIX "$pbkdf2-sha512$"
+#define PBKDF2_DIGEST_SIZE 64
+
+typedef struct UserEntry
+{
+    char *username;
+    char *password; // 明文（旧记录）或 crypt 格式的散列
+    struct UserEntry *next;
+} UserEntry;
+
+static UserEntry **buckets = NULL;
+static size_t bucket_count = 0;
+static size_t user_count = 0;
+
+static char user_db_path[MAXSIZE] = USER_DB_FILE;
+static struct stat loaded_stat; // 上次加载时文件的状态，用于判断文件是否变化
+static off_t loaded_size = 0;   // 已经读取到的文件偏移（只处理完整的行）
+static int loaded = 0;
+static volatile sig_atomic_t reload_requested = 0;
+
+// FNV-1a 散列
+static size_t hash_name(const char *name)
+{
+    size_t hash = 14695981039346656037ULL;
+    while (*name)
+    {
+        hash ^= (unsigned char)*name++;
+        hash *= 1099511628211ULL;
+    }
+    return hash;
+}
+
+static UserEntry *find_user(const char *username)
+{
+    if (bucket_count == 0)
+    {
+        return NULL;
+    }
+    UserEntry *entry = buckets[hash_name(username) & (bucket_count - 1)];
+    while (entry != NULL && strcmp(entry->username, username) != 0)
+    {
+        entry = entry->next;
+    }
+    return entry;
+}
+
+static void free_users(void)
+{
+    for (size_t i = 0; i < bucket_count; i++)
+    {
+        UserEntry *entry = buckets[i];
+        while (entry != NULL)
+        {
+            UserEntry *next = entry->next;
+            free(entry->username);
+            free(entry->password);
+            free(entry);
+            entry = next;
+        }
+    }
+    free(buckets);
+    buckets = NULL;
+    bucket_count = 0;
+    user_count = 0;
+}
+
+// 负载因子超过 0.75 时把桶的数量翻倍
+static int grow_buckets(void)
+{
+    size_t new_count = bucket_count == 0 ? 1024 : bucket_count * 2;
+    UserEntry **new_buckets = (UserEntry **)calloc(new_count, sizeof(UserEntry *));
+    if (new_buckets == NULL)
+    {
+        return -1;
+    }
+    for (size_t i = 0; i < bucket_count; i++)
+    {
+        UserEntry *entry = buckets[i];
+        while (entry != NULL)
+        {
+            UserEntry *next = entry->next;
+            size_t index = hash_name(entry->username) & (new_count - 1);
+            entry->next = new_buckets[index];
+            new_buckets[index] = entry;
+            entry = next;
+        }
+    }
+    free(buckets);
+    buckets = new_buckets;
+    bucket_count = new_count;
+    return 0;
+}
+
+// 加入一个用户；同名用户以文件中的第一条记录为准，与原来逐行查找的结果一致
+static void insert_user(const char *username, const char *password)
+{
+    if (find_user(username) != NULL)
+    {
+        return;
+    }
+    if ((user_count + 1) * 4 > bucket_count * 3 && grow_buckets() < 0)
+    {
+        return;
+    }
+    UserEntry *entry = (UserEntry *)malloc(sizeof(UserEntry));
+    if (entry == NULL)
+    {
+        return;
+    }
+    entry->username = strdup(username);
+    entry->password = strdup(password);
+    if (entry->username == NULL || entry->password == NULL)
+    {
+        free(entry->username);
+        free(entry->password);
+        free(entry);
+        return;
+    }
+    size_t index = hash_name(username) & (bucket_count - 1);
+    entry->next = buckets[index];
+    buckets[index] = entry;
+    user_count++;
+}
+
+// 解析一行 "用户名:密码"，密码到第一个空白字符为止
+static void parse_user_line(char *line)
+{
+    char *sep = strchr(line, ':');
+    if (sep == NULL || sep == line)
+    {
+        return;
+    }
+    *sep = '\0';
+    char *password = sep + 1;
+    password[strcspn(password, " \t\r\n")] = '\0';
+    insert_user(line, password);
+}
+
+// 从 offset 开始读取文件中的完整行并加入用户表，返回读取到的位置（最后一个换行符之后）
+static off_t load_from(int fd, off_t offset)
+{
+    char buffer[65536];
+    char line[1024];
+    size_t line_len = 0;
+    off_t position = offset;
+    off_t consumed = offset;
+    ssize_t n;
+
+    while ((n = pread(fd, buffer, sizeof(buffer), position)) > 0)
+    {
+        for (ssize_t i = 0; i < n; i++)
+        {
+            if (buffer[i] == '\n')
+            {
+                line[line_len] = '\0';
+                parse_user_line(line);
+                line_len = 0;
+                consumed = position + i + 1;
+            }
+            else if (line_len < sizeof(line) - 1)
+            {
+                line[line_len++] = buffer[i];
+            }
+        }
+        position += n;
+    }
+    // 没有换行符结尾的最后一行可能是其他进程正在写入的记录，等下次写完后再读取
+    return consumed;
+}
+
+// 检查用户文件是否变化，需要时重新加载；返回当前的用户数
+size_t users_refresh(void)
+{
+    struct stat st;
+    if (stat(user_db_path, &st) < 0)
+    {
+        // 文件不存在表示没有任何用户
+        if (loaded && loaded_stat.st_ino != 0)
+        {
+            free_users();
+        }
+        memset(&loaded_stat, 0, sizeof(loaded_stat));
+        loaded_size = 0;
+        loaded = 1;
+        reload_requested = 0;
+        return user_count;
+    }
+
+    int same_file = loaded && st.st_ino == loaded_stat.st_ino && st.st_dev == loaded_stat.st_dev;
+    if (same_file && !reload_requested && st.st_size == loaded_stat.st_size &&
+        st.st_mtim.tv_sec == loaded_stat.st_mtim.tv_sec && st.st_mtim.tv_nsec == loaded_stat.st_mtim.tv_nsec)
+    {
+        return user_count; // 没有变化
+    }
+
+    int fd = open(user_db_path, O_RDONLY);
+    if (fd < 0)
+    {
+        perror("[ERROR] Failed to open user database");
+        return user_count;
+    }
+    if (same_file && !reload_requested && st.st_size > loaded_stat.st_size)
+    {
+        // 同一个文件变长了，视为在末尾追加了新用户：从上次读到的位置继续
+        loaded_size = load_from(fd, loaded_size);
+    }
+    else
+    {
+        free_users();
+        loaded_size = load_from(fd, 0);
+        printf("[DEBUG] Loaded %zu users from %s\n", user_count, user_db_path);
+    }
+    close(fd);
+    loaded_stat = st;
+    loaded = 1;
+    reload_requested = 0;
+    return user_count;
+}
+
+// 设置用户文件的路径并加载
+void users_init(const char *path)
+{
+    if (path != NULL)
+    {
+        strncpy(user_db_path, path, sizeof(user_db_path) - 1);
+        user_db_path[sizeof(user_db_path) - 1] = '\0';
+    }
+    free_users();
+    loaded = 0;
+    users_refresh();
+}
+
+// 请求在下一次查找前重新加载整个文件（可以在信号处理函数中调用）
+void users_request_reload(void)
+{
+    reload_requested = 1;
+}
+
+// 生成 SHA-512 crypt 的盐 "$6$<16 个字符>$"
+static int make_salt(char *salt, size_t size)
+{
+    static const char alphabet[] = "./0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz";
+    unsigned char random_bytes[16];
+    int fd = open("/dev/urandom", O_RDONLY);
+    if (fd < 0 || read(fd, random_bytes, sizeof(random_bytes)) != sizeof(random_bytes))
+    {
+        if (fd >= 0)
+        {
+            close(fd);
+        }
+        return -1;
+    }
+    close(fd);
+    if (size < 4 + sizeof(random_bytes) + 2)
+    {
+        return -1;
+    }
+    strcpy(salt, "$6$");
+    for (size_t i = 0; i < sizeof(random_bytes); i++)
+    {
+        salt[3 + i] = alphabet[random_bytes[i] % 64];
+    }
+    strcpy(salt + 3 + sizeof(random_bytes), "$");
+    return 0;
+}
+
+// 验证 PBKDF2 格式的散列 "$pbkdf2-sha512$轮数$盐（十六进制）$散列（十六进制）"，匹配时返回 1
+static int check_pbkdf2(const char *password, const char *stored)
+{
+    unsigned long rounds;
+    char salt_hex[129];
+    char digest_hex[2 * PBKDF2_DIGEST_SIZE + 2];
+    unsigned char salt[64];
+    unsigned char digest[PBKDF2_DIGEST_SIZE];
+    char computed[2 * PBKDF2_DIGEST_SIZE + 1];
+
+    const char *fields = stored + strlen(PBKDF2_PREFIX);
+    int end = 0;
+    if (sscanf(fields, "%lu$%128[0-9a-f]$%129[0-9a-f]%n", &rounds, salt_hex, digest_hex, &end) != 3 ||
+        fields[end] != '\0' || rounds == 0 || rounds > INT_MAX || strlen(salt_hex) % 2 != 0 || strlen(digest_hex) != 2 * PBKDF2_DIGEST_SIZE)
+    {
+        return 0;
+    }
+    size_t salt_len = strlen(salt_hex) / 2;
+    for (size_t i = 0; i < salt_len; i++)
+    {
+        unsigned int byte;
+        sscanf(salt_hex + 2 * i, "%2x", &byte);
+        salt[i] = (unsigned char)byte;
+    }
+    if (PKCS5_PBKDF2_HMAC(password, strlen(password), salt, salt_len, (int)rounds, EVP_sha512(),
+                          sizeof(digest), digest) != 1)
+    {
+        return 0;
+    }
+    for (size_t i = 0; i < sizeof(digest); i++)
+    {
+        snprintf(computed + 2 * i, 3, "%02x", digest[i]);
+    }
+    return CRYPTO_memcmp(computed, digest_hex, sizeof(computed) - 1) == 0 ? 1 : 0;
+}
+
+// 检查用户名和密码：返回 1 表示匹配，0 表示密码错误，-1 表示用户不存在
+int check_user_credentials(const char *username, const char *password)
+{
+    users_refresh();
+    UserEntry *entry = find_user(username);
+    if (entry == NULL)
+    {
+        return -1; // 用户不存在
+    }
+    if (strncmp(entry->password, PBKDF2_PREFIX, strlen(PBKDF2_PREFIX)) == 0)
+    {
+        return check_pbkdf2(password, entry->password);
+    }
+    if (entry->password[0] == '$')
+    {
+        // crypt 格式：用保存的散列中的算法和盐重新计算
+        const char *hashed = crypt(password, entry->password);
+        return hashed != NULL && strcmp(hashed, entry->password) == 0 ? 1 : 0;
+    }
+    return strcmp(password, entry->password) == 0 ? 1 : 0; // 旧文件中的明文密码
+}
+
+// 保存新用户信息：密码加盐散列后追加到用户文件，并加入内存中的用户表
+int save_new_user(const char *username, const char *password)
+{
+    char salt[32];
+    char record[MAXSIZE];
+    if (strchr(username, ':') != NULL || make_salt(salt, sizeof(salt)) < 0)
+    {
+        return 0;
+    }
+    const char *hashed = crypt(password, salt);
+    if (hashed == NULL || hashed[0] != '$')
+    {
+        perror("[ERROR] crypt");
+        return 0;
+    }
+    int len = snprintf(record, sizeof(record), "%s:%s\n", username, hashed);
+    if (len < 0 || len >= (int)sizeof(record))
+    {
+        return 0;
+    }
+
+    // O_APPEND 加上一次 write 写完整行，多个进程同时注册时记录不会交错
+    int fd = open(user_db_path, O_WRONLY | O_APPEND | O_CREAT, 0600);
+    if (fd < 0)
+    {
+        perror("[ERROR] Failed to open user database for writing");
+        return 0;
+    }
+    ssize_t written = write(fd, record, len);
+    close(fd);
+    if (written != len)
+    {
+        perror("[ERROR] Failed to write user database");
+        return 0;
+    }
+
+    // 读取文件新增的部分（包括刚写入的这一行和其他进程追加的用户）
+    users_refresh();
+    insert_user(username, hashed);
+    return 1;
+}